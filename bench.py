@@ -0,0 +1,610 @@
+# bench.py
+"""离屏性能基准：界面启动、日志插入、终端输出解析、TCP和本地套接字触发、并发客户端负载、进程启动开销、请求体传输和长时间输出的内存增长。
+
+用法：
+  python bench.py                   运行全部基准，并与 bench_baseline.json 比较
+  python bench.py startup tcp       只运行指定的基准
+  python bench.py --repeat 3        每个基准运行3次，取最好的结果（降低噪声）
+  python bench.py --save-baseline   运行并把结果保存为新的基线
+  python bench.py --threshold 0.3   指标比基线差30%以上判为退化（默认25%）
+  python bench.py tcp_concurrent --clients 200   并发负载基准只用200个客户端
+
+每个基准在单独的子进程中运行，使用临时目录中生成的配置，不会用到config.py中的脚本；
+界面基准使用Qt的offscreen平台，不需要显示器。存在退化时退出码为1。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+import tempfile
+import asyncio
+import functools
+from pathlib import Path
+
+from daemon_client import DaemonClient, DaemonError
+
+CURRENT_SCRIPT_DIR = Path(__file__).parent
+BASELINE_FILE = CURRENT_SCRIPT_DIR / "bench_baseline.json"
+DEFAULT_THRESHOLD = 0.25 # 比基线差超过此比例判为退化
+CHILD_TIMEOUT = 600      # 单个基准子进程的最长运行时间（秒）
+DAEMON_START_TIMEOUT = 20
+
+STARTUP_SCRIPT_COUNTS = (10, 100, 300) # 界面启动基准中配置的脚本数量，每种数量单独测量
+INSERT_CHUNK_CHARS = 4096       # 每次插入界面的文本长度，相当于一次合并刷新
+INSERT_TOTAL_CHARS = 1_000_000  # 日志插入基准的总字符数
+PROGRESS_UPDATES = 5000         # 进度条('\r')基准的刷新次数
+PARSE_UPDATES = 200_000         # 终端输出解析基准中进度条的刷新次数
+MEMORY_LINES = 200_000          # 内存增长基准输出的总行数
+MEMORY_WARMUP_LINES = 40_000    # 达到回滚上限后才开始计算内存增长
+PING_COUNT = 1000
+TRIGGER_COUNT = 5000
+TRIGGER_BATCH = 500
+CONCURRENT_CLIENTS = 1000       # 并发负载基准的客户端数量（--clients）
+CONCURRENT_TRIGGERS = 50        # 并发负载基准中每个客户端流水线发送的TRIGGER数量
+CONCURRENT_LEGACY_TRIGGERS = 5  # 并发负载基准中每个旧协议客户端的触发次数，每次一条连接
+RUN_COUNT = 20
+WARM_RUN_COUNT = 10
+WARM_REFILL_WAIT = 1.0          # 两次预热运行之间等待预热池补充的时间（秒）
+PAYLOAD_MB = 64                 # 请求体基准每次发送的数据量（MB）
+PAYLOAD_RUNS = 3
+
+# 指标名 -> (单位, 是否越大越好, 忽略的绝对差值, 说明)
+METRICS = {
+    **{f'startup_{count}_seconds': ('s', False, 0.05, f"界面启动（{count}个脚本，含导入）") for count in STARTUP_SCRIPT_COUNTS},
+    **{f'startup_{count}_rss_mb': ('MB', False, 5, f"界面启动后的常驻内存（{count}个脚本）") for count in STARTUP_SCRIPT_COUNTS},
+    'insert_ascii_chars_per_s': ('字符/s', True, 0, "插入ASCII日志"),
+    'insert_cjk_chars_per_s':   ('字符/s', True, 0, "插入中英混合日志"),
+    'insert_cr_updates_per_s':  ('次/s', True, 0, "进度条行内刷新"),
+    'parse_cr_mb_per_s':        ('MB/s', True, 0, "解析进度条终端输出"),
+    'parse_ansi_mb_per_s':      ('MB/s', True, 0, "解析带颜色代码的终端输出"),
+    'memory_growth_mb':         ('MB', False, 5, f"回滚上限后再输出{MEMORY_LINES - MEMORY_WARMUP_LINES}行的内存增长"),
+    'memory_rss_mb':            ('MB', False, 5, "长时间输出后的常驻内存"),
+    'ping_p50_ms':              ('ms', False, 0.1, "PING往返延迟中位数"),
+    'ping_p95_ms':              ('ms', False, 0.2, "PING往返延迟P95"),
+    'trigger_p50_ms':           ('ms', False, 0.1, "TRIGGER往返延迟中位数"),
+    'trigger_per_s':            ('次/s', True, 0, "流水线TRIGGER吞吐量"),
+    'concurrent_trigger_per_s': ('次/s', True, 0, f"并发客户端（默认{CONCURRENT_CLIENTS}个）各流水线{CONCURRENT_TRIGGERS}条TRIGGER的吞吐量"),
+    'concurrent_legacy_per_s':  ('次/s', True, 0, f"并发旧协议客户端（默认{CONCURRENT_CLIENTS}个，每次触发一条连接）的吞吐量"),
+    'local_ping_p50_ms':        ('ms', False, 0.1, "本地套接字PING往返延迟中位数"),
+    'local_ping_p95_ms':        ('ms', False, 0.2, "本地套接字PING往返延迟P95"),
+    'local_trigger_p50_ms':     ('ms', False, 0.1, "本地套接字TRIGGER往返延迟中位数"),
+    'local_trigger_per_s':      ('次/s', True, 0, "本地套接字流水线TRIGGER吞吐量"),
+    'run_cold_p50_ms':          ('ms', False, 5, "RUN空脚本往返中位数（冷启动）"),
+    'run_warm_p50_ms':          ('ms', False, 5, "RUN空脚本往返中位数（预热解释器）"),
+    'spawn_cold_ms':            ('ms', False, 2, "触发到进程启动的延迟中位数（冷启动）"),
+    'spawn_warm_ms':            ('ms', False, 2, "触发到进程启动的延迟中位数（预热解释器）"),
+    'payload_mb_per_s':         ('MB/s', True, 0, f"RUN带{PAYLOAD_MB}MB请求体写入脚本标准输入"),
+    'payload_daemon_rss_mb':    ('MB', False, 5, "传输请求体期间守护程序的峰值常驻内存"),
+}
+
+
+# ---------------------------------------------------------------------------
+# 公共工具
+# ---------------------------------------------------------------------------
+
+def current_rss_mb():
+    """返回本进程当前的常驻内存（MB）；没有/proc时退回到峰值内存。"""
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def peak_rss_mb(pid):
+    """返回指定进程的峰值常驻内存（MB），没有/proc时返回None。"""
+    try:
+        with open(f'/proc/{pid}/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def chunked(text, size=INSERT_CHUNK_CHARS):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def ascii_log(total):
+    lines, length, i = [], 0, 0
+    while length < total:
+        line = f"2024-05-01 12:{i // 60 % 60:02d}:{i % 60:02d} INFO worker-{i % 8} processed item {i} in {i % 997} ms\n"
+        lines.append(line)
+        length += len(line)
+        i += 1
+    return "".join(lines)
+
+
+def cjk_log(total):
+    lines, length, i = [], 0, 0
+    while length < total:
+        line = f"[{i}] 处理文件 数据_{i}.csv 完成，耗时 {i % 997} 毫秒，status=ok 共{i % 50}条记录\n"
+        lines.append(line)
+        length += len(line)
+        i += 1
+    return "".join(lines)
+
+
+def progress_bar(i, total):
+    percent = i * 100 // total
+    return f"下载中 {percent:3d}%|{'#' * (percent * 40 // 100):<40}| {i}/{total} [00:{i % 60:02d}<00:10, 512.00it/s]"
+
+
+def generate_configs(root):
+    """在root下生成界面基准和守护程序基准使用的配置。
+
+    返回(脚本数量 -> 界面配置目录, 守护程序配置目录, 端口)。守护程序同时监听守护程序配置目录下的daemon.sock。
+    """
+    scripts_dir = root / "scripts"
+    scripts_dir.mkdir()
+    gui_scripts = []
+    for i in range(max(STARTUP_SCRIPT_COUNTS)):
+        path = scripts_dir / f"noop_{i}.py"
+        path.write_text("pass\n")
+        gui_scripts.append({"name": f"脚本{i}", "script": str(path), "msg": f"BENCH_{i}".encode()})
+    (scripts_dir / "noop_warm.py").write_text("pass\n")
+    (scripts_dir / "hold.py").write_text("import time\ntime.sleep(2)\n")
+    (scripts_dir / "sink.py").write_text("import sys\nwhile sys.stdin.buffer.read(1 << 20):\n    pass\n")
+    daemon_scripts = [
+        {"name": "noop", "script": str(scripts_dir / "noop_0.py"), "msg": b"BENCH_NOOP", "policy": "queue"},
+        {"name": "noop_warm", "script": str(scripts_dir / "noop_warm.py"), "msg": b"BENCH_WARM", "policy": "queue", "warm_workers": 1},
+        {"name": "hold", "script": str(scripts_dir / "hold.py"), "msg": b"BENCH_HOLD", "policy": "coalesce"},
+        {"name": "sink", "script": str(scripts_dir / "sink.py"), "msg": b"BENCH_SINK", "policy": "queue"},
+    ]
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    def write_config(name, scripts, enable_server):
+        workdir = root / name
+        workdir.mkdir()
+        local_socket = str(workdir / "daemon.sock") if enable_server else None
+        (workdir / "config.py").write_text(
+            f"HOST = '127.0.0.1'\nPORT = {port}\nENABLE_TCP_SERVER = {enable_server}\nLOCAL_SOCKET = {local_socket!r}\n"
+            f"LOG_DIR = {str(workdir / 'logs')!r}\nSCRIPTS_CONFIG = {scripts!r}\n", encoding='utf-8')
+        return workdir
+
+    gui_dirs = {count: write_config(f"gui_{count}", gui_scripts[:count], False) for count in STARTUP_SCRIPT_COUNTS}
+    return gui_dirs, write_config("daemon", daemon_scripts, True), port
+
+
+def use_config(workdir):
+    """让之后的 import config 读取生成的配置，必须在导入daemon_core/gui之前调用。"""
+    sys.path.insert(0, str(workdir))
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+# ---------------------------------------------------------------------------
+# 子进程中运行的基准
+# ---------------------------------------------------------------------------
+
+def create_window():
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    from gui import MainWindow
+    window = MainWindow()
+    window.show()
+    app.processEvents()
+    return app, window
+
+
+def insert_rate(app, window, messages):
+    """依次插入messages，每条之后处理一次事件（相当于一次合并刷新），返回耗时（秒）。"""
+    script_id = next(iter(window.tabs_info))
+    window.tabs_info[script_id]['log_display'].clear()
+    app.processEvents()
+    started = time.perf_counter()
+    for message in messages:
+        window.append_log_message(script_id, message)
+        app.processEvents()
+    return time.perf_counter() - started
+
+
+def bench_startup(started):
+    app, window = create_window()
+    result = {'startup_seconds': time.perf_counter() - started, 'startup_rss_mb': current_rss_mb()}
+    window.quit_application()
+    return result
+
+
+def bench_insert(started):
+    app, window = create_window()
+    ascii_text = ascii_log(INSERT_TOTAL_CHARS)
+    cjk_text = cjk_log(INSERT_TOTAL_CHARS)
+    progress = []
+    for i in range(1, PROGRESS_UPDATES + 1):
+        # 每100次刷新完成一行，和tqdm的多个进度条依次结束类似
+        progress.append('\r' + progress_bar(i % 100 or 100, 100) + ('\n' if i % 100 == 0 else ''))
+    result = {
+        'insert_ascii_chars_per_s': len(ascii_text) / insert_rate(app, window, chunked(ascii_text)),
+        'insert_cjk_chars_per_s': len(cjk_text) / insert_rate(app, window, chunked(cjk_text)),
+        'insert_cr_updates_per_s': PROGRESS_UPDATES / insert_rate(app, window, progress),
+    }
+    window.quit_application()
+    return result
+
+
+# 解析基准之前先检查的输入：(分批送入的文本, 界面上应得到的文本)
+PARSE_CASES = [
+    (['abc\x1b(B', 'def\n'], 'abcdef\n'),                  # tput sgr0 输出的 ESC ( B，位于批次末尾
+    (['hello \x1b(B\x1b[mworld\n'], 'hello world\n'),
+    (['a\x1b7b\x1b8c\n'], 'abc\n'),                          # 保存/恢复光标
+    (['x\x1b=y\x1b>z\n'], 'xyz\n'),                          # 小键盘模式
+    (['a\x1b', '(Bb\n'], 'ab\n'),                             # 在ESC之后拆开
+    (['a\x1b[3', '1mred\x1b[0m\n'], 'ared\n'),
+    (['t\x1b]0;x\x1b', '\\ok\n'], 'tok\n'),                  # OSC在结束符ESC \\中间拆开
+    (['p 10%\r\x1b[Kp 20%\n'], 'p 20%\n'),
+]
+
+
+def bench_parse(started):
+    from daemon_core import TerminalStream
+
+    for chunks, expected in PARSE_CASES:
+        stream = TerminalStream()
+        outputs = [stream.feed(chunk) for chunk in chunks]
+        if ''.join(outputs) != expected: # 不等到进程退出，送入最后一批时就应该全部显示
+            raise RuntimeError(f"终端输出解析错误: {chunks!r} 得到 {outputs!r}，应为 {expected!r}")
+
+    def rate(text):
+        stream = TerminalStream()
+        chunks = chunked(text)
+        begin = time.perf_counter()
+        for chunk in chunks:
+            stream.feed(chunk)
+        stream.feed('', final=True)
+        return len(text.encode('utf-8')) / (time.perf_counter() - begin) / 1e6
+
+    progress = "".join('\r' + progress_bar(i % 1000, 1000) + ('\n' if i % 1000 == 0 else '') for i in range(1, PARSE_UPDATES + 1))
+    colored = "".join(f"\x1b[32m{line}\x1b[0m\n" if i % 3 else f"\x1b[1;31m{line}\x1b[K\n"
+                      for i, line in enumerate(ascii_log(INSERT_TOTAL_CHARS * 4).splitlines()))
+    return {'parse_cr_mb_per_s': rate(progress), 'parse_ansi_mb_per_s': rate(colored)}
+
+
+def bench_memory(started):
+    app, window = create_window()
+    script_id = next(iter(window.tabs_info))
+    line = "memory benchmark line {:>8} " + "x" * 30 + "\n"
+    lines_per_chunk = INSERT_CHUNK_CHARS // len(line.format(0))
+    baseline = None
+    for start in range(0, MEMORY_LINES, lines_per_chunk):
+        if baseline is None and start >= MEMORY_WARMUP_LINES:
+            baseline = current_rss_mb()
+        window.append_log_message(script_id, "".join(line.format(i) for i in range(start, start + lines_per_chunk)))
+        app.processEvents()
+    rss = current_rss_mb()
+    window.quit_application()
+    return {'memory_growth_mb': rss - baseline, 'memory_rss_mb': rss}
+
+
+CHILD_BENCHMARKS = {
+    'startup': bench_startup,
+    'insert': bench_insert,
+    'parse': bench_parse,
+    'memory': bench_memory,
+}
+
+
+def child_main(name, workdir):
+    started = time.perf_counter()
+    use_config(workdir)
+    result = CHILD_BENCHMARKS[name](started)
+    print(json.dumps(result), flush=True)
+    return 0
+
+
+def daemon_main(workdir):
+    use_config(workdir)
+    import headless
+    return headless.main([sys.argv[0], "--quiet"])
+
+
+# ---------------------------------------------------------------------------
+# 通过TCP测量的基准（守护程序在子进程中运行）
+# ---------------------------------------------------------------------------
+
+def start_daemon(workdir, port):
+    process = subprocess.Popen([sys.executable, str(Path(__file__).absolute()), "--daemon", str(workdir)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    client = DaemonClient(port=port, timeout=5)
+    while True:
+        try:
+            client.ping()
+            return process, client
+        except DaemonError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"守护程序启动失败: {process.communicate()[1].strip()}")
+            time.sleep(0.1)
+
+
+def stop_daemon(process, client):
+    client.close()
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def timed_runs(client, message, count, pause=0.0):
+    latencies = []
+    for _ in range(count):
+        if pause:
+            time.sleep(pause)
+        begin = time.perf_counter()
+        client.run(message, timeout=30)
+        latencies.append((time.perf_counter() - begin) * 1000)
+    return latencies
+
+
+def median_spawn_ms(client, message):
+    history = next(iter(client.stats(message).values()))['history']
+    return percentile([run['spawn_latency'] for run in history if run['spawn_latency'] is not None], 0.5) * 1000
+
+
+def round_trips_ms(call, count):
+    latencies = []
+    for _ in range(count):
+        begin = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - begin) * 1000)
+    return latencies
+
+
+def transport_metrics(client):
+    """测量PING和单条TRIGGER的往返延迟，以及流水线TRIGGER的吞吐量。"""
+    pings = round_trips_ms(client.ping, PING_COUNT)
+    triggers = round_trips_ms(lambda: client.trigger("BENCH_HOLD"), PING_COUNT) # hold合并重复触发，不会启动大量进程
+    begin = time.perf_counter()
+    for _ in range(TRIGGER_COUNT // TRIGGER_BATCH):
+        replies = client.trigger_many(["BENCH_HOLD"] * TRIGGER_BATCH)
+        if any(status != 'OK' for status, _ in replies):
+            raise RuntimeError(f"TRIGGER失败: {replies[0]}")
+    elapsed = time.perf_counter() - begin
+    return {'ping_p50_ms': percentile(pings, 0.5), 'ping_p95_ms': percentile(pings, 0.95),
+            'trigger_p50_ms': percentile(triggers, 0.5), 'trigger_per_s': TRIGGER_COUNT / elapsed}
+
+
+def bench_tcp(workdir, port):
+    process, client = start_daemon(workdir, port)
+    try:
+        return transport_metrics(client)
+    finally:
+        stop_daemon(process, client)
+
+
+async def concurrent_load(port, clients):
+    """clients个客户端同时连接：先各自在一条连接上流水线发送TRIGGER，再用旧协议每次触发一条连接，返回两者的吞吐量。"""
+    # 直接读写流而不用AsyncDaemonClient：客户端与守护程序共用CPU，客户端的开销越小，测到的越接近服务器本身
+    async def framed_client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            writer.write(b"".join(b"#%d TRIGGER BENCH_HOLD\n" % i for i in range(CONCURRENT_TRIGGERS)))
+            for _ in range(CONCURRENT_TRIGGERS):
+                line = await asyncio.wait_for(reader.readline(), 60)
+                if line.split(b' ', 2)[1:2] != [b'OK']:
+                    raise RuntimeError(f"TRIGGER失败: {line.decode('utf-8', 'replace').strip()!r}")
+        finally:
+            writer.close()
+
+    async def legacy_client():
+        for _ in range(CONCURRENT_LEGACY_TRIGGERS):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                writer.write(b"BENCH_HOLD")
+                reply = await asyncio.wait_for(reader.read(), 60)
+            finally:
+                writer.close()
+            if not reply.startswith("确认".encode('utf-8')):
+                raise RuntimeError(f"旧协议触发失败: {reply.decode('utf-8', 'replace').strip()!r}")
+
+    results = {}
+    for metric, client, count in (('concurrent_trigger_per_s', framed_client, CONCURRENT_TRIGGERS),
+                                  ('concurrent_legacy_per_s', legacy_client, CONCURRENT_LEGACY_TRIGGERS)):
+        begin = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        results[metric] = clients * count / (time.perf_counter() - begin)
+    return results
+
+
+def raise_open_files_limit(needed):
+    """并发客户端需要大量文件描述符，尽量提高本进程的软限制（守护程序子进程会继承）。"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def bench_tcp_concurrent(workdir, port, clients=CONCURRENT_CLIENTS):
+    raise_open_files_limit(clients * 2 + 256)
+    process, client = start_daemon(workdir, port)
+    try:
+        return asyncio.run(concurrent_load(port, clients))
+    finally:
+        stop_daemon(process, client)
+
+
+def bench_local(workdir, port):
+    process, client = start_daemon(workdir, port)
+    local_client = DaemonClient(path=workdir / "daemon.sock", timeout=5)
+    try:
+        return {f'local_{metric}': value for metric, value in transport_metrics(local_client).items()}
+    finally:
+        local_client.close()
+        stop_daemon(process, client)
+
+
+def bench_spawn(workdir, port):
+    process, client = start_daemon(workdir, port)
+    try:
+        time.sleep(WARM_REFILL_WAIT) # 等预热解释器就绪
+        cold = timed_runs(client, "BENCH_NOOP", RUN_COUNT)
+        warm = timed_runs(client, "BENCH_WARM", WARM_RUN_COUNT, pause=WARM_REFILL_WAIT)
+        result = {'run_cold_p50_ms': percentile(cold, 0.5), 'run_warm_p50_ms': percentile(warm, 0.5),
+                  'spawn_cold_ms': median_spawn_ms(client, "BENCH_NOOP"),
+                  'spawn_warm_ms': median_spawn_ms(client, "BENCH_WARM")}
+    finally:
+        stop_daemon(process, client)
+    return result
+
+
+def bench_payload(workdir, port):
+    process, client = start_daemon(workdir, port)
+    body = os.urandom(1 << 20) * PAYLOAD_MB
+    try:
+        client.run("BENCH_SINK", timeout=30, body=b"x") # 先运行一次，排除首次启动解释器的开销
+        rates = []
+        for _ in range(PAYLOAD_RUNS):
+            begin = time.perf_counter()
+            result = client.run("BENCH_SINK", timeout=60, body=body)
+            if result.exit_code != 0:
+                raise RuntimeError(f"请求体基准的脚本异常退出: {result}")
+            rates.append(PAYLOAD_MB / (time.perf_counter() - begin))
+        result = {'payload_mb_per_s': max(rates)}
+        rss = peak_rss_mb(process.pid)
+        if rss is not None:
+            result['payload_daemon_rss_mb'] = rss
+    finally:
+        stop_daemon(process, client)
+    return result
+
+
+DAEMON_BENCHMARKS = {
+    'tcp': bench_tcp,
+    'tcp_concurrent': bench_tcp_concurrent,
+    'local': bench_local,
+    'spawn': bench_spawn,
+    'payload': bench_payload,
+}
+BENCHMARKS = list(CHILD_BENCHMARKS) + list(DAEMON_BENCHMARKS)
+
+
+# ---------------------------------------------------------------------------
+# 运行、比较与保存基线
+# ---------------------------------------------------------------------------
+
+def run_child(name, workdir):
+    completed = subprocess.run([sys.executable, str(Path(__file__).absolute()), "--child", name, str(workdir)],
+                               capture_output=True, text=True, timeout=CHILD_TIMEOUT,
+                               env=dict(os.environ, QT_QPA_PLATFORM='offscreen'))
+    if completed.returncode != 0:
+        raise RuntimeError(f"基准 {name} 失败:\n{completed.stderr.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def better(name, a, b):
+    return max(a, b) if METRICS[name][1] else min(a, b)
+
+
+def run_benchmarks(names, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="daemon_bench_") as root:
+        gui_dirs, daemon_dir, port = generate_configs(Path(root))
+        for name in names:
+            for _ in range(repeat):
+                print(f"运行基准 {name}...", file=sys.stderr, flush=True)
+                if name == 'startup':
+                    values = {}
+                    for count, gui_dir in gui_dirs.items():
+                        for metric, value in run_child(name, gui_dir).items():
+                            values[metric.replace('startup_', f'startup_{count}_')] = value
+                elif name in CHILD_BENCHMARKS:
+                    values = run_child(name, gui_dirs[min(gui_dirs)])
+                else:
+                    values = DAEMON_BENCHMARKS[name](daemon_dir, port)
+                for metric, value in values.items():
+                    results[metric] = better(metric, results[metric], value) if metric in results else value
+    return {metric: round(value, 4) for metric, value in results.items()}
+
+
+def machine_info():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, threshold):
+    """打印结果与基线的比较，返回退化的指标名列表。"""
+    regressions = []
+    print(f"{'指标':<26}{'当前':>14}{'基线':>14}{'变化':>10}  说明")
+    for metric, value in results.items():
+        unit, higher_is_better, tolerance, label = METRICS[metric]
+        base = baseline.get(metric)
+        change, mark = "", ""
+        if base:
+            worse = (base - value) if higher_is_better else (value - base)
+            change = f"{(value - base) / base:+.1%}"
+            if worse > abs(base) * threshold and worse > tolerance:
+                regressions.append(metric)
+                mark = "  <-- 退化"
+        base_text = f"{base:.4g}" if base is not None else "-"
+        print(f"{metric:<26}{value:>14.4g}{base_text:>14}{change:>10}  {label}（{unit}）{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="守护程序热点路径的离屏性能基准。")
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f"要运行的基准，默认全部: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, default=1, help="每个基准运行的次数，取最好的结果")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"比基线差超过此比例判为退化，默认{DEFAULT_THRESHOLD}")
+    parser.add_argument('--clients', type=int, default=CONCURRENT_CLIENTS,
+                        help=f"并发负载基准(tcp_concurrent)的客户端数量，默认{CONCURRENT_CLIENTS}；基线按默认值保存")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE, help="基线文件")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基线（与已有基线合并）")
+    parser.add_argument('--child', nargs=2, metavar=('NAME', 'CONFIG_DIR'), help=argparse.SUPPRESS)
+    parser.add_argument('--daemon', metavar='CONFIG_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child_main(args.child[0], Path(args.child[1]))
+    if args.daemon:
+        return daemon_main(Path(args.daemon))
+
+    if args.save_baseline and args.clients != CONCURRENT_CLIENTS:
+        parser.error(f"基线按默认的{CONCURRENT_CLIENTS}个客户端保存，--save-baseline 不能与 --clients 同时使用")
+    DAEMON_BENCHMARKS['tcp_concurrent'] = functools.partial(bench_tcp_concurrent, clients=max(1, args.clients))
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准: {', '.join(unknown)}，可选: {', '.join(BENCHMARKS)}")
+    results = run_benchmarks(args.benchmarks or BENCHMARKS, max(1, args.repeat))
+    stored = json.loads(args.baseline.read_text(encoding='utf-8')) if args.baseline.exists() else {}
+    if stored.get('machine') and stored['machine'] != machine_info():
+        print(f"注意: 基线来自不同的环境 {stored['machine']}，比较结果仅供参考。", file=sys.stderr)
+    regressions = compare(results, stored.get('metrics', {}), args.threshold)
+
+    if args.save_baseline:
+        # 与已有基线合并，已经不存在的指标不再保留
+        metrics = {metric: value for metric, value in dict(stored.get('metrics', {}), **results).items() if metric in METRICS}
+        args.baseline.write_text(json.dumps({'machine': machine_info(), 'metrics': metrics}, ensure_ascii=False, indent=2) + "\n",
+                                 encoding='utf-8')
+        print(f"基线已保存到 {args.baseline}")
+        return 0
+    if regressions:
+        print(f"有 {len(regressions)} 项指标比基线差超过 {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
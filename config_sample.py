@@ -5,6 +5,32 @@ from pathlib import Path
 HOST = "127.0.0.1"  # 标准环回接口地址 (localhost)
 PORT = 54321        # TCP服务器监听的端口
 ENABLE_TCP_SERVER = True # 设置为 False 可以禁用TCP服务器
+LOCAL_SOCKET = None      # 本地套接字的路径（例如 Path(__file__).parent / "daemon.sock"），与TCP使用相同的命令，None表示不监听
+LOCAL_SOCKET_MODE = 0o600 # 本地套接字文件的权限，只有能写入它的用户才能连接；0o660配合LOCAL_SOCKET_GROUP允许一个组使用
+LOCAL_SOCKET_GROUP = None # 本地套接字文件所属的组（组名或GID），None表示保持默认
+
+# --- 多实例分派 ---
+PEERS = []                   # 其他守护程序的"主机:端口"列表，例如 ["10.0.0.2:54321", "10.0.0.3:54321"]；不为空时把触发转发给负载最低的节点
+DISPATCH_INCLUDE_SELF = True # 本机是否也参与分派（负载相同时优先本机）
+PEER_CHECK_INTERVAL_MS = 1000 # 查询各节点负载（健康检查）的间隔（毫秒）
+PEER_TIMEOUT_MS = 3000        # 节点超过这么久没有回复负载查询就视为不可用，并断开与它的连接（毫秒）
+
+# --- 日志配置 ---
+LOG_DIR = Path(__file__).parent / "logs" # 每次运行的完整输出都会写入此目录下的日志文件
+RUN_LOG_KEEP = 100       # 每个脚本保留的运行日志文件数，新建日志时删除最旧的，0表示不限制，脚本可用run_log_keep单独设置
+RUN_LOG_MAX_BYTES = 0    # 每个脚本运行日志的总字节数上限，0表示不限制，脚本可用run_log_max_bytes单独设置
+HEADLESS_LOG_MAX_BYTES = 10 * 1024 * 1024 # 无界面模式下每个脚本日志文件的最大字节数，超出后轮转
+HEADLESS_LOG_BACKUPS = 5                  # 无界面模式下每个脚本保留的轮转日志数量
+
+# --- 统计配置 ---
+STATS_HISTORY_RUNS = 50  # 每个脚本保留的运行统计记录数，可通过TCP的STATS命令查询
+RESOURCE_SAMPLE_MS = 200 # 采样运行中脚本峰值内存的间隔（毫秒），CPU和磁盘I/O在进程结束时准确统计
+METRICS_FILE = None      # 设置为文件路径后，每次运行结束都以Prometheus文本格式写出指标（可配合node_exporter的textfile收集器）
+STREAM_BUFFER_BYTES = 1024 * 1024 # 每个脚本为TCP的TAIL/SUBSCRIBE订阅保留的最近输出字节数，所有订阅者共用
+MAX_PAYLOAD_BYTES = 256 * 1024 * 1024 # TCP的TRIGGER/RUN附带的请求体的字节数上限，脚本可用max_payload_bytes单独设置
+
+# --- 调度配置 ---
+MAX_CONCURRENCY = 0 # 所有脚本同时占用的并发槽位上限（见slots），0表示不限制
 
 # --- 脚本配置 ---
 CURRENT_DIR = Path(__file__).parent
@@ -15,6 +41,66 @@ CURRENT_DIR = Path(__file__).parent
 # - script: 要执行的python脚本的路径。
 # - msg: 通过TCP套接字触发脚本的秘密消息。
 # - args: (可选) 一个字符串列表，作为命令行参数传递给脚本。
+# - flush_interval_ms: (可选) 脚本输出合并刷新到界面的间隔（毫秒），默认为30。
+#   输出非常频繁的脚本可以调大此值（例如50）以降低界面负担。
+# - scrollback_lines: (可选) 界面中保留的最大行数，默认为10000，0表示不限制。
+#   更早的输出仍可通过“历史输出”按钮从运行日志文件中查看。
+# - max_pending_output: (可选) 界面来不及显示时，每个脚本最多积压的输出字符数，默认为4194304。
+#   脚本的输出管道始终及时读取，界面繁忙不会阻塞脚本；超出上限的部分按output_overflow丢弃。
+# - output_overflow: (可选) 积压超出上限时的处理方式，默认为"drop_oldest"：
+#     "drop_oldest" - 丢弃最旧的积压输出，界面显示最新的内容；
+#     "drop_newest" - 丢弃新到的输出，界面保留先到的内容。
+#   两种方式下界面都会注明省略的字符数，运行日志文件中始终保留完整输出。
+# - run_log_keep: (可选) 该脚本保留的运行日志文件数，默认为RUN_LOG_KEEP，0表示不限制。
+#   定时触发或文件触发频繁运行的脚本每天可能产生数千个日志文件，可以调小此值。
+# - run_log_max_bytes: (可选) 该脚本运行日志的总字节数上限，默认为RUN_LOG_MAX_BYTES，0表示不限制。
+#   超出任一上限时，新建日志的同时删除最旧的日志；仍在写入的日志不会删除。
+# - warm_workers: (可选) 预热解释器的数量，默认为0（每次触发都冷启动解释器）。
+#   预热解释器提前启动并导入preload中的模块，触发时直接运行脚本，适合导入耗时长的短任务。
+# - preload: (可选) 预热解释器需要预先导入的模块名列表，例如 ["numpy", "pandas"]。
+# - policy: (可选) 脚本已在运行时再次触发的处理方式，默认为"toggle"：
+#     "toggle"   - 终止正在运行的脚本（原有行为）；
+#     "queue"    - 排队，等前一次运行结束后再运行；
+#     "coalesce" - 最多保留一个等待中的请求，新的请求只更新它的参数；
+#     "replace"  - 终止正在运行的实例并丢弃等待中的请求，然后以新参数运行。
+# - max_instances: (可选) 同一脚本允许同时运行的实例数，默认为1。
+# - priority: (可选) 优先级，数值越大越先启动，默认为0。
+# - slots: (可选) 每个实例占用的全局并发槽位数，默认为1，用于限制重任务的并发。
+# - schedule_interval: (可选) 每隔多少秒自动触发一次（从程序启动时开始计时），不需要外部的cron调用send_msg.py。
+# - schedule_cron: (可选) 按cron表达式自动触发，5个字段依次为分、时、日、月、星期，按本地时间计算，
+#   例如 "*/15 * * * *"（每15分钟）、"0 9 * * 1-5"（工作日9点），也可以使用"@hourly"、"@daily"等简写。
+#   schedule_interval和schedule_cron只能配置一个；错过的时间（例如电脑休眠期间）不会补跑。
+# - schedule_jitter: (可选) 每次定时触发随机推迟0到该秒数，默认为0，用于错开大量同时到期的任务。
+# - schedule_skip_if_running: (可选) 到期时脚本仍在运行或排队则跳过这次触发，默认为True。
+#   设为False时按policy处理，注意默认的toggle策略会终止正在运行的脚本。
+# - watch: (可选) 要监视的目录（或目录列表），有新文件出现时触发脚本，程序启动时已有的文件不会触发。
+#   目录停止变化watch_settle_ms毫秒后才处理，大量文件同时到达也只运行一次脚本；
+#   脚本运行或排队期间到达的文件继续累积，等它结束后再交给它。
+# - watch_patterns: (可选) 文件名的通配符列表，例如 ["*.csv", "*.json"]，默认为 ["*"]。
+#   写入较慢的文件建议先用不匹配的临时名写完再改名。
+# - watch_delivery: (可选) 文件路径的传递方式，默认为"args"：
+#     "args"  - 追加在args之后作为命令行参数；
+#     "stdin" - 写入脚本的标准输入，每行一个路径，适合一次处理大量文件。
+# - watch_settle_ms: (可选) 目录最后一次变化后等待的毫秒数，默认为1000。
+# - watch_max_delay_ms: (可选) 目录持续变化时，从第一次变化起最多等待的毫秒数，默认为10000。
+# - watch_batch_files: (可选) 每次运行最多传入的文件数，默认为1000，更多的文件在本次运行结束后分批传入。
+# - cache_ttl: (可选) 结果缓存的有效期（秒），默认为0（不缓存）。适用于结果只取决于参数和脚本文件本身的脚本：
+#   有效期内通过TCP重复触发相同的消息时，直接回复上次正常退出的结果而不再运行脚本，
+#   与排队或运行中的相同请求合并；脚本文件被修改后缓存自动失效。界面上的按钮始终运行脚本。
+# - cache_entries: (可选) 该脚本最多缓存的结果数，默认为16，超出时淘汰最久未使用的。
+# - cache_output: (可选) 每个缓存结果保存的输出字符数上限，默认为1048576，超出时只保留末尾。
+# - max_payload_bytes: (可选) 通过TCP触发该脚本时附带的请求体的字节数上限，默认为MAX_PAYLOAD_BYTES。
+# - cpu_affinity: (可选) 脚本只在这些CPU上运行，CPU编号的列表或字符串，例如 [0, 1] 或 "0-3,6"。
+# - nice: (可选) 脚本的nice值（-20到19，越大优先级越低），例如 10；是目标值而不是相对守护程序的增量，低于守护程序的nice值需要权限。
+# - ionice_class: (可选) 磁盘I/O调度类别，"realtime"、"best-effort"或"idle"（只在系统空闲时读写）。
+# - ionice_level: (可选) 磁盘I/O优先级（0到7，越小越优先），默认为4，只对realtime和best-effort有效。
+# - memory_limit_bytes: (可选) 虚拟内存上限（字节，RLIMIT_AS），超出时脚本的内存分配失败（Python中为MemoryError）。
+# - cpu_time_limit: (可选) CPU时间上限（秒，RLIMIT_CPU），超出时脚本被SIGXCPU结束，显示为崩溃。
+#   以上限制只在Linux上全部支持，由脚本进程在运行脚本之前应用，脚本启动的子进程也会继承；
+#   无法应用的限制在脚本输出中给出警告，脚本照常运行。预热解释器在预先导入模块之前应用，导入的开销也计入限制。
+# - process_group: (可选) 为True时脚本在新的进程组中运行，终止脚本时连同它启动的子进程一起终止，默认为False。
+# - stop_timeout: (可选) 终止脚本时先发送SIGTERM，等待这么多秒仍未退出再强制结束，默认为0（立即强制结束）。
+#   等待期间再次终止则立即强制结束；程序退出时同样先发送SIGTERM，最多等待各脚本的stop_timeout。
 SCRIPTS_CONFIG = [
     {
         "name": "测试脚本",
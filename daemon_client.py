@@ -0,0 +1,559 @@
+# daemon_client.py
+"""守护程序的客户端库，使用分帧协议（见README的TCP协议一节）。
+
+DaemonClient 为同步客户端，内部维护一个线程安全的连接池；
+AsyncDaemonClient 基于asyncio，在少量连接上复用大量并发请求。
+两者都支持只触发(trigger)、等待运行结束(run)、查询缓存结果(result)、查询负载(load/peers)和跟随脚本输出(follow)。
+
+trigger和run可以附带参数（脚本中为环境变量DAEMON_PARAM_<名称>）和请求体（写入脚本的标准输入），
+请求体可以是bytes或以二进制打开的文件，分块发送，不会整个读入内存。
+
+默认通过TCP连接；指定path时连接守护程序的本地套接字（配置中的LOCAL_SOCKET），命令完全相同。
+
+连接失败或池中的旧连接已被服务器关闭时会自动重连重试；
+请求已经发出但回复丢失时不会重试，以免同一个脚本被重复触发。
+"""
+import os
+import json
+import asyncio
+import itertools
+import queue
+import select
+import socket
+from collections import namedtuple
+from urllib.parse import quote
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_TIMEOUT = 10.0
+CONNECT_RETRIES = 2
+FOLLOW_LINE_LIMIT = 1024 * 1024 # 推送事件行的最大长度（服务器按64KB拆分输出，转义后可能变长）
+REPLY_LINE_LIMIT = 8 * 1024 * 1024 # 异步客户端回复行的最大长度，RESULT回复包含缓存的输出
+BODY_CHUNK = 256 * 1024 # 发送请求体时每次读取和发送的字节数
+
+# exit_code 为脚本退出码；status 为 'finished' 或 'crashed'；cached 表示结果来自缓存，脚本没有再次运行
+RunResult = namedtuple('RunResult', ['exit_code', 'status', 'cached'], defaults=(False,))
+
+# TAIL/SUBSCRIBE推送的事件，kind为：
+#   'start' - 运行run_id开始；
+#   'data'  - 运行run_id的一段输出text，offset是它在本次运行输出中的字节位置（以'\r'开头表示替换当前行）；
+#   'drop'  - 读取太慢，跳过了dropped字节；
+#   'end'   - 运行run_id结束，附带exit_code和status。
+StreamEvent = namedtuple('StreamEvent', ['kind', 'run_id', 'offset', 'text', 'exit_code', 'status', 'dropped'],
+                         defaults=(None,) * 6)
+
+
+class DaemonError(Exception):
+    """服务器返回ERR，或者连接在收到回复前中断。"""
+
+
+class _StaleConnection(Exception):
+    """池中的连接在发送请求前已经失效，可以安全地换一个连接重试。"""
+
+
+def _parse_reply(line, request_id):
+    """解析"#<id> OK|ERR 文本"，返回(状态, 文本)。"""
+    head, _, rest = line.partition(' ')
+    if head != f"#{request_id}":
+        raise DaemonError(f"回复与请求不匹配: {line!r}")
+    status, _, text = rest.partition(' ')
+    return status, text
+
+
+def _check(status, text):
+    if status != 'OK':
+        raise DaemonError(text)
+    return text
+
+
+def _run_result(text):
+    exit_code, status, *flags = text.split(' ')
+    return RunResult(int(exit_code), status, 'cached' in flags)
+
+
+def _body_length(body):
+    """返回请求体的字节数：bytes类对象为其长度，文件为从当前位置到末尾的长度。"""
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return memoryview(body).nbytes
+    try:
+        return os.fstat(body.fileno()).st_size - body.tell()
+    except (AttributeError, OSError) as e:
+        raise TypeError("请求体应为bytes或以二进制打开的普通文件") from e
+
+
+def _body_chunks(body, length):
+    """按BODY_CHUNK分块产生请求体，文件提前结束时抛出DaemonError。"""
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        view = memoryview(body).cast('B')
+        for start in range(0, length, BODY_CHUNK):
+            yield view[start:start + BODY_CHUNK]
+        return
+    remaining = length
+    while remaining:
+        chunk = body.read(min(BODY_CHUNK, remaining))
+        if not chunk:
+            raise DaemonError(f"请求体文件比预期短了 {remaining} 字节")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _trigger_argument(message, params, length):
+    """生成TRIGGER/RUN的参数"<消息> [键=值 ...] [请求体字节数]"，值按URL编码。"""
+    parts = [message] + [f"{key}={quote(str(value), safe='')}" for key, value in (params or {}).items()]
+    if length is not None:
+        parts.append(str(length))
+    return ' '.join(parts)
+
+
+def _follow_command(message, offset, policy, forever):
+    argument = message if offset is None else f"{message} {offset}"
+    return f"#1 {'SUBSCRIBE' if forever else 'TAIL'} {argument} {policy}\n".encode('utf-8')
+
+
+def _stream_event(status, text):
+    """解析推送事件的状态和文本，返回StreamEvent；ERR时抛出DaemonError。"""
+    if status == 'DATA':
+        run_id, offset, payload = text.split(' ', 2)
+        return StreamEvent('data', int(run_id), int(offset), json.loads(payload))
+    if status == 'START':
+        return StreamEvent('start', int(text))
+    if status == 'END':
+        run_id, exit_code, result = text.split(' ')
+        return StreamEvent('end', int(run_id), exit_code=int(exit_code), status=result)
+    if status == 'DROP':
+        return StreamEvent('drop', dropped=int(text))
+    raise DaemonError(text)
+
+
+def _connect(host, port, path, timeout):
+    """建立TCP连接，path不为None时改为连接该本地套接字。"""
+    if path is None:
+        return socket.create_connection((host, port), timeout=timeout)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(os.fspath(path))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class _Connection:
+    """同步客户端的一条连接，同一时间只被一个线程使用。"""
+
+    def __init__(self, host, port, timeout, path=None):
+        self.sock = _connect(host, port, path, timeout)
+        self.reader = self.sock.makefile('r', encoding='utf-8', newline='\n')
+        self.ids = itertools.count(1)
+
+    def send(self, lines):
+        try:
+            self.sock.sendall("".join(lines).encode('utf-8'))
+        except OSError as e:
+            raise _StaleConnection(e) from e
+
+    def read_line(self, timeout):
+        self.sock.settimeout(timeout)
+        try:
+            line = self.reader.readline()
+        except OSError as e:
+            raise DaemonError(f"等待回复失败: {e}") from e
+        if not line:
+            raise DaemonError("连接在收到回复前被关闭")
+        return line.rstrip('\n')
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class DaemonClient:
+    """同步客户端，可在多个线程中共用。
+
+    pool_size 是空闲连接的上限，并发调用超过它时会临时创建额外的连接。
+    指定path时连接该本地套接字，忽略host和port。
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=None, timeout=DEFAULT_TIMEOUT, pool_size=4, path=None):
+        if port is None and path is None:
+            from config import PORT as port
+        self.host = host
+        self.port = port
+        self.path = path
+        self.address = os.fspath(path) if path is not None else f"{host}:{port}"
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=pool_size)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def acquire(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return _Connection(self.host, self.port, self.timeout, self.path)
+            # 空闲连接上不应有可读数据，可读说明服务器已关闭了它
+            if select.select([connection.sock], [], [], 0)[0]:
+                connection.close()
+                continue
+            return connection
+
+    def release(self, connection):
+        if self.closed:
+            connection.close()
+            return
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, command, argument='', timeout=None, body=None, length=None):
+        """发送一条命令并等待回复，返回(状态, 文本)。body不为None时在命令行之后发送length字节的请求体。"""
+        if body is None:
+            return self.request_many([(command, argument)], timeout)[0]
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(CONNECT_RETRIES + 1):
+            connection = None
+            try:
+                connection = self.acquire()
+                request_id = next(connection.ids)
+                connection.send([f"#{request_id} {command} {argument}\n"])
+                break
+            except (_StaleConnection, OSError) as e:
+                if connection is not None:
+                    connection.close()
+                if attempt == CONNECT_RETRIES:
+                    raise DaemonError(f"无法连接到守护程序 {self.address}: {e}") from e
+        try:
+            # 脚本读取得慢或还在排队时，服务器停止接收，sendall随之等待
+            connection.sock.settimeout(timeout)
+            try:
+                for chunk in _body_chunks(body, length):
+                    connection.sock.sendall(chunk)
+            except OSError as e:
+                # 服务器可能已经回复了错误（例如请求体超过上限）并断开
+                try:
+                    status, text = _parse_reply(connection.read_line(1.0), request_id)
+                except DaemonError:
+                    raise DaemonError(f"发送请求体失败: {e}") from e
+                raise DaemonError(text if status == 'ERR' else f"发送请求体失败: {e}") from e
+            result = _parse_reply(connection.read_line(timeout), request_id)
+        except DaemonError:
+            connection.close()
+            raise
+        self.release(connection)
+        return result
+
+    def request_many(self, commands, timeout=None):
+        """在一个连接上流水线发送多条命令，按顺序返回[(状态, 文本), ...]。"""
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(CONNECT_RETRIES + 1):
+            connection = None
+            try:
+                connection = self.acquire()
+                ids = [next(connection.ids) for _ in commands]
+                connection.send(f"#{i} {command} {argument}\n" for i, (command, argument) in zip(ids, commands))
+                break
+            except (_StaleConnection, OSError) as e:
+                if connection is not None:
+                    connection.close()
+                if attempt == CONNECT_RETRIES:
+                    raise DaemonError(f"无法连接到守护程序 {self.address}: {e}") from e
+        results = []
+        try:
+            for request_id in ids:
+                results.append(_parse_reply(connection.read_line(timeout), request_id))
+        except DaemonError:
+            # 连接上可能还有未读的回复，不能放回池中
+            connection.close()
+            raise
+        self.release(connection)
+        return results
+
+    def trigger(self, message, params=None, body=None):
+        """触发脚本，不等待运行结束，返回服务器的说明。
+
+        params为{名称: 值}，脚本中读取环境变量DAEMON_PARAM_<名称大写>；
+        body为写入脚本标准输入的bytes或二进制文件，脚本中DAEMON_PAYLOAD_BYTES为它的长度。
+        """
+        length = _body_length(body) if body is not None else None
+        return _check(*self.request('TRIGGER', _trigger_argument(message, params, length), body=body, length=length))
+
+    def trigger_many(self, messages):
+        """通过一个连接批量触发，返回与messages对应的(状态, 文本)列表。"""
+        return self.request_many([('TRIGGER', message) for message in messages])
+
+    def run(self, message, timeout=None, params=None, body=None):
+        """触发脚本并等待运行结束，返回RunResult。params和body的含义同trigger。
+
+        脚本因toggle策略、replace策略或停止操作未能运行时抛出DaemonError。
+        timeout默认使用客户端的timeout，长时间运行的脚本需要传入更大的值。
+        """
+        length = _body_length(body) if body is not None else None
+        return _run_result(_check(*self.request('RUN', _trigger_argument(message, params, length), timeout, body, length)))
+
+    def ping(self):
+        return _check(*self.request('PING'))
+
+    def stats(self, message=''):
+        """查询运行统计；指定触发消息时只返回该脚本，并附带运行历史。"""
+        return json.loads(_check(*self.request('STATS', message)))
+
+    def result(self, message):
+        """查询脚本缓存的最近结果（exit_code、status、output、truncated、finished_at、age），不会触发脚本。
+
+        脚本没有启用结果缓存或没有有效的缓存结果时抛出DaemonError。
+        """
+        return json.loads(_check(*self.request('RESULT', message)))
+
+    def load(self):
+        """查询守护程序的负载（running、queued、slots、cpu），分派器用它选择节点。"""
+        return json.loads(_check(*self.request('LOAD')))
+
+    def peers(self):
+        """查询分派器看到的本机负载和各节点的状态；守护程序没有配置PEERS时抛出DaemonError。"""
+        return json.loads(_check(*self.request('PEERS')))
+
+    def follow(self, message, offset=None, policy='drop', forever=False):
+        """逐个产生脚本输出的StreamEvent，使用单独的连接。
+
+        默认跟随当前这次运行（脚本没有在运行时跟随下一次），收到'end'事件后结束；
+        forever为True时接收之后所有运行的事件，直到调用方停止迭代。
+        offset为当前运行输出中的起始字节位置，负数表示从末尾往前数；
+        policy为'drop'（读取太慢时跳过）或'disconnect'（读取太慢时由服务器断开）。
+        """
+        try:
+            connection = _Connection(self.host, self.port, self.timeout, self.path)
+        except OSError as e:
+            raise DaemonError(f"无法连接到守护程序 {self.address}: {e}") from e
+        try:
+            connection.send([_follow_command(message, offset, policy, forever).decode('utf-8')])
+            _check(*_parse_reply(connection.read_line(self.timeout), 1))
+            while True:
+                event = _stream_event(*_parse_reply(connection.read_line(None), 1))
+                yield event
+                if event.kind == 'end' and not forever:
+                    return
+        except _StaleConnection as e:
+            raise DaemonError(f"发送请求失败: {e}") from e
+        finally:
+            connection.close()
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class _AsyncConnection:
+    """asyncio客户端的一条连接，多个请求共用，按请求ID分发回复。"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.pending = {} # 请求ID -> Future
+        self.task = asyncio.ensure_future(self.read_replies())
+
+    @property
+    def alive(self):
+        return not self.task.done()
+
+    async def read_replies(self):
+        error = DaemonError("连接在收到回复前被关闭")
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                head, _, rest = line.decode('utf-8').rstrip('\n').partition(' ')
+                future = self.pending.pop(head[1:], None)
+                if future is not None and not future.done():
+                    status, _, text = rest.partition(' ')
+                    future.set_result((status, text))
+        except (OSError, UnicodeDecodeError) as e:
+            error = DaemonError(f"读取回复失败: {e}")
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.writer.close()
+
+    def send(self, command, argument):
+        if not self.alive:
+            raise _StaleConnection()
+        request_id = str(next(self.ids))
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(f"#{request_id} {command} {argument}\n".encode('utf-8'))
+        return request_id, future
+
+    def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+
+class AsyncDaemonClient:
+    """asyncio客户端。请求分摊到最多pool_size条连接上，每条连接可同时有多个请求在途。
+
+    指定path时连接该本地套接字，忽略host和port。
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=None, timeout=DEFAULT_TIMEOUT, pool_size=2, path=None):
+        if port is None and path is None:
+            from config import PORT as port
+        self.host = host
+        self.port = port
+        self.path = path
+        self.address = os.fspath(path) if path is not None else f"{host}:{port}"
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.connections = []
+        self.connecting = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connection(self):
+        """返回在途请求最少的连接，连接数不足时新建一条。"""
+        self.connections = [c for c in self.connections if c.alive]
+        if len(self.connections) < self.pool_size:
+            if self.connecting is None:
+                self.connecting = asyncio.ensure_future(self.connect())
+            connecting = self.connecting
+            try:
+                await asyncio.shield(connecting)
+            finally:
+                if self.connecting is connecting:
+                    self.connecting = None
+            if connecting.exception() is None and connecting.result() not in self.connections:
+                self.connections.append(connecting.result())
+        return min(self.connections, key=lambda c: len(c.pending))
+
+    async def connect(self):
+        for attempt in range(CONNECT_RETRIES + 1):
+            try:
+                reader, writer = await asyncio.wait_for(self.open_connection(REPLY_LINE_LIMIT), self.timeout)
+                return _AsyncConnection(reader, writer)
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt == CONNECT_RETRIES:
+                    raise DaemonError(f"无法连接到守护程序 {self.address}: {e}") from e
+                await asyncio.sleep(0.05 * (attempt + 1))
+
+    def open_connection(self, limit):
+        """返回建立连接的协程，得到(StreamReader, StreamWriter)。"""
+        if self.path is not None:
+            return asyncio.open_unix_connection(os.fspath(self.path), limit=limit)
+        return asyncio.open_connection(self.host, self.port, limit=limit)
+
+    async def request(self, command, argument='', timeout=None, body=None, length=None):
+        """发送一条命令并等待回复，返回(状态, 文本)。
+
+        有请求体时使用单独的连接，请求体的数据不会与其他请求交错。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if body is not None:
+            return await self.request_body(command, argument, timeout, body, length)
+        for attempt in range(CONNECT_RETRIES + 1):
+            connection = await self.connection()
+            try:
+                request_id, future = connection.send(command, argument)
+                break
+            except _StaleConnection:
+                if attempt == CONNECT_RETRIES:
+                    raise DaemonError("连接已失效")
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            connection.pending.pop(request_id, None)
+            raise DaemonError(f"等待回复超时（{timeout}秒）") from None
+
+    async def request_body(self, command, argument, timeout, body, length):
+        try:
+            reader, writer = await asyncio.wait_for(self.open_connection(REPLY_LINE_LIMIT), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise DaemonError(f"无法连接到守护程序 {self.address}: {e}") from e
+        try:
+            writer.write(f"#1 {command} {argument}\n".encode('utf-8'))
+            try:
+                for chunk in _body_chunks(body, length):
+                    writer.write(chunk)
+                    await asyncio.wait_for(writer.drain(), timeout)
+            except OSError as e:
+                raise DaemonError(f"发送请求体失败: {e}") from e
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                raise DaemonError("连接在收到回复前被关闭")
+            return _parse_reply(line.decode('utf-8').rstrip('\n'), 1)
+        except asyncio.TimeoutError:
+            raise DaemonError(f"等待回复超时（{timeout}秒）") from None
+        finally:
+            writer.close()
+
+    async def trigger(self, message, params=None, body=None):
+        """触发脚本，不等待运行结束；params和body的含义同DaemonClient.trigger。"""
+        length = _body_length(body) if body is not None else None
+        return _check(*await self.request('TRIGGER', _trigger_argument(message, params, length), body=body, length=length))
+
+    async def run(self, message, timeout=None, params=None, body=None):
+        """触发脚本并等待运行结束，返回RunResult；未能运行时抛出DaemonError。"""
+        length = _body_length(body) if body is not None else None
+        return _run_result(_check(*await self.request('RUN', _trigger_argument(message, params, length), timeout, body, length)))
+
+    async def ping(self):
+        return _check(*await self.request('PING'))
+
+    async def stats(self, message=''):
+        return json.loads(_check(*await self.request('STATS', message)))
+
+    async def result(self, message):
+        return json.loads(_check(*await self.request('RESULT', message)))
+
+    async def load(self):
+        return json.loads(_check(*await self.request('LOAD')))
+
+    async def peers(self):
+        return json.loads(_check(*await self.request('PEERS')))
+
+    async def follow(self, message, offset=None, policy='drop', forever=False):
+        """异步产生脚本输出的StreamEvent，参数含义同DaemonClient.follow，使用单独的连接。"""
+        try:
+            reader, writer = await asyncio.wait_for(self.open_connection(FOLLOW_LINE_LIMIT), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise DaemonError(f"无法连接到守护程序 {self.address}: {e}") from e
+        try:
+            writer.write(_follow_command(message, offset, policy, forever))
+            ack = await asyncio.wait_for(reader.readline(), self.timeout)
+            _check(*_parse_reply(ack.decode('utf-8').rstrip('\n'), 1))
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise DaemonError("连接在收到运行结束前被关闭")
+                event = _stream_event(*_parse_reply(line.decode('utf-8').rstrip('\n'), 1))
+                yield event
+                if event.kind == 'end' and not forever:
+                    return
+        except asyncio.TimeoutError:
+            raise DaemonError(f"等待回复超时（{self.timeout}秒）") from None
+        finally:
+            writer.close()
+
+    async def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
@@ -0,0 +1,2000 @@
+# 守护程序核心：脚本运行与TCP服务器，不依赖QtWidgets/QtGui，可供界面和无界面模式共用
+import os
+import re
+import sys
+import time
+import json
+import codecs
+import heapq
+import itertools
+import stat
+import signal
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import unquote
+import shutil
+
+from PySide6.QtCore import QObject, Signal, Slot, QProcess, QTimer, QProcessEnvironment
+from PySide6.QtNetwork import QTcpServer, QHostAddress, QLocalServer, QLocalSocket
+
+from run_stats import RunStatistics, children_usage, read_proc_usage, render_prometheus
+from scheduler import Scheduler
+from watcher import DirectoryWatcher
+from process_limits import parse_limits, has_child_limits, encode_limits, LIMITS_ENV
+from dispatcher import PeerDispatcher, cpu_load, DEFAULT_CHECK_INTERVAL_MS, DEFAULT_PEER_TIMEOUT_MS
+
+# --- 配置文件检查 ---
+# 在导入配置之前，检查config.py是否存在。如果不存在，则从config_sample.py复制。
+CURRENT_SCRIPT_DIR = Path(__file__).parent
+config_path = CURRENT_SCRIPT_DIR / "config.py"
+sample_config_path = CURRENT_SCRIPT_DIR / "config_sample.py"
+
+if not config_path.exists():
+    print(f"'config.py' 未找到。正在尝试从 '{sample_config_path.name}' 创建...")
+    if sample_config_path.exists():
+        try:
+            shutil.copy(sample_config_path, config_path)
+            print("成功创建 'config.py'。请根据您的需求编辑该文件后重新启动程序。")
+        except Exception as e:
+            print(f"错误: 从模板创建 'config.py' 失败: {e}")
+            sys.exit(1) # 关键文件创建失败，退出程序
+    else:
+        print(f"错误: '{config_path.name}' 和 '{sample_config_path.name}' 都不存在。程序无法启动。")
+        sys.exit(1) # 缺少关键文件，退出程序
+
+# --- 配置 ---
+import config
+from config import SCRIPTS_CONFIG, HOST, PORT, ENABLE_TCP_SERVER
+
+PYTHON_EXECUTABLE = sys.executable # 使用运行此脚本的同一个Python解释器
+MAX_CONCURRENCY = getattr(config, "MAX_CONCURRENCY", 0) # 全局并发槽位上限，0表示不限制
+WARM_WORKER_SCRIPT = str(CURRENT_SCRIPT_DIR / "warm_worker.py") # 预热解释器的入口脚本
+LIMITS_SCRIPT = str(CURRENT_SCRIPT_DIR / "process_limits.py") # 配置了进程限制的脚本经由它冷启动
+PROCESS_GROUPS = os.name == 'posix' and hasattr(QProcess, 'setUnixProcessParameters') # 是否支持process_group（Qt 6.6以上）
+LOG_DIR = Path(getattr(config, "LOG_DIR", CURRENT_SCRIPT_DIR / "logs")) # 每次运行的完整输出日志目录
+RUN_LOG_KEEP = getattr(config, "RUN_LOG_KEEP", 100) # 每个脚本保留的运行日志文件数，0表示不限制
+RUN_LOG_MAX_BYTES = getattr(config, "RUN_LOG_MAX_BYTES", 0) # 每个脚本运行日志的总字节数上限，0表示不限制
+STATS_HISTORY_RUNS = getattr(config, "STATS_HISTORY_RUNS", 50) # 每个脚本保留的运行记录数
+RESOURCE_SAMPLE_MS = getattr(config, "RESOURCE_SAMPLE_MS", 200) # 采样运行中脚本峰值内存的间隔（毫秒）
+METRICS_FILE = getattr(config, "METRICS_FILE", None) # 每次运行结束后写入Prometheus文本格式指标的文件，None表示不写
+METRICS_WRITE_INTERVAL_MS = 1000 # 指标文件的最短写入间隔，运行频繁时合并写入
+WARM_REFILL_DELAY_MS = 500 # 取出预热解释器后，最晚过这么久补充新的解释器（取出的运行先结束时立即补充）
+STREAM_BUFFER_BYTES = getattr(config, "STREAM_BUFFER_BYTES", 1024 * 1024) # 每个脚本为TAIL/SUBSCRIBE保留的最近输出字节数
+MAX_PAYLOAD_BYTES = getattr(config, "MAX_PAYLOAD_BYTES", 256 * 1024 * 1024) # TRIGGER/RUN附带的请求体的默认大小上限
+LOCAL_SOCKET = getattr(config, "LOCAL_SOCKET", None) # 本地套接字的路径，None表示不监听
+LOCAL_SOCKET_MODE = getattr(config, "LOCAL_SOCKET_MODE", 0o600) # 本地套接字文件的权限，能写入它的用户才能连接
+LOCAL_SOCKET_GROUP = getattr(config, "LOCAL_SOCKET_GROUP", None) # 本地套接字文件所属的组（组名或GID），None表示不修改
+PEERS = getattr(config, "PEERS", []) # 其他守护程序节点的"主机:端口"列表，不为空时把触发分派给负载最低的节点
+DISPATCH_INCLUDE_SELF = getattr(config, "DISPATCH_INCLUDE_SELF", True) # 本机是否也作为分派的候选
+PEER_CHECK_INTERVAL_MS = getattr(config, "PEER_CHECK_INTERVAL_MS", DEFAULT_CHECK_INTERVAL_MS) # 查询节点负载的间隔（毫秒）
+PEER_TIMEOUT_MS = getattr(config, "PEER_TIMEOUT_MS", DEFAULT_PEER_TIMEOUT_MS) # 节点多久没有回复就视为不可用（毫秒）
+# ---------------------
+
+DEFAULT_FLUSH_INTERVAL_MS = 30 # 脚本输出合并刷新到界面的默认间隔（毫秒）
+DEFAULT_MAX_PENDING_OUTPUT = 4 * 1024 * 1024 # 每个脚本等待界面取走的输出上限（字符）
+DEFAULT_CACHE_ENTRIES = 16 # 启用结果缓存的脚本默认保留的结果数
+DEFAULT_CACHE_OUTPUT = 1024 * 1024 # 每个缓存结果默认保存的输出上限（字符），超出时只保留末尾
+OUTPUT_OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest')
+LOGGED_ARGUMENTS = 20 # 开始运行时打印的参数个数上限，文件触发可能传入上千个文件路径
+
+FRAME_PREFIX = b'#'        # 以此开头的连接使用按行分帧的协议
+MAX_LINE_BYTES = 64 * 1024 # 单条消息/命令的最大长度
+LEGACY_WAIT_MS = 200       # 旧协议下等待消息到齐的最长时间（毫秒）
+SUBSCRIBER_BACKLOG_BYTES = 256 * 1024 # 每个连接上尚未发出的订阅数据上限，超过后等客户端读走再继续
+SLOW_SUBSCRIBER_POLICIES = ('drop', 'disconnect') # 订阅者落后到输出已被淘汰时：跳过丢失的部分，或断开连接
+MAX_STREAM_CHUNK = 64 * 1024 # 订阅流中单个输出事件的最大字节数，大段输出按UTF-8字符边界拆开
+LISTEN_BACKLOG = 1024      # 监听队列长度，支持大量客户端同时连接
+SOCKET_READ_BUFFER = 256 * 1024  # 每个连接在Qt中缓存的接收数据上限，请求体暂时写不出去时由TCP流量控制让客户端等待
+PAYLOAD_BUFFER_BYTES = 1024 * 1024 # 每个请求体在守护程序中最多缓存的字节数（脚本尚未启动或还没读走的部分）
+PARAM_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*') # TRIGGER/RUN参数名，作为环境变量DAEMON_PARAM_<名称>传给脚本
+LOCAL_PROBE_MS = 200 # 启动时检查本地套接字是否已被其他守护程序使用的等待时间（毫秒）
+
+def collapse_carriage_returns(text):
+    """折叠一批输出中被'\\r'覆盖的内容，每行只保留最终状态。
+
+    如果第一行被覆盖，返回的文本以'\\r'开头，表示需要替换界面上的当前行；
+    其余位置不再包含'\\r'。
+    """
+    if '\r' not in text:
+        return text
+    lines = text.replace('\r\n', '\n').split('\n')
+    for i, line in enumerate(lines):
+        if '\r' not in line:
+            continue
+        head, *rest = line.split('\r')
+        # 取最后一次'\r'之后的非空内容；行尾单独的'\r'不会覆盖任何内容
+        tail = next((part for part in reversed(rest) if part), None)
+        if tail is None:
+            lines[i] = head
+        elif i == 0:
+            lines[i] = '\r' + tail
+        else:
+            lines[i] = tail
+    return '\n'.join(lines)
+
+class OutputMailbox:
+    """运行线程与界面线程之间的输出信箱，每个脚本的积压量有上限。
+
+    运行线程随时放入输出，不会因为界面繁忙而停止读取子进程的管道；
+    界面在收到通知后一次取走所有积压的输出。积压超过上限时按脚本的
+    output_overflow策略丢弃最旧('drop_oldest')或最新('drop_newest')的输出，
+    并在取出的文本中注明省略了多少字符。运行日志文件不受影响，始终是完整的。
+    """
+    def __init__(self, stats=None):
+        self.lock = threading.Lock()
+        self.pending = {}  # 脚本ID -> {chunks: deque, size: int, dropped: int, policy: str, since: float}
+        self.notified = False
+        self.stats = stats # 取件时记录从读到输出到被取走的延迟
+
+    def put(self, script_id, text, limit, policy, since=None):
+        """放入一段输出，返回是否需要通知取件方（信箱此前为空）。since是读到这段输出的时刻。"""
+        with self.lock:
+            box = self.pending.get(script_id)
+            if box is None:
+                box = self.pending[script_id] = {'chunks': deque(), 'size': 0, 'dropped': 0, 'policy': policy,
+                                                 'since': since or time.monotonic()}
+            if policy == 'drop_newest':
+                room = max(limit - box['size'], 0)
+                if len(text) > room:
+                    box['dropped'] += len(text) - room
+                    text = text[:room]
+                if text:
+                    box['chunks'].append(text)
+                    box['size'] += len(text)
+            else:
+                box['chunks'].append(text)
+                box['size'] += len(text)
+                while box['size'] > limit:
+                    oldest = box['chunks'].popleft()
+                    excess = box['size'] - limit
+                    if len(oldest) > excess:
+                        # 只截掉多出的部分，保留这段输出的结尾
+                        box['chunks'].appendleft(oldest[excess:])
+                        oldest = oldest[:excess]
+                    box['size'] -= len(oldest)
+                    box['dropped'] += len(oldest)
+            notify = not self.notified
+            self.notified = True
+            return notify
+
+    def take(self):
+        """取走所有积压的输出，返回[(脚本ID, 文本), ...]，被覆盖的进度已折叠。"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.notified = False
+        now = time.monotonic()
+        result = []
+        for script_id, box in pending.items():
+            if self.stats:
+                self.stats.observe('flush_latency', script_id, now - box['since'])
+            text = merge_output(box['chunks'])
+            if box['dropped']:
+                note = f"\n[输出过快，界面来不及显示，省略了 {box['dropped']} 个字符，完整内容见运行日志]\n"
+                if box['policy'] == 'drop_newest':
+                    text = text + note
+                else:
+                    text = note + text.lstrip('\r')
+            if text:
+                result.append((script_id, text))
+        return result
+
+
+def merge_output(chunks):
+    """按顺序合并多段TerminalStream的输出，结果仍遵循以'\\r'开头表示替换当前行的约定。"""
+    parts = []
+    replace = False
+    for chunk in chunks:
+        if chunk.startswith('\r'):
+            # 去掉已合并内容的最后一行，没有换行时替换的就是界面上的当前行
+            while parts:
+                newline = parts[-1].rfind('\n')
+                if newline != -1:
+                    parts[-1] = parts[-1][:newline + 1]
+                    break
+                parts.pop()
+            if not parts:
+                replace = True
+            chunk = chunk[1:]
+        if chunk:
+            parts.append(chunk)
+    return ('\r' if replace else '') + ''.join(parts)
+
+class StreamEntry:
+    """ScriptStream中的一个事件。"""
+    __slots__ = ('kind', 'run_id', 'position', 'run_offset', 'data', 'result', 'frame')
+
+    def __init__(self, kind, run_id, position, run_offset=0, data=b'', result=None):
+        self.kind = kind             # 'start'、'data'或'end'
+        self.run_id = run_id
+        self.position = position     # 事件在该脚本全部输出中的字节位置
+        self.run_offset = run_offset # 事件在本次运行输出（即运行日志文件）中的字节位置
+        self.data = data             # 'data'事件的UTF-8输出
+        self.result = result         # 'end'事件的(退出码, finished/crashed)
+        self.frame = None            # 编码好的回复行（不含请求ID），由所有订阅者共用
+
+
+class ScriptStream:
+    """一个脚本所有运行的输出事件，供TAIL/SUBSCRIBE的订阅者共用，只保留最近limit字节。
+
+    事件按序号编址，订阅者各自保存下一个要读取的序号，追加事件与订阅者数量无关。
+    输出与运行日志文件的内容一致（已经过终端解析，以'\r'开头表示替换当前行）。
+    只在运行线程中访问。
+    """
+    def __init__(self, limit=STREAM_BUFFER_BYTES):
+        self.limit = limit
+        self.entries = []  # 事件列表，前head个已被淘汰，定期整体删除
+        self.head = 0
+        self.base = 0      # entries[0]的序号
+        self.size = 0      # 保留的'data'事件字节数
+        self.position = 0  # 已追加的总字节数
+        self.runs = {}     # 正在运行的运行ID -> [开始事件的序号, 开始时的位置]
+
+    @property
+    def first_seq(self):
+        return self.base + self.head
+
+    @property
+    def next_seq(self):
+        return self.base + len(self.entries)
+
+    @property
+    def first_position(self):
+        return self.entries[self.head].position if self.head < len(self.entries) else self.position
+
+    def entry(self, seq):
+        return self.entries[seq - self.base]
+
+    def latest_run(self):
+        """最近开始且仍在运行的运行ID，没有时返回None。"""
+        return max(self.runs) if self.runs else None
+
+    def begin_run(self, run_id):
+        self.runs[run_id] = [self.next_seq, self.position]
+        self.entries.append(StreamEntry('start', run_id, self.position))
+
+    def append(self, run_id, data):
+        run = self.runs.get(run_id)
+        if run is None:
+            return
+        while data:
+            cut = len(data)
+            if cut > MAX_STREAM_CHUNK:
+                cut = MAX_STREAM_CHUNK
+                while cut > 0 and data[cut] & 0xC0 == 0x80: # 不拆开多字节字符
+                    cut -= 1
+            self.entries.append(StreamEntry('data', run_id, self.position, self.position - run[1], data[:cut]))
+            self.position += cut
+            self.size += cut
+            data = data[cut:]
+        # 淘汰最旧的事件，至少保留刚追加的这一个
+        while self.size > self.limit and self.head < len(self.entries) - 1:
+            self.size -= len(self.entries[self.head].data)
+            self.head += 1
+        if self.head > 1024 and self.head * 2 > len(self.entries):
+            del self.entries[:self.head]
+            self.base += self.head
+            self.head = 0
+
+    def end_run(self, run_id, exit_code, result):
+        if self.runs.pop(run_id, None) is not None:
+            self.entries.append(StreamEntry('end', run_id, self.position, result=(exit_code, result)))
+
+    def locate(self, run_id, offset):
+        """返回从运行run_id的输出第offset字节开始读取的(序号, 要跳过的字节数, 已被淘汰的字节数)。
+
+        offset为负数时从当前末尾往前数；超过当前末尾时从之后的新输出开始。
+        要求的位置已被淘汰时从最早保留的事件开始。
+        """
+        start_seq, start_position = self.runs[run_id]
+        if offset < 0:
+            offset = max(self.position - start_position + offset, 0)
+        seq = max(start_seq, self.first_seq)
+        while seq < self.next_seq:
+            entry = self.entry(seq)
+            if entry.run_id == run_id and entry.kind == 'data' and entry.run_offset + len(entry.data) > offset:
+                skip = max(offset - entry.run_offset, 0)
+                while skip < len(entry.data) and entry.data[skip] & 0xC0 == 0x80: # 从完整的字符开始
+                    skip += 1
+                return seq, skip, max(entry.run_offset - offset, 0)
+            seq += 1
+        return seq, 0, 0
+
+
+class ResultCache:
+    """按(脚本, 参数, 脚本文件的修改时间和大小)缓存最近的运行结果，服务器直接用它回复重复的触发。
+
+    只对配置了cache_ttl的脚本生效。每个脚本的条目数有上限，超出时淘汰最久未使用的，过期条目在查询时删除；
+    只缓存正常退出（不论退出码）的运行。排队或运行中的请求记录在inflight中，相同的触发合并到它上面。
+    只在运行线程中访问。
+    """
+    def __init__(self, script_configs):
+        self.settings = {} # 脚本ID -> (有效期秒数, 最大条目数, 输出上限)
+        for script_id, script_config in script_configs.items():
+            if script_config.get('cache_ttl', 0) > 0:
+                self.settings[script_id] = (script_config['cache_ttl'], script_config.get('cache_entries', DEFAULT_CACHE_ENTRIES),
+                                            script_config.get('cache_output', DEFAULT_CACHE_OUTPUT))
+        self.entries = {script_id: OrderedDict() for script_id in self.settings} # 脚本ID -> {键: 结果}，按使用先后排列
+        self.counters = {script_id: {'hits': 0, 'misses': 0, 'joined': 0, 'expired': 0, 'evictions': 0} for script_id in self.settings}
+        self.inflight = {} # 键 -> 排队或运行中的请求的凭据列表
+
+    def key(self, script_id, args):
+        """返回缓存键；脚本没有启用缓存或文件不存在时返回None。"""
+        if script_id not in self.settings:
+            return None
+        try:
+            stat = os.stat(script_id)
+        except OSError:
+            return None
+        return (script_id, tuple(args), stat.st_mtime_ns, stat.st_size)
+
+    def output_limit(self, key):
+        return self.settings[key[0]][2]
+
+    def get(self, key, count=True):
+        """返回未过期的结果，没有时返回None。count为True时计入命中和过期次数。"""
+        entries = self.entries[key[0]]
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['stored'] > self.settings[key[0]][0]:
+            del entries[key]
+            self.counters[key[0]]['expired'] += 1
+            return None
+        if count:
+            entries.move_to_end(key)
+            self.counters[key[0]]['hits'] += 1
+        return entry
+
+    def join(self, key, ticket):
+        """把触发合并到排队或运行中的相同请求上，返回是否合并成功。"""
+        tickets = self.inflight.get(key)
+        if tickets is None:
+            return False
+        if ticket:
+            tickets.append(ticket)
+        self.counters[key[0]]['joined'] += 1
+        return True
+
+    def miss(self, key):
+        self.counters[key[0]]['misses'] += 1
+
+    def track(self, key, tickets, previous=None):
+        """记录排队或运行中的请求的凭据列表；请求启动后凭据列表换成运行的列表时传入previous。"""
+        if key is None:
+            return
+        if previous is None:
+            self.inflight.setdefault(key, tickets)
+        elif self.inflight.get(key) is previous:
+            self.inflight[key] = tickets
+
+    def untrack(self, key, tickets):
+        if key is not None and self.inflight.get(key) is tickets:
+            del self.inflight[key]
+
+    def store(self, key, exit_code, status, output, truncated):
+        entries = self.entries[key[0]]
+        entries[key] = {'exit_code': exit_code, 'status': status, 'output': output, 'truncated': truncated,
+                        'finished_at': time.time(), 'stored': time.monotonic()}
+        entries.move_to_end(key)
+        while len(entries) > self.settings[key[0]][1]:
+            entries.popitem(last=False)
+            self.counters[key[0]]['evictions'] += 1
+
+    def annotate(self, snapshot, names):
+        """把各脚本的缓存计数加入RunStatistics.snapshot()的结果中。"""
+        for script_id, counters in self.counters.items():
+            entry = snapshot.get(names.get(script_id, script_id))
+            if entry is not None:
+                entry['cache'] = dict(counters, entries=len(self.entries[script_id]))
+        return snapshot
+
+
+# 终端控制序列：CSI（ESC [ 参数 结束符）、OSC（ESC ] ... BEL/ST）和其他ESC序列（ECMA-48的nF/Fp/Fe/Fs，
+# 即若干中间字节0x20-0x2F加一个结束字节0x30-0x7E，例如ESC ( B、ESC 7、ESC =；没有中间字节时'['和']'开始的是CSI/OSC）
+ESCAPE_SEQUENCE = r'[ -/]+[0-~]|[0-Z\\^-~]'
+ANSI_SEQUENCE = re.compile(r'\x1b(?:\[([0-?]*)[ -/]*([@-~])|\][^\x07\x1b]*(?:\x07|\x1b\\)|' + ESCAPE_SEQUENCE + ')')
+CONTROL_TOKEN = re.compile(ANSI_SEQUENCE.pattern + r'|[\r\n\b]')
+# 不影响纯文本内容的控制序列（除擦除行和移到列以外的CSI、OSC等），可以预先整体去掉
+IGNORED_SEQUENCE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-FH-JL-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|' + ESCAPE_SEQUENCE + ')')
+# 批次末尾还不完整、之后可能成为有效控制序列的部分，只有这样的部分才留到下一批
+ESCAPE_PREFIX = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[ -/]*)\Z')
+# 只移动光标或改变样式、不写入也不擦除内容的片段
+CURSOR_ONLY = re.compile(r'(?:\x1b\[[0-?]*[ -/]*G|\x08|' + IGNORED_SEQUENCE.pattern + ')*')
+MAX_ESCAPE_CARRY = 256 # 跨批次暂存的不完整控制序列的最大长度
+
+
+class TerminalStream:
+    """把脚本的原始终端输出逐批转换成界面可以直接追加的文本。
+
+    理解'\\n'、'\\r'、退格以及常用的ANSI序列：擦除行(ESC[K)、移到行首(ESC[G)；
+    颜色等其他控制序列被去掉。同一批内被'\\r'覆盖的进度状态只保留最终状态。
+    输出沿用collapse_carriage_returns的约定：以'\\r'开头表示替换界面上的当前行，
+    其余位置不含'\\r'。跨批次的不完整控制序列和行尾的'\\r'会留到下一批再处理。
+    """
+    def __init__(self):
+        self.line = ''       # 当前行（尚未以换行结束）的内容
+        self.shown = None    # 界面上当前行已经显示的内容，None表示当前行还没有显示过
+        self.at_start = False # 光标已回到行首，下一个字符开始覆盖当前行
+        self.carry = ''      # 上一批末尾不完整的控制序列
+
+    def feed(self, text, final=False):
+        """处理一批文本，返回需要追加到界面的文本。final为True时输出所有暂存内容。"""
+        text = self.carry + text
+        self.carry = ''
+        if not final:
+            # 从最靠前的一处开始暂存，ESC ] ... ESC 这样等待结束符的OSC不会从中间断开
+            prefix = ESCAPE_PREFIX.search(text, max(len(text) - MAX_ESCAPE_CARRY, 0)) if '\x1b' in text else None
+            if prefix:
+                text, self.carry = text[:prefix.start()], text[prefix.start():]
+        out = []
+        if '\r' not in text and '\x1b' not in text and '\b' not in text:
+            # 普通输出的快速路径：只需处理换行
+            first = text.find('\n')
+            if first == -1:
+                self.write(text)
+            else:
+                last = text.rfind('\n')
+                self.write(text[:first])
+                self.commit(out)
+                out.append(text[first + 1:last + 1])
+                self.write(text[last + 1:])
+        else:
+            if '\r' in text:
+                text = '\n'.join(map(self.skip_overwritten, text.split('\n')))
+            text = IGNORED_SEQUENCE.sub('', text)
+            position = 0
+            for match in CONTROL_TOKEN.finditer(text):
+                self.write(text[position:match.start()])
+                position = match.end()
+                self.control(match, out)
+            self.write(text[position:])
+        self.render(out)
+        return ''.join(out)
+
+    @staticmethod
+    def skip_overwritten(line):
+        """去掉一行中最后一次有效重写之前的内容，它们对最终状态没有影响。
+
+        '\\r'之后只要有文字或擦除行，当前行就会被整体替换；
+        只有光标移动的'\\r'片段不会改变内容，不能作为替换的起点。
+        """
+        end = len(line)
+        cr = line.rfind('\r')
+        while cr > 0:
+            tail = line[cr + 1:end]
+            if tail and not CURSOR_ONLY.fullmatch(tail):
+                return line[cr:]
+            end = cr
+            cr = line.rfind('\r', 0, cr)
+        return line
+
+    def write(self, text):
+        if not text:
+            return
+        if self.at_start:
+            self.line = ''
+            self.at_start = False
+        self.line += text
+
+    def control(self, match, out):
+        token = match.group(0)
+        if token == '\n':
+            self.at_start = False
+            self.commit(out)
+        elif token == '\r':
+            self.at_start = True
+        elif token == '\b':
+            if not self.at_start:
+                self.line = self.line[:-1]
+        elif match.group(2) == 'K':
+            # 擦除行：0(默认)擦除光标到行尾，1/2擦除整行；光标在行尾时前者不起作用
+            if self.at_start or match.group(1) in ('1', '2'):
+                self.line = ''
+                self.at_start = False
+        elif match.group(2) == 'G' and match.group(1) in ('', '0', '1'):
+            self.at_start = True
+        # 颜色、光标上下移动等其他控制序列在纯文本界面中没有对应，直接去掉
+
+    def render(self, out):
+        """把当前行的变化追加到out：能追加时只追加新增部分，否则替换整行。"""
+        if self.shown is None:
+            if self.line:
+                out.append(self.line)
+                self.shown = self.line
+        elif self.line != self.shown:
+            if self.line.startswith(self.shown):
+                out.append(self.line[len(self.shown):])
+            else:
+                # 界面上的当前行需要被替换，只会发生在本批的第一段输出上
+                out.append('\r' + self.line)
+            self.shown = self.line
+
+    def commit(self, out):
+        self.render(out)
+        out.append('\n')
+        self.line = ''
+        self.shown = None
+
+
+class PayloadUpload(QObject):
+    """把随TRIGGER/RUN命令发来的请求体边接收边写入脚本的标准输入。
+
+    服务器从连接读取数据交给feed()，每次最多接收capacity()字节：脚本启动前缓存在这里，
+    启动后直接写给进程，两种情况下守护程序持有的未写出数据都不超过PAYLOAD_BUFFER_BYTES。
+    接收不了时服务器停止读取连接，由TCP流量控制让客户端等待；进程读走数据后发出drained，服务器继续读取。
+    请求没有运行（被拒绝、取消）或进程已经结束时调用discard()，之后收到的数据直接丢弃，连接上的后续命令照常处理。
+    """
+    drained = Signal() # 可以接收更多数据了
+
+    def __init__(self, length, parent=None):
+        super().__init__(parent)
+        self.length = length
+        self.remaining = length # 尚未从连接收到的字节数
+        self.chunks = []        # 进程启动前收到的数据
+        self.buffered = 0
+        self.process = None
+        self.discarded = False
+        self.notify_pending = False
+
+    def capacity(self):
+        if self.discarded:
+            return self.remaining
+        pending = self.buffered if self.process is None else self.process.bytesToWrite()
+        return max(0, min(self.remaining, PAYLOAD_BUFFER_BYTES - pending))
+
+    def feed(self, data):
+        """接收data开头的一部分，返回接收的字节数。"""
+        count = min(len(data), self.capacity())
+        if count == 0:
+            return 0
+        self.remaining -= count
+        if not self.discarded:
+            chunk = bytes(data[:count])
+            if self.process is None:
+                self.chunks.append(chunk)
+                self.buffered += count
+            else:
+                self.process.write(chunk)
+                if self.remaining == 0:
+                    self.process.closeWriteChannel()
+        return count
+
+    def attach(self, process):
+        """脚本进程已创建（已调用start或预热解释器已下发任务）：写出缓存的数据，之后收到的直接写给它。"""
+        if self.discarded:
+            return
+        self.process = process
+        process.bytesWritten.connect(self.on_bytes_written)
+        for chunk in self.chunks:
+            process.write(chunk)
+        self.chunks = []
+        self.buffered = 0
+        if self.remaining == 0:
+            process.closeWriteChannel()
+        else:
+            self.request_more()
+
+    def abort(self):
+        """连接在请求体收完之前断开：关闭脚本的标准输入，脚本可以对照DAEMON_PAYLOAD_BYTES发现数据不完整。"""
+        if self.remaining and not self.discarded:
+            print(f"警告: 请求体还差 {self.remaining} 字节时连接已断开。")
+        self.remaining = 0
+        if self.process is not None and not self.discarded:
+            self.process.closeWriteChannel()
+
+    def discard(self):
+        if self.discarded:
+            return
+        self.discarded = True
+        self.chunks = []
+        self.buffered = 0
+        if self.process is not None:
+            self.process.bytesWritten.disconnect(self.on_bytes_written)
+            self.process = None
+        self.request_more()
+
+    def on_bytes_written(self, count):
+        if self.remaining:
+            self.request_more()
+
+    def request_more(self):
+        # 合并到事件循环中发出：既避免频繁的bytesWritten反复触发读取，也避免在服务器处理命令的过程中重入
+        if not self.notify_pending:
+            self.notify_pending = True
+            QTimer.singleShot(0, self, self.emit_drained)
+
+    def emit_drained(self):
+        self.notify_pending = False
+        self.drained.emit()
+
+
+class ScriptInput:
+    """一次运行的额外输入：写入标准输入的数据（bytes，或边接收边写入的PayloadUpload）和附加的环境变量。"""
+
+    def __init__(self, data=b'', upload=None, env=None):
+        self.data = data
+        self.upload = upload
+        self.env = env or {}
+
+    def discard(self):
+        """运行被拒绝或取消时调用，丢弃还在接收的请求体。"""
+        if self.upload is not None:
+            self.upload.discard()
+
+
+def create_script_process(working_dir, limits=None):
+    """创建尚未启动的QProcess，设置好工作目录和UTF-8输出环境。
+
+    limits为脚本的进程限制（见process_limits.parse_limits）：需要在子进程中应用的限制通过环境变量传给
+    process_limits.py或warm_worker.py；启用process_group时子进程成为新会话和进程组的首进程。
+    """
+    process = QProcess()
+    process.setWorkingDirectory(working_dir)
+
+    # 设置子进程的环境变量，强制其输出为UTF-8，解决中文乱码问题
+    env = QProcessEnvironment.systemEnvironment()
+    env.insert("PYTHONIOENCODING", "utf-8")
+    if has_child_limits(limits):
+        env.insert(LIMITS_ENV, encode_limits(limits))
+    process.setProcessEnvironment(env)
+    if limits and limits['process_group'] and PROCESS_GROUPS:
+        process.setUnixProcessParameters(QProcess.UnixProcessFlag.CreateNewSession)
+    return process
+
+
+def signal_process(process, group, force):
+    """向脚本发送SIGTERM（force时为SIGKILL）。group为进程组ID时发给整个组，首进程已退出时组内剩下的进程也能收到。"""
+    if group and os.name == 'posix':
+        try:
+            os.killpg(group, signal.SIGKILL if force else signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass # 组内的进程都已退出
+    elif force or os.name != 'posix':
+        process.kill() # Windows没有SIGTERM，terminate只对有窗口的程序有效
+    else:
+        process.terminate()
+
+
+def pid_in_use(pid):
+    """是否有进程使用这个进程号（包括属于其他用户的进程）。"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WarmPool(QObject):
+    """某个脚本的预热解释器池。
+
+    池中的每个解释器都已经启动并导入了配置的模块，正阻塞在标准输入上等待任务。
+    取出一个解释器后立即在后台补充新的解释器。每个解释器只运行一次脚本，
+    因此脚本之间不会共享状态，退出码也就是脚本自身的退出码。
+    """
+    reaped = Signal() # 没有运行脚本的解释器已被回收，它的资源占用不属于任何一次运行
+
+    def __init__(self, script_id, size, preload, limits=None, parent=None):
+        super().__init__(parent)
+        self.script_id = script_id
+        self.size = size
+        self.preload = list(preload)
+        self.limits = limits
+        self.working_dir = str(Path(script_id).parent)
+        self.idle = deque() # 空闲的预热解释器
+        self.stopped = False
+
+    def fill(self):
+        """补充解释器，直到空闲数量达到池大小。"""
+        while not self.stopped and len(self.idle) < self.size:
+            process = create_script_process(self.working_dir, self.limits)
+            process.finished.connect(lambda code, status, p=process: self.discard(p))
+            process.start(PYTHON_EXECUTABLE, [WARM_WORKER_SCRIPT] + self.preload)
+            self.idle.append(process)
+
+    def discard(self, process):
+        """空闲的解释器意外退出时将其移出池。"""
+        if process in self.idle:
+            self.idle.remove(process)
+            print(f"警告: '{Path(self.script_id).name}' 的预热解释器意外退出 (退出码: {process.exitCode()})")
+            process.deleteLater()
+            self.reaped.emit()
+
+    def acquire(self):
+        """取出一个正在运行的空闲解释器，没有可用的则返回None。"""
+        process = None
+        while self.idle:
+            candidate = self.idle[0]
+            state = candidate.state()
+            if state == QProcess.ProcessState.Starting:
+                break # 还在启动，这次冷启动，把它留给之后的触发
+            self.idle.popleft()
+            if state == QProcess.ProcessState.Running:
+                process = candidate
+                break
+            # 还没有回收的进程在销毁时回收
+            candidate.destroyed.connect(lambda *_: self.reaped.emit())
+            candidate.deleteLater()
+        if process is not None:
+            # 新解释器的启动和导入会与刚取出的运行争抢CPU，使这次触发反而更慢：
+            # 等这次运行结束后再补充，运行时间较长时最晚在WARM_REFILL_DELAY_MS后补充
+            process.finished.connect(lambda *_: QTimer.singleShot(0, self, self.fill))
+            QTimer.singleShot(WARM_REFILL_DELAY_MS, self, self.fill)
+        elif len(self.idle) < self.size:
+            QTimer.singleShot(0, self, self.fill)
+        return process
+
+    def stop(self):
+        """关闭所有空闲的解释器。"""
+        self.stopped = True
+        while self.idle:
+            process = self.idle.popleft()
+            process.kill()
+            process.waitForFinished(1000)
+        self.reaped.emit()
+
+
+class ScriptRunner(QObject):
+    """处理外部脚本的运行，允许多个脚本并发执行。
+
+    每次触发先按脚本的策略(policy)进入等待队列，再由调度器在不超过
+    每个脚本的实例上限(max_instances)和全局并发槽位(MAX_CONCURRENCY)的前提下
+    按优先级(priority)启动。每次运行用一个递增的运行ID区分。
+
+    触发时可以附带一个凭据(ticket)，运行结束、被取消或被拒绝时通过
+    ticket_resolved信号报告结果，供服务器回复等待中的客户端。
+
+    ScriptRunner可以移到单独的线程中运行。脚本输出放入output信箱，
+    通过output_ready通知取件方；其余信号都只携带简单的值，可以跨线程排队投递。
+    """
+    setup_error = Signal(str, str)      # 脚本ID, 消息
+    output_ready = Signal()             # output信箱中有新的输出
+    run_recorded = Signal(str, dict)    # 脚本ID, 本次运行的统计记录（见build_record）
+    started_message = Signal(str)       # 脚本ID
+    finished_message = Signal(str, str) # 脚本ID, 消息
+    queue_changed = Signal(str, int, int) # 脚本ID, 运行中的实例数, 排队数
+    ticket_resolved = Signal(str, str, int) # 凭据, 结果(finished/crashed/cancelled/rejected), 退出码
+    stream_updated = Signal(str)        # 脚本ID，streams中该脚本有新事件
+
+    def __init__(self, parent=None, write_run_logs=True):
+        super().__init__(parent)
+        self.write_run_logs = write_run_logs # 是否为每次运行写入完整日志文件
+        self.processes = {}  # 运行ID -> {process: QProcess, script_id: str, name: str, slots: int, tickets: list, decoders: dict, terminal: TerminalStream, ...统计字段}
+        self.pending = []    # 等待启动的触发[-优先级, 序号, 脚本ID, 参数, 凭据列表, 触发时刻, 缓存键, ScriptInput或None]组成的堆
+        self.output_buffers = {} # 运行ID -> 尚未刷新到界面的输出片段列表
+        self.flush_timers = {}   # 运行ID -> 控制刷新频率的QTimer
+        self.log_files = {}      # 运行ID -> 本次运行的日志文件对象
+        self.run_logs = {}       # 日志文件名前缀（脚本文件名）-> 已有的运行日志[路径, 字节数]组成的deque，从旧到新排列
+        self.log_entries = {}    # 运行ID -> 本次运行在run_logs中的条目，日志关闭时记下字节数
+        self.log_paths = {}      # 脚本ID -> 最近一次运行的日志文件路径（只在运行线程中赋值，其他线程可以读取）
+        self.output_since = {}   # 运行ID -> 缓冲区中最早一段输出的读取时刻
+        self.script_configs = {str(Path(config['script']).absolute()): config for config in SCRIPTS_CONFIG}
+        self.warm_pools = {}     # 脚本ID -> WarmPool
+        self.limits = {}         # 脚本ID -> 进程限制（见process_limits.parse_limits），没有配置的脚本不在其中
+        self.stats = RunStatistics({script_id: config['name'] for script_id, config in self.script_configs.items()}, STATS_HISTORY_RUNS)
+        self.output = OutputMailbox(self.stats)
+        self.streams = {script_id: ScriptStream() for script_id in self.script_configs} # 脚本ID -> 供订阅者读取的输出，只在运行线程中访问
+        self.results = ResultCache(self.script_configs) # 启用了cache_ttl的脚本最近的运行结果，只在运行线程中访问
+        # 定时触发、文件触发与TCP触发走同一个入口
+        self.scheduler = Scheduler(self.script_configs, self.is_busy, self)
+        self.scheduler.trigger_script.connect(self.run_script)
+        self.watcher = DirectoryWatcher(self.script_configs, self.is_busy, self)
+        self.watcher.trigger_script.connect(self.run_script)
+        self.queue_changed.connect(self.watcher.on_queue_changed)
+        self.reaped_usage = children_usage() # 上一次运行结束时已回收子进程的累计资源占用
+        self.sample_timer = QTimer(self) # 定期采样运行中脚本的资源占用
+        self.sample_timer.setInterval(RESOURCE_SAMPLE_MS)
+        self.sample_timer.timeout.connect(self.sample_all)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.setSingleShot(True)
+        self.metrics_timer.setInterval(METRICS_WRITE_INTERVAL_MS)
+        self.metrics_timer.timeout.connect(self.write_metrics_file)
+        self._run_ids = itertools.count(1)
+        self._pending_seq = itertools.count()
+
+        for script_id, script_config in self.script_configs.items():
+            policy = script_config.get('output_overflow', 'drop_oldest')
+            if policy not in OUTPUT_OVERFLOW_POLICIES:
+                print(f"警告: '{script_config['name']}' 的output_overflow配置 '{policy}' 无效，使用drop_oldest。")
+                script_config['output_overflow'] = 'drop_oldest'
+            try:
+                limits = parse_limits(script_config)
+            except ValueError as e:
+                print(f"警告: '{script_config['name']}' 的进程限制配置无效，已忽略: {e}")
+                limits = None
+            if limits is not None:
+                if limits['process_group'] and not PROCESS_GROUPS:
+                    print(f"警告: 当前平台不支持process_group，'{script_config['name']}' 终止时只结束脚本自身。")
+                self.limits[script_id] = limits
+
+    @Slot()
+    def start(self):
+        """启动预热解释器池、资源采样和定时触发。移到其他线程时应在该线程中调用，使子进程和定时器归属于运行线程。"""
+        self.sample_timer.start()
+        self.scheduler.start()
+        self.watcher.start()
+        for script_id, script_config in self.script_configs.items():
+            if script_config.get('warm_workers', 0) > 0:
+                pool = WarmPool(script_id, script_config['warm_workers'], script_config.get('preload', []),
+                                self.limits.get(script_id), self)
+                pool.reaped.connect(self.reset_reaped_usage)
+                pool.fill()
+                self.warm_pools[script_id] = pool
+
+    def runs_of(self, script_id):
+        """返回该脚本正在运行的所有运行ID。"""
+        return [run_id for run_id, run in self.processes.items() if run['script_id'] == script_id]
+
+    def is_running(self, script_id):
+        return bool(self.runs_of(script_id))
+
+    def queued_count(self, script_id):
+        return sum(1 for entry in self.pending if entry[2] == script_id)
+
+    def is_busy(self, script_id):
+        """脚本正在运行或有等待中的请求。"""
+        return self.is_running(script_id) or self.queued_count(script_id) > 0
+
+    def used_slots(self):
+        return sum(run['slots'] for run in self.processes.values())
+
+    def load(self):
+        """返回本机的负载：运行中和排队的任务数、占用的槽位和CPU负载，供LOAD命令和分派使用。"""
+        return {'running': len(self.processes), 'queued': len(self.pending), 'slots': self.used_slots(), 'cpu': cpu_load()}
+
+    def notify_queue(self, script_id):
+        self.queue_changed.emit(script_id, len(self.runs_of(script_id)), self.queued_count(script_id))
+
+    def resolve_tickets(self, tickets, result, exit_code=-1):
+        for ticket in tickets:
+            self.ticket_resolved.emit(ticket, result, exit_code)
+
+    def drop_pending(self, script_id):
+        """丢弃该脚本所有等待中的请求，返回丢弃的数量。"""
+        dropped = [entry for entry in self.pending if entry[2] == script_id]
+        if dropped:
+            self.pending = [entry for entry in self.pending if entry[2] != script_id]
+            heapq.heapify(self.pending)
+            for entry in dropped:
+                self.results.untrack(entry[6], entry[4])
+                if entry[7] is not None:
+                    entry[7].discard()
+                self.resolve_tickets(entry[4], 'cancelled')
+        return len(dropped)
+
+    @Slot(str, list, str)
+    @Slot(str, list, str, object)
+    def run_script(self, script_path_str, args=None, ticket='', script_input=None):
+        """按脚本的策略提交一次运行请求，由调度器以非阻塞方式启动。
+
+        script_input为写入标准输入的bytes或ScriptInput，有数据时写完后关闭脚本的标准输入。
+        """
+        if isinstance(script_input, (bytes, bytearray)):
+            script_input = ScriptInput(bytes(script_input)) if script_input else None
+        script_path = Path(script_path_str)
+        script_id = str(script_path.absolute())
+        config = self.script_configs.get(script_id, {})
+        policy = config.get('policy', 'toggle')
+
+        # toggle策略：如果脚本已在运行（或在排队），则终止它
+        if policy == 'toggle' and (self.is_running(script_id) or self.queued_count(script_id)):
+            self.stop_script(script_id) # 注意：这里是停止脚本，不是重启。如果需要带新参数重启，请使用replace策略。
+            if script_input is not None:
+                script_input.discard()
+            self.resolve_tickets([ticket] if ticket else [], 'rejected')
+            return True # 返回True表示执行了操作
+
+        if not script_path.exists():
+            error_msg = f"错误: 脚本 '{script_path_str}' 未找到。"
+            print(error_msg)
+            self.setup_error.emit(script_id, error_msg)
+            if script_input is not None:
+                script_input.discard()
+            self.resolve_tickets([ticket] if ticket else [], 'rejected')
+            return False
+
+        args = list(args or [])
+        tickets = [ticket] if ticket else []
+        cache_key = self.results.key(script_id, args) if script_input is None else None # 结果取决于额外输入时不缓存
+        if policy == 'coalesce':
+            # 最多保留一个等待中的请求，新的请求只更新它的参数，并共享它的运行结果
+            for entry in self.pending:
+                if entry[2] == script_id:
+                    entry[3] = args
+                    if entry[7] is not None:
+                        entry[7].discard()
+                    entry[7] = script_input
+                    entry[4].extend(tickets)
+                    if entry[6] != cache_key:
+                        self.results.untrack(entry[6], entry[4])
+                        self.results.track(cache_key, entry[4])
+                        entry[6] = cache_key
+                    print(f"'{script_path.name}' 已有等待中的请求，已合并。")
+                    return True
+        elif policy == 'replace':
+            # 丢弃等待中的请求并终止正在运行的实例，新请求在槽位释放后启动
+            self.drop_pending(script_id)
+            for run_id in self.runs_of(script_id):
+                self.stop_run(run_id)
+
+        self.results.track(cache_key, tickets)
+        heapq.heappush(self.pending, [-config.get('priority', 0), next(self._pending_seq), script_id, args, tickets, time.monotonic(), cache_key, script_input])
+        self.dispatch()
+        self.notify_queue(script_id)
+        return True
+
+    def dispatch(self):
+        """按优先级启动等待中的请求，直到实例上限或全局槽位用尽。"""
+        free_slots = MAX_CONCURRENCY - self.used_slots() if MAX_CONCURRENCY > 0 else None
+        waiting = []
+        started = set()
+        while self.pending:
+            entry = heapq.heappop(self.pending)
+            script_id = entry[2]
+            config = self.script_configs.get(script_id, {})
+            slots = config.get('slots', 1)
+            if len(self.runs_of(script_id)) >= config.get('max_instances', 1):
+                # 受自身实例上限限制时，不阻塞其他脚本
+                waiting.append(entry)
+                continue
+            if free_slots is not None and slots > free_slots:
+                # 全局槽位不足时保持优先级顺序，避免高优先级的大任务被一直插队
+                waiting.append(entry)
+                break
+            self.start_run(script_id, entry[3], slots, entry[4], entry[5], entry[6], entry[7])
+            started.add(script_id)
+            if free_slots is not None:
+                free_slots -= slots
+        for entry in waiting:
+            heapq.heappush(self.pending, entry)
+        for script_id in started:
+            self.notify_queue(script_id)
+
+    def start_run(self, script_id, args, slots, tickets=(), enqueued=None, cache_key=None, script_input=None):
+        """立即启动脚本的一次运行。enqueued是收到触发的时刻，用于统计启动延迟；cache_key不为None时保存运行结果；
+        script_input为ScriptInput时设置它的环境变量并写入标准输入。"""
+        script_path = Path(script_id)
+        run_id = next(self._run_ids)
+        arguments = [script_id] + args
+        limits = self.limits.get(script_id)
+
+        pool = self.warm_pools.get(script_id)
+        process = pool.acquire() if pool else None
+        warm = process is not None
+        if not warm:
+            process = create_script_process(str(script_path.parent), limits)
+            if script_input is not None and script_input.env:
+                env = process.processEnvironment()
+                for key, value in script_input.env.items():
+                    env.insert(key, value)
+                process.setProcessEnvironment(env)
+        self.processes[run_id] = {'process': process, 'script_id': script_id, 'name': script_path.name, 'slots': slots, 'tickets': list(tickets),
+                                  # 每个管道一个增量解码器，跨读取拆开的多字节字符不会丢失
+                                  'decoders': {'stdout': codecs.getincrementaldecoder('utf-8')('replace'),
+                                               'stderr': codecs.getincrementaldecoder('utf-8')('replace')},
+                                  'terminal': TerminalStream(),
+                                  # 统计：触发时刻、进程启动时刻、资源采样（预热解释器扣除取出前的基数）和输出量
+                                  'enqueued': enqueued or time.monotonic(), 'start_time': None, 'started_at': time.time(),
+                                  'warm': warm, 'usage': None, 'usage_base': None, 'output_bytes': 0, 'output_lines': 0,
+                                  # 结果缓存：缓存键和截取的输出（超出上限时只保留末尾）
+                                  'cache_key': cache_key, 'capture': [], 'capture_size': 0, 'capture_truncated': False,
+                                  'input': script_input,
+                                  # 终止：启用process_group时的进程组ID，以及是否已经发送过SIGTERM
+                                  'group': None, 'stopping': False}
+        self.results.track(cache_key, self.processes[run_id]['tickets'], previous=tickets)
+
+        shown = ' '.join(arguments[:LOGGED_ARGUMENTS]) + (f" ...（共 {len(args)} 个参数）" if len(arguments) > LOGGED_ARGUMENTS else "")
+        print(f"开始运行脚本: {PYTHON_EXECUTABLE} {shown}")
+        self.open_run_log(run_id, script_path)
+        self.streams.setdefault(script_id, ScriptStream()).begin_run(run_id)
+        self.emit_log(run_id, f"--- 开始运行脚本: {script_path.name} ---\n")
+        self.started_message.emit(script_id)
+
+        # 连接信号和槽
+        process.readyReadStandardOutput.connect(lambda: self.handle_stdout(run_id))
+        process.readyReadStandardError.connect(lambda: self.handle_stderr(run_id))
+        process.finished.connect(lambda code, status: self.on_finished(run_id, code, status))
+        stdin = script_input.data if script_input is not None else b''
+        upload = script_input.upload if script_input is not None else None
+        if warm:
+            # 预热解释器已在运行，下发任务（和标准输入的数据）后关闭标准输入
+            job = {'script': script_id, 'args': args, 'cwd': str(script_path.parent)}
+            if script_input is not None and script_input.env:
+                job['env'] = script_input.env
+            process.write((json.dumps(job) + '\n').encode('utf-8') + stdin)
+            if upload is not None:
+                upload.attach(process) # 请求体收完后由它关闭标准输入
+            else:
+                process.closeWriteChannel()
+            self.on_started(run_id)
+            # 取出前可能已有输出（例如预先导入时的警告）
+            self.handle_stdout(run_id)
+            self.handle_stderr(run_id)
+        else:
+            process.started.connect(lambda: self.on_started(run_id))
+            process.start(PYTHON_EXECUTABLE, [LIMITS_SCRIPT] + arguments if has_child_limits(limits) else arguments)
+            # 进程启动前写入的数据由QProcess缓存，启动后送出
+            if stdin:
+                process.write(stdin)
+            if upload is not None:
+                upload.attach(process)
+            elif stdin:
+                process.closeWriteChannel()
+
+        if limits and limits['process_group'] and PROCESS_GROUPS:
+            # 首进程就是组长，记下组ID，它退出后仍能终止组内剩下的进程
+            self.processes[run_id]['group'] = process.processId() or None
+        print(f"'{script_id}' 已启动{'（预热解释器）' if warm else ''}。")
+        return run_id
+
+    def on_started(self, run_id):
+        """进程已启动（或预热解释器已接到任务），记录启动延迟和资源基数。"""
+        run = self.processes.get(run_id)
+        if run is None:
+            return
+        run['start_time'] = time.monotonic()
+        self.stats.observe('spawn_latency', run['script_id'], run['start_time'] - run['enqueued'])
+        if run['warm']:
+            # 预热解释器在取出前已经有了导入模块的CPU时间和内存，作为基数扣除
+            run['usage_base'] = run['usage'] = read_proc_usage(run['process'].processId())
+
+    def sample_usage(self, run_id):
+        """采样一次运行的资源占用；峰值内存取历次采样的最大值，进程退出中读不到的字段沿用上一次。"""
+        run = self.processes.get(run_id)
+        if run is None or run['start_time'] is None:
+            return
+        usage = read_proc_usage(run['process'].processId())
+        if usage is None:
+            return
+        previous = run['usage'] or {}
+        for key, value in previous.items():
+            if usage.get(key) is None:
+                usage[key] = value
+        if previous.get('peak_rss') and usage['peak_rss'] < previous['peak_rss']:
+            usage['peak_rss'] = previous['peak_rss']
+        run['usage'] = usage
+
+    def sample_all(self):
+        for run_id in list(self.processes):
+            self.sample_usage(run_id)
+
+    def take_reaped_usage(self):
+        """返回上次调用以来回收的子进程的资源占用，即getrusage(RUSAGE_CHILDREN)的差值。
+
+        QProcess自己回收子进程，拿不到单个进程的wait4结果；但它在发出finished之前
+        刚刚回收了该进程，而每个进程的回收和finished依次处理，所以在on_finished中取得的差值
+        是这次运行（包括脚本等待过的子进程）的占用。没有运行脚本的预热解释器被回收时
+        由reset_reaped_usage重设基数，不计入下一次运行；守护程序以其他方式启动并回收的子进程
+        仍会计入下一次结束的运行，因此这是近似值。峰值内存是所有子进程的最大值，只有创造了新的最大值时才能得知。
+        """
+        current = children_usage()
+        previous, self.reaped_usage = self.reaped_usage, current
+        if current is None or previous is None:
+            return None
+        delta = {key: current[key] - previous[key] for key in ('cpu_user', 'cpu_sys', 'read_bytes', 'write_bytes')}
+        delta['peak_rss'] = current['peak_rss'] if current['peak_rss'] > previous['peak_rss'] else None
+        return delta
+
+    def reset_reaped_usage(self):
+        """回收了不属于任何运行的子进程（空闲的预热解释器）后重设基数。"""
+        self.reaped_usage = children_usage()
+
+    def build_record(self, run_id, exit_code, result, reaped=None):
+        """生成一次运行的统计记录，可以直接序列化为JSON。
+
+        CPU和磁盘I/O优先使用进程回收时的准确值（reaped），不支持时使用/proc的最后一次采样；
+        峰值内存取运行期间/proc采样和回收时得到的最大值。预热解释器扣除取出前的基数。
+        """
+        run = self.processes[run_id]
+        usage = reaped or run['usage'] or {}
+        base = run['usage_base'] or {}
+
+        def used(key):
+            if usage.get(key) is None:
+                return None
+            return round(usage[key] - (base.get(key) or 0), 3)
+
+        peaks = [value for value in ((run['usage'] or {}).get('peak_rss'), (reaped or {}).get('peak_rss')) if value]
+
+        start_time = run['start_time']
+        return {
+            'run_id': run_id,
+            'started_at': round(run['started_at'], 3),       # 开始运行的时间戳（秒）
+            'wall': round(time.monotonic() - start_time, 3) if start_time else 0.0, # 运行耗时（秒）
+            'spawn_latency': round(start_time - run['enqueued'], 4) if start_time else None, # 触发到启动（秒）
+            'exit_code': exit_code,
+            'status': result,                                 # finished/crashed
+            'warm': run['warm'],
+            'cpu_user': used('cpu_user'),                     # 用户态CPU（秒）
+            'cpu_sys': used('cpu_sys'),                       # 内核态CPU（秒）
+            'peak_rss': max(peaks) if peaks else None,       # 峰值常驻内存（字节）
+            'read_bytes': used('read_bytes'),                 # 磁盘读取（字节）
+            'write_bytes': used('write_bytes'),               # 磁盘写入（字节）
+            'output_bytes': run['output_bytes'],
+            'output_lines': run['output_lines'],
+        }
+
+    def write_metrics_file(self):
+        """以Prometheus文本格式写出所有脚本的统计，先写临时文件再替换，读取方不会看到半个文件。"""
+        path = Path(METRICS_FILE)
+        temp_path = path.with_name(path.name + '.tmp')
+        try:
+            snapshot = self.results.annotate(self.stats.snapshot(), self.stats.names)
+            temp_path.write_text(render_prometheus(snapshot), encoding='utf-8')
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"警告: 无法写入指标文件 '{path}': {e}")
+
+    @Slot()
+    def shutdown(self):
+        """程序退出前关闭所有预热解释器，并终止仍在运行的脚本。"""
+        self.sample_timer.stop()
+        self.scheduler.stop()
+        self.watcher.stop()
+        if self.metrics_timer.isActive():
+            self.metrics_timer.stop()
+            self.write_metrics_file()
+        for pool in self.warm_pools.values():
+            pool.stop()
+        for entry in self.pending:
+            self.results.untrack(entry[6], entry[4])
+            if entry[7] is not None:
+                entry[7].discard()
+            self.resolve_tickets(entry[4], 'cancelled')
+        self.pending = []
+        # 先向所有脚本发送SIGTERM，再分别等待各自的stop_timeout，超时仍未退出的强制结束
+        running = list(self.processes.values())
+        started = time.monotonic()
+        for run in running:
+            signal_process(run['process'], run['group'], force=self.stop_timeout(run['script_id']) <= 0)
+        for run in running:
+            deadline = started + self.stop_timeout(run['script_id'])
+            run['process'].waitForFinished(max(0, int((deadline - time.monotonic()) * 1000)))
+            self.force_stop(run['process'], run['group'])
+            run['process'].waitForFinished(1000)
+
+    @Slot(str)
+    def stop_script(self, script_id):
+        """停止脚本所有正在运行的实例，并清空它的等待队列。"""
+        queued = self.drop_pending(script_id)
+        stopped = [self.stop_run(run_id) for run_id in self.runs_of(script_id)]
+        self.notify_queue(script_id)
+        return any(stopped) or queued > 0
+
+    def stop_timeout(self, script_id):
+        limits = self.limits.get(script_id)
+        return limits['stop_timeout'] if limits else 0
+
+    def stop_run(self, run_id):
+        """终止一次正在运行的实例。
+
+        配置了stop_timeout时先发送SIGTERM，让脚本有机会清理，超时仍未退出再发送SIGKILL；
+        已经在等待退出时再次终止则立即发送SIGKILL。启用process_group时信号发给整个进程组。
+        """
+        run = self.processes.get(run_id)
+        if run and run['process'].state() != QProcess.ProcessState.NotRunning:
+            self.flush_output(run_id)
+            timeout = self.stop_timeout(run['script_id'])
+            graceful = timeout > 0 and not run['stopping']
+            detail = f"（SIGTERM，{timeout:g} 秒后强制结束）" if graceful else ""
+            self.emit_log(run_id, f"--- 正在终止脚本: {run['name']}{detail} ---\n")
+            signal_process(run['process'], run['group'], force=not graceful)
+            if graceful:
+                run['stopping'] = True
+                process, group = run['process'], run['group']
+                QTimer.singleShot(int(timeout * 1000), self, lambda: self.force_stop(process, group))
+            return True
+        return False
+
+    def force_stop(self, process, group):
+        """stop_timeout到期：脚本（或组内的其他进程）还没有退出时发送SIGKILL。
+
+        脚本已退出并被回收时，只在组ID仍属于这次运行时才发给进程组：组内还有进程时内核不会把这个号分配给新进程，
+        因此有进程使用首进程的进程号，说明组已经不存在、这个号被重新分配了，不能再发送信号。
+        """
+        if any(run['process'] is process for run in self.processes.values()):
+            signal_process(process, group, force=True)
+        elif group and not pid_in_use(group):
+            signal_process(process, group, force=True)
+
+    def handle_stdout(self, run_id):
+        if run_id in self.processes:
+            run = self.processes[run_id]
+            data = run['process'].readAllStandardOutput().data()
+            run['output_bytes'] += len(data)
+            run['output_lines'] += data.count(b'\n')
+            self.buffer_output(run_id, run['decoders']['stdout'].decode(data))
+
+    def handle_stderr(self, run_id):
+        if run_id in self.processes:
+            run = self.processes[run_id]
+            data = run['process'].readAllStandardError().data()
+            run['output_bytes'] += len(data)
+            run['output_lines'] += data.count(b'\n')
+            self.buffer_output(run_id, run['decoders']['stderr'].decode(data))
+
+    def buffer_output(self, run_id, text):
+        """将输出暂存到本次运行的缓冲区，由定时器按限定的频率合并后一次性发出。"""
+        if not text:
+            return
+        if run_id not in self.output_buffers:
+            self.output_since[run_id] = time.monotonic()
+        self.output_buffers.setdefault(run_id, []).append(text)
+        timer = self.flush_timers.get(run_id)
+        if timer is None:
+            config = self.script_configs.get(self.processes[run_id]['script_id'], {})
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.setInterval(config.get('flush_interval_ms', DEFAULT_FLUSH_INTERVAL_MS))
+            timer.timeout.connect(lambda: self.flush_output(run_id))
+            self.flush_timers[run_id] = timer
+        if not timer.isActive():
+            timer.start()
+
+    def flush_output(self, run_id, final=False):
+        """把缓冲区中的输出合并，经终端解析折叠进度更新后发出。"""
+        run = self.processes[run_id]
+        if final:
+            # 进程结束时输出解码器中残留的不完整字节
+            for decoder in run['decoders'].values():
+                self.output_buffers.setdefault(run_id, []).append(decoder.decode(b'', final=True))
+        chunks = self.output_buffers.pop(run_id, None)
+        since = self.output_since.pop(run_id, None)
+        if not chunks:
+            return
+        text = run['terminal'].feed(''.join(chunks), final)
+        if text:
+            if run['cache_key'] is not None:
+                self.capture_output(run, text)
+            self.emit_log(run_id, text, since)
+        # 输出活跃的脚本随刷新一起采样，短时间运行的脚本也能得到资源数据
+        self.sample_usage(run_id)
+
+    def capture_output(self, run, text):
+        """截取运行的输出供结果缓存保存，超过上限两倍时合并并只保留末尾，避免每次都复制。"""
+        limit = self.results.output_limit(run['cache_key'])
+        run['capture'].append(text)
+        run['capture_size'] += len(text)
+        if run['capture_size'] > 2 * limit:
+            kept = merge_output(run['capture']).lstrip('\r')[-limit:]
+            run['capture'] = [kept]
+            run['capture_size'] = len(kept)
+            run['capture_truncated'] = True
+
+    def open_run_log(self, run_id, script_path):
+        """为本次运行创建只追加的日志文件，界面中被淘汰的旧输出可以从这里找回。"""
+        if not self.write_run_logs:
+            return
+        log_path = LOG_DIR / f"{script_path.stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{run_id}.log"
+        try:
+            LOG_DIR.mkdir(parents=True, exist_ok=True)
+            self.log_files[run_id] = open(log_path, 'ab', buffering=0)
+            self.log_paths[str(script_path)] = log_path
+        except OSError as e:
+            print(f"警告: 无法创建日志文件 '{log_path}': {e}")
+            return
+        logs = self.run_logs.get(script_path.stem)
+        if logs is None:
+            # 第一次运行时列出目录中已有的日志（包括刚创建的这个），之后在内存中记录
+            logs = self.run_logs[script_path.stem] = self.scan_run_logs(script_path.stem)
+        else:
+            logs.append([log_path, 0])
+        self.log_entries[run_id] = next((entry for entry in reversed(logs) if entry[0] == log_path), None)
+        self.prune_run_logs(script_path, logs)
+
+    @staticmethod
+    def scan_run_logs(stem):
+        """列出LOG_DIR中该脚本已有的运行日志，按修改时间从旧到新排列。"""
+        pattern = re.compile(re.escape(stem) + r'-\d{8}-\d{6}-\d+\.log')
+        found = []
+        try:
+            with os.scandir(LOG_DIR) as entries:
+                for entry in entries:
+                    if pattern.fullmatch(entry.name) and entry.is_file():
+                        info = entry.stat()
+                        found.append((info.st_mtime, entry.name, info.st_size))
+        except OSError as e:
+            print(f"警告: 无法列出日志目录 '{LOG_DIR}': {e}")
+        return deque([LOG_DIR / name, size] for _, name, size in sorted(found))
+
+    def prune_run_logs(self, script_path, logs):
+        """删除该脚本最旧的运行日志，使文件数和总字节数不超过run_log_keep和run_log_max_bytes。
+
+        同名的脚本共用日志文件名前缀，也共用这些上限。仍在写入的日志（同时运行的实例）不会删除。
+        """
+        config = self.script_configs.get(str(script_path), {})
+        keep = config.get('run_log_keep', RUN_LOG_KEEP)
+        max_bytes = config.get('run_log_max_bytes', RUN_LOG_MAX_BYTES)
+        writing = {entry[0] for entry in self.log_entries.values() if entry is not None}
+        total = sum(size for _, size in logs) if max_bytes > 0 else 0
+        while logs and (0 < keep < len(logs) or 0 < max_bytes < total):
+            path, size = logs[0]
+            if path in writing:
+                break
+            logs.popleft()
+            total -= size
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"警告: 无法删除旧的日志文件 '{path}': {e}")
+
+    def emit_log(self, run_id, text, since=None):
+        """追加写入本次运行的日志文件和订阅流，并放入output信箱。since是读到这段输出的时刻。"""
+        data = text.encode('utf-8')
+        log_file = self.log_files.get(run_id)
+        if log_file:
+            log_file.write(data)
+        script_id = self.processes[run_id]['script_id']
+        self.streams[script_id].append(run_id, data)
+        self.stream_updated.emit(script_id)
+        config = self.script_configs.get(script_id, {})
+        if self.output.put(script_id, text, config.get('max_pending_output', DEFAULT_MAX_PENDING_OUTPUT),
+                           config.get('output_overflow', 'drop_oldest'), since):
+            self.output_ready.emit()
+
+    def on_finished(self, run_id, exit_code, exit_status):
+        status_text = "正常退出" if exit_status == QProcess.ExitStatus.NormalExit else "崩溃"
+        result = 'finished' if exit_status == QProcess.ExitStatus.NormalExit else 'crashed'
+        run = self.processes[run_id]
+        if run['input'] is not None:
+            run['input'].discard() # 脚本没有读完的请求体不再写给它
+        reaped = self.take_reaped_usage()
+        self.flush_output(run_id, final=True)
+        record = self.build_record(run_id, exit_code, result, reaped)
+        self.stats.record_run(run['script_id'], record)
+        if run['cache_key'] is not None:
+            # 在回复等待者之前保存，收到结果的客户端立即重复触发时可以命中缓存
+            self.results.untrack(run['cache_key'], run['tickets'])
+            if result == 'finished':
+                output = merge_output(run['capture']).lstrip('\r')
+                limit = self.results.output_limit(run['cache_key'])
+                self.results.store(run['cache_key'], exit_code, result, output[-limit:],
+                                   run['capture_truncated'] or len(output) > limit)
+        self.emit_log(run_id, f"\n--- 脚本运行结束 (退出码: {exit_code}, 状态: {status_text}) ---\n")
+        self.streams[run['script_id']].end_run(run_id, exit_code, result)
+        self.stream_updated.emit(run['script_id'])
+        log_file = self.log_files.pop(run_id, None)
+        if log_file:
+            entry = self.log_entries.pop(run_id, None)
+            if entry is not None:
+                entry[1] = log_file.tell()
+            log_file.close()
+        timer = self.flush_timers.pop(run_id, None)
+        if timer:
+            timer.stop()
+            timer.deleteLater()
+        self.output_buffers.pop(run_id, None)
+        self.output_since.pop(run_id, None)
+        del self.processes[run_id]
+        run['process'].deleteLater()
+
+        # 先更新实例数，接收方处理finished_message时据此判断是否还有实例在运行
+        self.notify_queue(run['script_id'])
+        self.finished_message.emit(run['script_id'], f"{run['name']} 脚本运行结束 (退出码: {exit_code}, 状态: {status_text})")
+        self.resolve_tickets(run['tickets'], result, exit_code)
+        self.run_recorded.emit(run['script_id'], record)
+        if METRICS_FILE and not self.metrics_timer.isActive():
+            self.metrics_timer.start()
+        # 释放的槽位交给等待中的请求
+        self.dispatch()
+
+
+def disconnect_socket(socket):
+    """待发送的数据发完后断开连接，适用于TCP和本地套接字。"""
+    if isinstance(socket, QLocalSocket):
+        socket.disconnectFromServer()
+    else:
+        socket.disconnectFromHost()
+
+
+class Server(QObject):
+    """服务器，在TCP端口和/或本地套接字上监听触发消息，两者的命令完全相同。
+
+    本地套接字不经过网络协议栈，由套接字文件的权限（LOCAL_SOCKET_MODE、LOCAL_SOCKET_GROUP）控制哪些用户可以连接。
+    同时支持两种协议，由连接的第一个字节区分：
+    - 旧协议：发送一条秘密消息，收到一行回复后服务器断开连接。
+    - 分帧协议：每条命令占一行，格式为"#<请求ID> <命令> [参数]"。连接保持打开，
+      可以连续发送多条命令，每条命令对应一行"#<请求ID> OK|ERR <说明>"回复。
+      TAIL/SUBSCRIBE在OK之后继续以同一个请求ID推送START/DATA/DROP/END事件行。
+      TRIGGER/RUN可以附带"键=值"参数和请求体长度，请求体紧跟在命令行之后发送，边接收边写入脚本的标准输入。
+
+    配置了PEERS时同时是分派器：没有请求体的触发由PeerDispatcher转发给负载最低的节点（可能是本机），
+    节点的回复原样转交给客户端。其他节点发来的连接以PEER命令开头，上面的触发总是在本机运行。
+
+    启用了结果缓存的脚本，重复的触发在缓存有效期内直接用缓存的结果回复，
+    与排队或运行中的相同请求合并，都不会再次运行脚本。
+    """
+    trigger_script = Signal(str, list, str) # 触发信号，参数为脚本路径、参数列表和凭据（不等待结果时为空）
+    trigger_input = Signal(str, list, str, object) # 附带参数或请求体的触发，最后一个参数为ScriptInput
+    start_failed = Signal(str)              # 无法监听端口或本地套接字，参数为错误说明
+
+    def __init__(self, parent=None, stats=None, streams=None, cache=None, load=None, port=PORT, local_socket=LOCAL_SOCKET):
+        super().__init__(parent)
+        self.stats = stats     # ScriptRunner.stats，供STATS命令查询
+        self.streams = streams # ScriptRunner.streams，供TAIL/SUBSCRIBE读取，服务器必须与ScriptRunner在同一线程
+        self.cache = cache     # ScriptRunner.results，同样要求在同一线程
+        self.load = load       # ScriptRunner.load，供LOAD命令和分派使用，同样要求在同一线程
+        self.port = port
+        self.local_socket = local_socket
+        self._server = QTcpServer(self) if ENABLE_TCP_SERVER else None
+        self._local_server = QLocalServer(self) if local_socket else None
+        self.dispatcher = None
+        if PEERS:
+            self.dispatcher = PeerDispatcher(PEERS, (HOST, port), self.local_load, DISPATCH_INCLUDE_SELF,
+                                             PEER_CHECK_INTERVAL_MS, PEER_TIMEOUT_MS, self)
+        for listener in (self._server, self._local_server):
+            if listener is not None:
+                listener.setMaxPendingConnections(LISTEN_BACKLOG)
+                listener.setListenBacklogSize(LISTEN_BACKLOG)
+                listener.newConnection.connect(lambda l=listener: self.on_new_connection(l))
+        self.message_map = {config['msg'].decode('utf-8'): {'script': config['script'], 'args': config.get('args', []),
+                                                            'max_payload': config.get('max_payload_bytes', MAX_PAYLOAD_BYTES)}
+                            for config in SCRIPTS_CONFIG}
+        # 是其他消息前缀的消息，旧协议下需要等到换行或超时才能确定
+        self.ambiguous_messages = {m for m in self.message_map if any(o != m and o.startswith(m) for o in self.message_map)}
+        self.connections = {} # socket -> {mode: None/'legacy'/'framed'/'closed', buffer: bytearray, upload: 正在接收的PayloadUpload, peer: 是否来自其他节点}
+        self.commands = {     # 分帧协议的命令 -> 处理函数(socket, 请求ID, 参数)
+            'TRIGGER': self.cmd_trigger,
+            'RUN': self.cmd_run,
+            'PING': self.cmd_ping,
+            'STATS': self.cmd_stats,
+            'RESULT': self.cmd_result,
+            'TAIL': self.cmd_tail,
+            'SUBSCRIBE': self.cmd_subscribe,
+            'UNSUBSCRIBE': self.cmd_unsubscribe,
+            'PEER': self.cmd_peer,
+            'LOAD': self.cmd_load,
+            'PEERS': self.cmd_peers,
+        }
+        self.subscriptions = {} # socket -> {请求ID: 订阅}
+        self.subscribers = {}   # 脚本ID -> {(socket, 请求ID): 订阅}
+        self.waiting = {} # 凭据 -> (socket, 请求ID)，等待运行结果的RUN命令
+        self._tickets = itertools.count(1)
+
+    @Slot()
+    def start(self):
+        error = None
+        if self._server is not None and not self._server.listen(QHostAddress(HOST), self.port):
+            error = f"无法在端口 {self.port} 上启动服务器。"
+        elif self._local_server is not None:
+            reason = self.listen_local()
+            if reason:
+                error = f"无法在本地套接字 '{self.local_socket}' 上启动服务器: {reason}"
+        if error:
+            if self._server is not None:
+                self._server.close()
+            print(f"错误: {error}")
+            self.start_failed.emit(error)
+            return False
+        if self._server is not None:
+            print(f"正在监听 {self._server.serverAddress().toString()}:{self._server.serverPort()}...")
+        if self._local_server is not None:
+            print(f"正在监听本地套接字 {self._local_server.fullServerName()}...")
+        if self.dispatcher is not None:
+            print(f"分派模式: {len(self.dispatcher.links)} 个节点{'和本机' if DISPATCH_INCLUDE_SELF else ''}")
+            self.dispatcher.start()
+        return True
+
+    def listen_local(self):
+        """监听本地套接字并设置文件的组和权限，成功时返回None，失败时返回原因。"""
+        path = str(Path(self.local_socket).absolute())
+        if os.path.lexists(path):
+            probe = QLocalSocket()
+            probe.connectToServer(path)
+            if probe.waitForConnected(LOCAL_PROBE_MS):
+                probe.abort()
+                return "已有其他程序在监听"
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                return "该路径已存在且不是套接字文件"
+            QLocalServer.removeServer(path) # 上次没有正常退出时留下的套接字文件
+        # 先创建只有本用户能连接的套接字，改好组之后再放开权限，中间不会有其他用户连进来
+        self._local_server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
+        if not self._local_server.listen(path):
+            return self._local_server.errorString()
+        if os.name == 'posix': # Windows上是命名管道，没有文件权限
+            try:
+                if LOCAL_SOCKET_GROUP is not None:
+                    import grp
+                    group = LOCAL_SOCKET_GROUP if isinstance(LOCAL_SOCKET_GROUP, int) else grp.getgrnam(LOCAL_SOCKET_GROUP).gr_gid
+                    os.chown(path, -1, group)
+                os.chmod(path, LOCAL_SOCKET_MODE)
+            except (OSError, KeyError) as e:
+                self._local_server.close()
+                return f"无法设置组和权限: {e}"
+        return None
+
+    @Slot()
+    def stop(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        for listener in (self._server, self._local_server):
+            if listener is not None:
+                listener.close() # 本地套接字的文件随之删除
+        # 先断开现有连接，不要等到套接字随服务器析构时才发出disconnected
+        for socket in list(self.connections):
+            socket.abort()
+        print("服务器已停止。")
+
+    def on_new_connection(self, listener):
+        while listener.hasPendingConnections():
+            socket = listener.nextPendingConnection()
+            socket.setReadBufferSize(SOCKET_READ_BUFFER)
+            self.connections[socket] = {'mode': None, 'buffer': bytearray(), 'watching': False, 'upload': None, 'peer': False}
+            socket.readyRead.connect(lambda s=socket: self.on_ready_read(s))
+            socket.disconnected.connect(lambda s=socket: self.on_disconnected(s))
+
+    def on_disconnected(self, socket):
+        # 套接字析构时可能再次发出disconnected，只在第一次时清理
+        state = self.connections.pop(socket, None)
+        if state is not None:
+            if state['upload'] is not None:
+                state['upload'].abort()
+            for subscription in list(self.subscriptions.get(socket, {}).values()):
+                self.end_subscription(subscription)
+            socket.deleteLater()
+
+    def on_ready_read(self, socket):
+        state = self.connections.get(socket)
+        if state is None or state['mode'] == 'closed':
+            socket.readAll()
+            return
+        if state['upload'] is not None:
+            # 正在接收请求体，按它能接收的量读取
+            self.process_frames(socket, state)
+            return
+        state['buffer'] += socket.readAll().data()
+        if state['mode'] is None:
+            state['mode'] = 'framed' if state['buffer'].startswith(FRAME_PREFIX) else 'legacy'
+            if state['mode'] == 'legacy':
+                # 旧客户端的消息可能被TCP拆成多段，超时后按已收到的内容处理
+                QTimer.singleShot(LEGACY_WAIT_MS, socket, lambda: self.answer_legacy(socket))
+        if state['mode'] == 'framed':
+            self.process_frames(socket, state)
+        else:
+            data = state['buffer']
+            message = data.decode('utf-8', errors='replace').strip()
+            if (message in self.message_map and message not in self.ambiguous_messages) or b'\n' in data or len(data) > MAX_LINE_BYTES:
+                self.answer_legacy(socket)
+
+    def answer_legacy(self, socket):
+        """按旧协议处理一条消息：回复一行后断开连接。"""
+        state = self.connections.get(socket)
+        if state is None or state['mode'] != 'legacy':
+            return
+        state['mode'] = 'closed'
+        data = state['buffer'].decode('utf-8', errors='replace').strip()
+        print(f"收到数据: {data}")
+        if data in self.message_map and self.dispatch('TRIGGER', data, lambda status, text, peer: self.answer_forwarded(socket, status, text, peer)):
+            return
+        script_name, outcome = self.trigger(data)
+        if isinstance(outcome, dict):
+            socket.write(f"确认: {script_name} 的结果已缓存，未重新运行。\n".encode('utf-8'))
+        elif script_name:
+            socket.write(f"确认: 已触发 {script_name}。\n".encode('utf-8'))
+        else:
+            socket.write("错误: 无效消息。\n".encode('utf-8'))
+        disconnect_socket(socket)
+
+    def answer_forwarded(self, socket, status, text, peer):
+        """按旧协议回复转发给其他节点的触发。"""
+        if socket not in self.connections:
+            return
+        if status == 'OK':
+            socket.write(f"确认: {text}（节点 {peer}）。\n".encode('utf-8'))
+        else:
+            socket.write(f"错误: {text}。\n".encode('utf-8'))
+        disconnect_socket(socket)
+
+    def process_frames(self, socket, state):
+        """处理缓冲区中所有完整的命令行，不完整的部分留待下次读取。"""
+        buffer = state['buffer']
+        while socket in self.connections:
+            upload = state['upload']
+            if upload is not None:
+                if not buffer:
+                    buffer += socket.read(upload.capacity()).data()
+                consumed = upload.feed(buffer)
+                del buffer[:consumed]
+                if upload.remaining:
+                    if consumed == 0:
+                        return # 等脚本读走数据(drained)后再继续读取连接
+                    continue
+                state['upload'] = None
+                buffer += socket.readAll().data()
+                continue
+            newline = buffer.find(b'\n')
+            if newline == -1:
+                if len(buffer) > MAX_LINE_BYTES:
+                    self.reply(socket, '-', 'ERR', "命令过长。")
+                    state['mode'] = 'closed'
+                    disconnect_socket(socket)
+                return
+            line = bytes(buffer[:newline]).decode('utf-8', errors='replace').strip()
+            del buffer[:newline + 1]
+            if line:
+                self.handle_frame(socket, line)
+
+    def handle_frame(self, socket, line):
+        head, _, rest = line.partition(' ')
+        request_id = head[1:]
+        if not head.startswith('#') or not request_id:
+            self.reply(socket, '-', 'ERR', "格式错误，应为'#<请求ID> <命令> [参数]'。")
+            return
+        command, _, argument = rest.strip().partition(' ')
+        handler = self.commands.get(command.upper())
+        if handler is None:
+            self.reply(socket, request_id, 'ERR', f"未知命令: {command}")
+            return
+        handler(socket, request_id, argument.strip())
+
+    def reply(self, socket, request_id, status, text):
+        """按分帧协议回复一行。"""
+        socket.write(f"#{request_id} {status} {text}\n".encode('utf-8'))
+
+    def parse_trigger(self, argument):
+        """解析TRIGGER/RUN的参数"<消息> [键=值 ...] [请求体字节数]"，返回(消息, 参数字典, 请求体字节数或None)。
+
+        整个参数就是一条消息时不再拆分；值按URL编码（%XX）解码。格式错误时抛出ValueError。
+        """
+        if argument in self.message_map:
+            return argument, {}, None
+        words = argument.split()
+        if not words:
+            raise ValueError("无效消息")
+        message, *tokens = words
+        params = {}
+        length = None
+        for index, token in enumerate(tokens):
+            key, separator, value = token.partition('=')
+            if separator:
+                if not PARAM_NAME.fullmatch(key):
+                    raise ValueError(f"参数名无效: {key}")
+                params[key] = unquote(value)
+            elif token.isdigit() and index == len(tokens) - 1:
+                length = int(token)
+            else:
+                raise ValueError(f"无法识别的参数: {token}")
+        return message, params, length
+
+    def prepare_input(self, socket, request_id, argument):
+        """解析附带参数和请求体的触发，返回(消息, ScriptInput或None)；出错时回复ERR并返回(None, None)。
+
+        有请求体时立即开始接收：请求无效时丢弃请求体，连接上的后续命令照常处理；
+        请求体超过上限时回复ERR后断开连接，不读取它。
+        """
+        try:
+            message, params, length = self.parse_trigger(argument)
+        except ValueError as e:
+            self.reply(socket, request_id, 'ERR', str(e))
+            return None, None
+        if not params and length is None:
+            return message, None
+        script_info = self.message_map.get(message)
+        if length is not None and script_info is not None and length > script_info['max_payload']:
+            self.reply(socket, request_id, 'ERR', f"请求体 {length} 字节超过上限 {script_info['max_payload']} 字节，连接已关闭")
+            self.connections[socket]['mode'] = 'closed'
+            disconnect_socket(socket)
+            return None, None
+        env = {f"DAEMON_PARAM_{key.upper()}": value for key, value in params.items()}
+        upload = None
+        if length is not None:
+            env['DAEMON_PAYLOAD_BYTES'] = str(length)
+            # 先登记再触发：脚本可能在触发的过程中就启动，请求体之后的数据不能被当作命令解析
+            upload = PayloadUpload(length)
+            upload.drained.connect(lambda s=socket: self.on_upload_drained(s))
+            self.connections[socket]['upload'] = upload
+            if script_info is None:
+                upload.discard()
+        return message, ScriptInput(upload=upload, env=env)
+
+    def dispatch(self, command, argument, callback):
+        """分派模式下把TRIGGER/RUN转发给负载最低的节点，已转发时返回True，callback(状态, 文本, 节点)收到节点的回复。
+
+        由本机处理（选中本机、不是分派模式、附带请求体或消息无效）时返回False。请求体不经过转发。
+        """
+        if self.dispatcher is None:
+            return False
+        try:
+            message, _, length = self.parse_trigger(argument)
+        except ValueError:
+            return False
+        if length is not None or message not in self.message_map:
+            return False
+        return self.dispatcher.forward(command, argument, callback)
+
+    def relay(self, socket, request_id, status, text):
+        """把节点的回复转交给客户端，客户端已断开时丢弃。"""
+        if socket in self.connections:
+            self.reply(socket, request_id, status, text)
+
+    def cache_key(self, script_info):
+        if self.cache is None:
+            return None
+        return self.cache.key(str(Path(script_info['script']).absolute()), script_info['args'])
+
+    def trigger(self, message, ticket='', script_input=None):
+        """触发消息对应的脚本，返回(脚本文件名, 结果)；消息无效时返回(None, None)。
+
+        结果为'triggered'（已提交运行）、'joined'（合并到排队或运行中的相同请求），
+        或者命中时缓存的结果字典（不会运行脚本，凭据也不会被处理）。附带script_input时不使用缓存。
+        """
+        script_info = self.message_map.get(message)
+        if script_info is None:
+            return None, None
+        script_name = Path(script_info['script']).name
+        if script_input is not None:
+            self.trigger_input.emit(script_info['script'], script_info['args'], ticket, script_input)
+            return script_name, 'triggered'
+        key = self.cache_key(script_info)
+        if key is not None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                return script_name, entry
+            if self.cache.join(key, ticket):
+                return script_name, 'joined'
+            self.cache.miss(key)
+        self.trigger_script.emit(script_info['script'], script_info['args'], ticket)
+        return script_name, 'triggered'
+
+    def cmd_trigger(self, socket, request_id, argument):
+        if not self.connections[socket]['peer'] and self.dispatch(
+                'TRIGGER', argument, lambda status, text, peer: self.relay(socket, request_id, status, f"{text} @{peer}" if status == 'OK' else text)):
+            return
+        message, script_input = self.prepare_input(socket, request_id, argument)
+        if message is None:
+            return
+        script_name, outcome = self.trigger(message, script_input=script_input)
+        if isinstance(outcome, dict):
+            self.reply(socket, request_id, 'OK', f"已缓存 {script_name}")
+        elif outcome == 'joined':
+            self.reply(socket, request_id, 'OK', f"已合并 {script_name}")
+        elif script_name:
+            self.reply(socket, request_id, 'OK', f"已触发 {script_name}")
+        else:
+            self.reply(socket, request_id, 'ERR', "无效消息")
+
+    def cmd_run(self, socket, request_id, argument):
+        """触发脚本，等运行结束后再回复"OK <退出码> <finished|crashed>"；命中缓存时立即回复，末尾附加"cached"。"""
+        if not self.connections[socket]['peer'] and self.dispatch(
+                'RUN', argument, lambda status, text, peer: self.relay(socket, request_id, status, text)):
+            return
+        message, script_input = self.prepare_input(socket, request_id, argument)
+        if message is None:
+            return
+        ticket = str(next(self._tickets))
+        self.waiting[ticket] = (socket, request_id)
+        script_name, outcome = self.trigger(message, ticket, script_input)
+        if isinstance(outcome, dict):
+            del self.waiting[ticket]
+            self.reply(socket, request_id, 'OK', f"{outcome['exit_code']} {outcome['status']} cached")
+        elif not script_name:
+            del self.waiting[ticket]
+            self.reply(socket, request_id, 'ERR', "无效消息")
+
+    def cmd_result(self, socket, request_id, message):
+        """回复一行JSON格式的缓存结果（退出码、状态、输出等），不会触发脚本。"""
+        script_info = self.message_map.get(message)
+        if script_info is None:
+            self.reply(socket, request_id, 'ERR', "无效消息")
+            return
+        key = self.cache_key(script_info)
+        if key is None:
+            self.reply(socket, request_id, 'ERR', "该脚本没有启用结果缓存")
+            return
+        entry = self.cache.get(key, count=False)
+        if entry is None:
+            self.reply(socket, request_id, 'ERR', "没有有效的缓存结果")
+            return
+        result = {field: value for field, value in entry.items() if field != 'stored'}
+        result['age'] = round(time.monotonic() - entry['stored'], 3)
+        self.reply(socket, request_id, 'OK', json.dumps(result, ensure_ascii=False))
+
+    def cmd_ping(self, socket, request_id, argument):
+        self.reply(socket, request_id, 'OK', "PONG")
+
+    def cmd_peer(self, socket, request_id, argument):
+        """标记连接来自其他节点的分派器，之后这个连接上的触发都在本机运行。"""
+        self.connections[socket]['peer'] = True
+        self.reply(socket, request_id, 'OK', "PEER")
+
+    def local_load(self):
+        return self.load() if self.load is not None else {'running': 0, 'queued': 0, 'slots': 0, 'cpu': cpu_load()}
+
+    def cmd_load(self, socket, request_id, argument):
+        """回复一行JSON：本机运行中和排队的任务数、占用的槽位和每个CPU核心的平均负载。"""
+        self.reply(socket, request_id, 'OK', json.dumps(self.local_load()))
+
+    def cmd_peers(self, socket, request_id, argument):
+        """回复一行JSON：本机的负载和分派器看到的各节点状态。"""
+        if self.dispatcher is None:
+            self.reply(socket, request_id, 'ERR', "没有配置PEERS，未启用分派")
+            return
+        self.reply(socket, request_id, 'OK', json.dumps(self.dispatcher.snapshot(), ensure_ascii=False))
+
+    def cmd_stats(self, socket, request_id, message):
+        """回复一行JSON格式的运行统计；参数为触发消息时只回复该脚本，并附带运行历史。"""
+        if self.stats is None:
+            self.reply(socket, request_id, 'ERR', "统计不可用")
+            return
+        if message:
+            script_info = self.message_map.get(message)
+            if script_info is None:
+                self.reply(socket, request_id, 'ERR', "无效消息")
+                return
+            snapshot = self.stats.snapshot([str(Path(script_info['script']).absolute())], with_history=True)
+        else:
+            snapshot = self.stats.snapshot()
+        if self.cache is not None:
+            self.cache.annotate(snapshot, self.stats.names)
+        self.reply(socket, request_id, 'OK', json.dumps(snapshot, ensure_ascii=False))
+
+    def cmd_tail(self, socket, request_id, argument):
+        """跟随脚本当前这次运行的输出，运行结束时以END事件结束；脚本没有在运行时跟随下一次运行。"""
+        self.subscribe(socket, request_id, argument, follow_all=False)
+
+    def cmd_subscribe(self, socket, request_id, argument):
+        """接收脚本之后所有运行的事件，直到UNSUBSCRIBE或连接断开。"""
+        self.subscribe(socket, request_id, argument, follow_all=True)
+
+    def cmd_unsubscribe(self, socket, request_id, argument):
+        """取消本连接上请求ID为参数的订阅。"""
+        subscription = self.subscriptions.get(socket, {}).get(argument.lstrip('#'))
+        if subscription is None:
+            self.reply(socket, request_id, 'ERR', "没有这个订阅")
+            return
+        self.end_subscription(subscription)
+        self.reply(socket, request_id, 'OK', "已取消订阅")
+
+    def parse_stream_argument(self, argument):
+        """拆分"<消息> [偏移] [drop|disconnect]"，返回(脚本ID, 偏移, 策略)，消息无效时脚本ID为None。"""
+        parts = argument.split(' ')
+        offset, policy = None, 'drop'
+        if argument not in self.message_map:
+            while len(parts) > 1:
+                if parts[-1] in SLOW_SUBSCRIBER_POLICIES:
+                    policy = parts.pop()
+                elif re.fullmatch(r'-?\d+', parts[-1]):
+                    offset = int(parts.pop())
+                else:
+                    break
+        script_info = self.message_map.get(' '.join(parts))
+        script_id = str(Path(script_info['script']).absolute()) if script_info else None
+        return script_id, offset, policy
+
+    def subscribe(self, socket, request_id, argument, follow_all):
+        """创建订阅并回复"OK <正在跟随的运行ID或->"，然后立即推送已有的事件。
+
+        指定偏移时从当前运行输出的该字节处开始（负数表示从末尾往前数），
+        否则TAIL从当前运行的开头开始，SUBSCRIBE只接收之后的新事件。
+        """
+        if self.streams is None:
+            self.reply(socket, request_id, 'ERR', "订阅不可用")
+            return
+        script_id, offset, policy = self.parse_stream_argument(argument)
+        if script_id is None:
+            self.reply(socket, request_id, 'ERR', "无效消息")
+            return
+        if request_id in self.subscriptions.get(socket, {}):
+            self.reply(socket, request_id, 'ERR', "请求ID已被订阅使用")
+            return
+        stream = self.streams[script_id]
+        run_id = stream.latest_run()
+        subscription = {'socket': socket, 'request_id': request_id, 'script_id': script_id, 'stream': stream,
+                        'follow_all': follow_all, 'policy': policy, 'run_id': run_id,
+                        'cursor': stream.next_seq, 'skip': 0, 'position': stream.position}
+        missed = 0
+        if run_id is not None and (offset is not None or not follow_all):
+            subscription['cursor'], subscription['skip'], missed = stream.locate(run_id, offset or 0)
+            if subscription['cursor'] < stream.next_seq:
+                subscription['position'] = stream.entry(subscription['cursor']).position + subscription['skip']
+        state = self.connections[socket]
+        if not state['watching']:
+            # 只有订阅过的连接需要在数据发出后继续推送
+            socket.bytesWritten.connect(lambda _, s=socket: self.on_bytes_written(s))
+            state['watching'] = True
+        self.subscriptions.setdefault(socket, {})[request_id] = subscription
+        self.subscribers.setdefault(script_id, {})[(socket, request_id)] = subscription
+        self.reply(socket, request_id, 'OK', str(run_id) if run_id is not None else '-')
+        if missed:
+            self.reply(socket, request_id, 'DROP', str(missed))
+        self.pump(subscription)
+
+    def end_subscription(self, subscription):
+        key = (subscription['socket'], subscription['request_id'])
+        self.subscriptions.get(key[0], {}).pop(key[1], None)
+        if not self.subscriptions.get(key[0], True):
+            del self.subscriptions[key[0]]
+        self.subscribers.get(subscription['script_id'], {}).pop(key, None)
+
+    @staticmethod
+    def stream_frame(entry, skip=0):
+        """把事件编码为回复行中请求ID之后的部分。"""
+        if entry.kind == 'start':
+            text = f"START {entry.run_id}"
+        elif entry.kind == 'end':
+            text = f"END {entry.run_id} {entry.result[0]} {entry.result[1]}"
+        else:
+            payload = json.dumps(entry.data[skip:].decode('utf-8', errors='replace'), ensure_ascii=False)
+            text = f"DATA {entry.run_id} {entry.run_offset + skip} {payload}"
+        return (text + "\n").encode('utf-8')
+
+    def pump(self, subscription):
+        """在连接发送积压允许的范围内推送订阅者还没读到的事件，其余的等客户端读走后再推送。
+
+        推送只受这个连接自身的积压限制，读取慢的订阅者只会落后，不会拖慢脚本或其他订阅者；
+        落后到未读的输出已被淘汰时，按订阅的策略发送DROP后跳到最早保留的事件，或断开连接。
+        """
+        socket, stream = subscription['socket'], subscription['stream']
+        prefix = f"#{subscription['request_id']} ".encode('utf-8')
+        budget = SUBSCRIBER_BACKLOG_BYTES - socket.bytesToWrite()
+        lines = []
+        finished = False
+        while budget > 0 and subscription['cursor'] < stream.next_seq:
+            if subscription['cursor'] < stream.first_seq:
+                if subscription['policy'] == 'disconnect':
+                    socket.write(b''.join(lines))
+                    self.end_subscription(subscription)
+                    self.reply(socket, subscription['request_id'], 'ERR', "读取太慢，未读的输出已被淘汰，连接即将断开")
+                    self.connections[socket]['mode'] = 'closed'
+                    disconnect_socket(socket)
+                    return
+                line = prefix + f"DROP {stream.first_position - subscription['position']}\n".encode('utf-8')
+                subscription.update(cursor=stream.first_seq, skip=0, position=stream.first_position)
+            else:
+                entry = stream.entry(subscription['cursor'])
+                subscription['cursor'] += 1
+                if entry.kind == 'data':
+                    subscription['position'] = entry.position + len(entry.data)
+                if not subscription['follow_all']:
+                    if subscription['run_id'] is None and entry.kind == 'start':
+                        subscription['run_id'] = entry.run_id
+                    if entry.run_id != subscription['run_id']:
+                        continue
+                if subscription['skip']:
+                    line = prefix + self.stream_frame(entry, subscription['skip'])
+                    subscription['skip'] = 0
+                else:
+                    if entry.frame is None:
+                        entry.frame = self.stream_frame(entry) # 所有订阅者共用同一份编码
+                    line = prefix + entry.frame
+                if entry.kind == 'end' and not subscription['follow_all']:
+                    finished = True
+            lines.append(line)
+            budget -= len(line)
+            if finished:
+                break
+        if lines:
+            socket.write(b''.join(lines))
+        if finished:
+            self.end_subscription(subscription)
+
+    @Slot(str)
+    def on_stream_updated(self, script_id):
+        for subscription in list(self.subscribers.get(script_id, {}).values()):
+            self.pump(subscription)
+
+    def on_upload_drained(self, socket):
+        if socket in self.connections:
+            self.on_ready_read(socket)
+
+    def on_bytes_written(self, socket):
+        for subscription in list(self.subscriptions.get(socket, {}).values()):
+            self.pump(subscription)
+
+    @Slot(str, str, int)
+    def on_ticket_resolved(self, ticket, result, exit_code):
+        """把RUN命令对应运行的结果回复给仍然连接着的客户端。"""
+        socket, request_id = self.waiting.pop(ticket, (None, None))
+        if socket not in self.connections:
+            return
+        if result in ('finished', 'crashed'):
+            self.reply(socket, request_id, 'OK', f"{exit_code} {result}")
+        elif result == 'cancelled':
+            self.reply(socket, request_id, 'ERR', "cancelled 请求在启动前被取消")
+        else:
+            self.reply(socket, request_id, 'ERR', "rejected 请求被拒绝（脚本不存在或已按toggle策略终止）")
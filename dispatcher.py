@@ -0,0 +1,209 @@
+# 多实例分派：把收到的触发转发给负载最低的守护程序节点
+import os
+import json
+import time
+import itertools
+
+from PySide6.QtCore import QObject, QTimer
+from PySide6.QtNetwork import QTcpSocket, QAbstractSocket
+
+DEFAULT_CHECK_INTERVAL_MS = 1000 # 向各节点查询负载（健康检查）的间隔（毫秒）
+DEFAULT_PEER_TIMEOUT_MS = 3000   # 节点超过这么久没有回复负载查询就视为不可用（毫秒）
+CPU_SATURATED = 1.0 # 每个CPU核心的平均负载达到此值视为已饱和，只在所有节点都饱和时才分派给它
+
+
+def parse_peer(text):
+    """把"主机:端口"解析为(主机, 端口)，格式无效时抛出ValueError。"""
+    host, separator, port = str(text).rpartition(':')
+    if not separator or not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"节点 '{text}' 应为 主机:端口 格式")
+    return host.strip('[]'), int(port)
+
+
+def cpu_load():
+    """返回本机最近1分钟每个CPU核心的平均负载，不支持的平台返回0。"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def load_score(load, pending=0):
+    """负载越低排序越靠前：未饱和的节点优先，其次比较运行中和排队的任务数，最后比较CPU负载。"""
+    return (load['cpu'] >= CPU_SATURATED, load['running'] + load['queued'] + pending, load['cpu'])
+
+
+class PeerLink(QObject):
+    """到一个节点的持久连接（分帧协议），用于健康检查和转发触发。
+
+    连接建立后先发送PEER，节点对这个连接上的TRIGGER/RUN总是在本机运行，不会再转发，多个节点互相配置为对方的节点也不会形成循环。
+    """
+
+    def __init__(self, host, port, timeout_ms, parent=None):
+        super().__init__(parent)
+        self.host = host
+        self.port = port
+        self.address = f"{host}:{port}"
+        self.timeout = timeout_ms / 1000
+        self.healthy = False
+        self.load = {'running': 0, 'queued': 0, 'cpu': 0.0}
+        self.assigned = 0      # 上次负载报告之后分派给它、尚未反映在报告中的触发数
+        self.probe_sent = None # 未回复的负载查询的发送时刻
+        self.probe_assigned = 0
+        self.forwarded = 0     # 累计转发的触发数
+        self.failures = 0      # 累计变为不可用的次数
+        self.pending = {}      # 请求ID -> 回调(状态, 文本)
+        self.buffer = bytearray()
+        self._ids = itertools.count(1)
+        self.socket = QTcpSocket(self)
+        self.socket.connected.connect(self.on_connected)
+        self.socket.readyRead.connect(self.on_ready_read)
+        self.socket.disconnected.connect(self.on_lost)
+        self.socket.errorOccurred.connect(self.on_lost)
+
+    def connect(self):
+        if self.socket.state() == QAbstractSocket.SocketState.UnconnectedState:
+            self.socket.connectToHost(self.host, self.port)
+
+    def is_connected(self):
+        return self.socket.state() == QAbstractSocket.SocketState.ConnectedState
+
+    def send(self, command, argument, callback):
+        request_id = str(next(self._ids))
+        self.pending[request_id] = callback
+        self.socket.write(f"#{request_id} {command} {argument}\n".encode('utf-8'))
+
+    def on_connected(self):
+        self.send('PEER', '', lambda status, text: None)
+        self.probe()
+
+    def probe(self):
+        """发送负载查询；上一次查询超时未回复时把节点标记为不可用。"""
+        if not self.is_connected():
+            self.connect()
+            return
+        if self.probe_sent is not None:
+            if time.monotonic() - self.probe_sent > self.timeout:
+                # 节点没有响应（例如已挂起），断开连接让转发给它的请求以ERR结束，之后重新连接
+                self.mark_unhealthy("负载查询超时")
+                self.socket.abort()
+            return
+        self.probe_sent = time.monotonic()
+        self.probe_assigned = self.assigned
+        self.send('LOAD', '', self.on_load)
+
+    def on_load(self, status, text):
+        self.probe_sent = None
+        if status != 'OK':
+            self.mark_unhealthy(text)
+            return
+        try:
+            report = json.loads(text)
+            self.load = {'running': int(report['running']), 'queued': int(report['queued']), 'cpu': float(report['cpu'])}
+        except (ValueError, KeyError, TypeError):
+            self.mark_unhealthy(f"无法解析负载报告: {text}")
+            return
+        self.assigned = max(0, self.assigned - self.probe_assigned)
+        if not self.healthy:
+            print(f"节点 {self.address} 可用。")
+            self.healthy = True
+
+    def mark_unhealthy(self, reason):
+        if self.healthy:
+            print(f"警告: 节点 {self.address} 不可用: {reason}")
+            self.healthy = False
+            self.failures += 1
+
+    def on_ready_read(self):
+        self.buffer += self.socket.readAll().data()
+        *lines, rest = self.buffer.split(b'\n')
+        self.buffer = bytearray(rest)
+        for line in lines:
+            head, _, reply = line.decode('utf-8', errors='replace').partition(' ')
+            status, _, text = reply.partition(' ')
+            callback = self.pending.pop(head[1:], None)
+            if callback is not None:
+                callback(status, text)
+
+    def on_lost(self, *_):
+        """连接失败或断开：标记为不可用，等待回复的请求以ERR结束。"""
+        if self.is_connected():
+            return # 已连接时的一般错误（例如写入超时）之后还会收到disconnected
+        self.mark_unhealthy(self.socket.errorString())
+        self.probe_sent = None
+        self.assigned = 0
+        self.buffer.clear()
+        pending, self.pending = self.pending, {}
+        for callback in pending.values():
+            callback('ERR', f"与节点 {self.address} 的连接中断，结果未知")
+
+    def snapshot(self):
+        return {'address': self.address, 'healthy': self.healthy, **self.load, 'assigned': self.assigned,
+                'forwarded': self.forwarded, 'failures': self.failures, 'in_flight': len(self.pending)}
+
+
+class PeerDispatcher(QObject):
+    """定期查询各节点的负载，把触发转发给负载最低的节点。
+
+    节点报告运行中和排队的任务数以及CPU负载（见load_score）；两次报告之间分派给节点的触发计入它的负载，
+    一批触发不会都涌向同一个节点。连接失败或查询超时的节点不参与分派，恢复后自动重新加入；
+    没有可用节点时由本机运行。include_self为True时本机也作为候选，负载相同时优先本机。
+    """
+
+    def __init__(self, peers, own_address, local_load, include_self=True,
+                 interval_ms=DEFAULT_CHECK_INTERVAL_MS, timeout_ms=DEFAULT_PEER_TIMEOUT_MS, parent=None):
+        super().__init__(parent)
+        self.local_load = local_load # 返回本机负载字典的函数
+        self.include_self = include_self
+        self.handled_locally = 0
+        self.links = []
+        own_host, own_port = own_address
+        for peer in peers:
+            try:
+                host, port = parse_peer(peer)
+            except ValueError as e:
+                print(f"警告: {e}，已忽略。")
+                continue
+            if port == own_port and host in (own_host, 'localhost', '127.0.0.1'):
+                continue # 所有实例共用一份配置时，列表中包含本机自己
+            self.links.append(PeerLink(host, port, timeout_ms, self))
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.check)
+
+    def start(self):
+        for link in self.links:
+            link.connect()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        for link in self.links:
+            link.socket.abort()
+
+    def check(self):
+        for link in self.links:
+            link.probe()
+
+    def choose(self):
+        """返回负载最低的可用节点，选中本机或没有可用节点时返回None。"""
+        candidates = [(load_score(link.load, link.assigned), 1, index, link)
+                      for index, link in enumerate(self.links) if link.healthy and link.is_connected()]
+        if self.include_self or not candidates:
+            candidates.append((load_score(self.local_load()), 0, -1, None))
+        return min(candidates)[3]
+
+    def forward(self, command, argument, callback):
+        """把命令转发给负载最低的节点，回调参数为(状态, 文本, 节点地址)；应由本机处理时返回False。"""
+        link = self.choose()
+        if link is None:
+            self.handled_locally += 1
+            return False
+        link.assigned += 1
+        link.forwarded += 1
+        link.send(command, argument, lambda status, text: callback(status, text, link.address))
+        return True
+
+    def snapshot(self):
+        return {'local': dict(self.local_load(), handled=self.handled_locally),
+                'peers': [link.snapshot() for link in self.links]}
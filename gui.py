@@ -1,167 +1,285 @@
 # 守护程序主应用
+import os
 import sys
+
+if __name__ == "__main__" and "--headless" in sys.argv:
+    # 无界面模式不导入QtWidgets/QtGui，直接交给headless.py
+    from headless import main
+    sys.exit(main())
+
+import re
+import mmap
+from collections import deque
+from datetime import datetime
 from pathlib import Path
-import shutil
- 
-from PySide6.QtCore import QObject, Signal, Slot, QProcess, QTimer, QProcessEnvironment, QEvent, Qt, QSettings
-from PySide6.QtNetwork import QTcpServer, QHostAddress
-from PySide6.QtWidgets import QApplication, QMainWindow, QSystemTrayIcon, QMenu, QMessageBox, QStyle, QTextEdit, QVBoxLayout, QWidget, QFontDialog, QTabWidget, QPushButton, QHBoxLayout
-from PySide6.QtGui import QIcon, QAction, QTextCursor, QFont, QPalette
-
-# --- 配置文件检查 ---
-# 在导入配置之前，检查config.py是否存在。如果不存在，则从config_sample.py复制。
-CURRENT_SCRIPT_DIR = Path(__file__).parent
-config_path = CURRENT_SCRIPT_DIR / "config.py"
-sample_config_path = CURRENT_SCRIPT_DIR / "config_sample.py"
-
-if not config_path.exists():
-    print(f"'config.py' 未找到。正在尝试从 '{sample_config_path.name}' 创建...")
-    if sample_config_path.exists():
-        try:
-            shutil.copy(sample_config_path, config_path)
-            print(f"成功创建 'config.py'。请根据您的需求编辑该文件后重新启动程序。")
-        except Exception as e:
-            print(f"错误: 从模板创建 'config.py' 失败: {e}")
-            sys.exit(1) # 关键文件创建失败，退出程序
-    else:
-        print(f"错误: '{config_path.name}' 和 '{sample_config_path.name}' 都不存在。程序无法启动。")
-        sys.exit(1) # 缺少关键文件，退出程序
-
-# --- 配置 ---
-from config import SCRIPTS_CONFIG, HOST, PORT, ENABLE_TCP_SERVER
-
-PYTHON_EXECUTABLE = sys.executable # 使用运行此脚本的同一个Python解释器
-# ---------------------
-
-class ScriptRunner(QObject):
-    """处理外部脚本的运行，允许多个脚本并发执行。"""
-    setup_error = Signal(str, str)      # 脚本ID, 消息
-    log_message = Signal(str, str)      # 脚本ID, 消息
-    started_message = Signal(str)       # 脚本ID
-    finished_message = Signal(str, str) # 脚本ID, 消息
-
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.processes = {}  # 脚本ID -> {process: QProcess, name: str}
 
-    @Slot(str)
-    def run_script(self, script_path_str, args=None):
-        """以非阻塞方式运行目标python脚本。"""
-        script_path = Path(script_path_str)
-        script_id = str(script_path.absolute())
-
-        # 如果脚本已在运行，则终止它
-        if script_id in self.processes and self.processes[script_id]['process'].state() != QProcess.ProcessState.NotRunning:
-            self.stop_script(script_id) # 注意：这里是停止脚本，不是重启。如果需要带新参数重启，逻辑会更复杂。
-            return True # 返回True表示执行了操作
-
-        if not script_path.exists():
-            error_msg = f"错误: 脚本 '{script_path_str}' 未找到。"
-            print(error_msg)
-            self.setup_error.emit(script_id, error_msg)
-            return False
-
-        arguments = [script_id]
-        if args:
-            arguments.extend(args)
-
-        print(f"开始运行脚本: {PYTHON_EXECUTABLE} {' '.join(arguments)}")
-        self.log_message.emit(script_id, f"--- 开始运行脚本: {script_path.name} ---\n")
-        self.started_message.emit(script_id)
-        
-        process = QProcess()
-        self.processes[script_id] = {'process': process, 'name': script_path.name}
-        process.setWorkingDirectory(str(script_path.absolute().parent))
+from PySide6.QtCore import Signal, Slot, QTimer, QEvent, Qt, QSettings, QPoint, QThread, QMetaObject
+from PySide6.QtWidgets import QApplication, QMainWindow, QSystemTrayIcon, QMenu, QMessageBox, QStyle, QTextEdit, QVBoxLayout, QWidget, QFontDialog, QPushButton, QHBoxLayout, QDialog, QPlainTextEdit, QLabel, QLineEdit, QCheckBox, QListWidget, QListWidgetItem, QStackedWidget
+from PySide6.QtGui import QIcon, QAction, QTextCursor, QFont, QPalette, QTextCharFormat, QSyntaxHighlighter, QTextBlockUserData
+
+from daemon_core import CURRENT_SCRIPT_DIR, SCRIPTS_CONFIG, ENABLE_TCP_SERVER, LOCAL_SOCKET, ScriptRunner, Server, collapse_carriage_returns, merge_output
+
+# 匹配连续的中文字符，用于把文本切分成“中文段”和“非中文段”
+CHINESE_RUN_PATTERN = re.compile(r'[\u4e00-\u9fa5]+')
+
+DEFAULT_SCROLLBACK_LINES = 10000 # 日志区域默认保留在内存中的最大行数
+HISTORY_PAGE_LINES = 1000 # 历史查看器每次从日志文件加载的行数
+HISTORY_MAX_LINES = 5000  # 历史查看器同时保留在内存中的最大行数
+RECENT_RUNS_SHOWN = 10    # 运行统计提示中列出的最近运行次数
+PENDING_COMPACT_CHARS = 256 * 1024 # 未打开页面的输出缓冲合并、截断的最小间隔（字符）
+
+
+def format_run_record(record):
+    """把一次运行的统计记录格式化为一行简短的说明。"""
+    parts = [f"耗时 {record['wall']:.2f}秒"]
+    if record['cpu_user'] is not None:
+        parts.append(f"CPU {record['cpu_user']:.2f}+{record['cpu_sys']:.2f}秒")
+    if record['peak_rss']:
+        parts.append(f"峰值内存 {record['peak_rss'] / 1048576:.1f}MB")
+    if record['read_bytes'] is not None:
+        parts.append(f"磁盘 读{record['read_bytes'] / 1048576:.1f}MB/写{record['write_bytes'] / 1048576:.1f}MB")
+    parts.append(f"输出 {record['output_bytes'] / 1024:.1f}KB/{record['output_lines']}行")
+    if record['spawn_latency'] is not None:
+        parts.append(f"启动延迟 {record['spawn_latency'] * 1000:.0f}毫秒")
+    return "  ".join(parts)
+
+
+def format_next_run(timestamp):
+    """把下次定时运行的时间戳格式化为简短的说明，当天只显示时间。"""
+    moment = datetime.fromtimestamp(timestamp)
+    return moment.strftime('%H:%M:%S' if moment.date() == datetime.now().date() else '%m-%d %H:%M:%S')
+
+
+class PendingLog:
+    """还没有打开过的脚本页面的输出缓冲，不创建任何控件。
+
+    输出按merge_output的约定合并，只保留最后max_lines行（0表示不限制），
+    与页面创建后日志区域保留的内容一致。合并在缓冲翻倍时才进行，总开销与输出量成正比。
+    """
+    def __init__(self, max_lines):
+        self.max_lines = max_lines
+        self.chunks = []
+        self.size = 0
+        self.compact_at = PENDING_COMPACT_CHARS
+
+    def append(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.compact_at:
+            self.compact()
+            self.compact_at = max(PENDING_COMPACT_CHARS, self.size * 2)
+
+    def compact(self):
+        text = merge_output(self.chunks)
+        if self.max_lines:
+            cut = len(text)
+            for _ in range(self.max_lines):
+                cut = text.rfind('\n', 0, cut)
+                if cut == -1:
+                    break
+            if cut >= 0:
+                text = text[cut + 1:]
+        self.chunks = [text]
+        self.size = len(text)
+
+    def take(self):
+        self.compact()
+        return self.chunks[0]
+
+
+class _BlockGeneration(QTextBlockUserData):
+    """记录文本块最后一次按哪一代字体设置完成了格式化。"""
+    def __init__(self, generation):
+        super().__init__()
+        self.generation = generation
 
-        # 设置子进程的环境变量，强制其输出为UTF-8，解决中文乱码问题
-        env = QProcessEnvironment.systemEnvironment()
-        env.insert("PYTHONIOENCODING", "utf-8")
-        process.setProcessEnvironment(env)
 
-        # 连接信号和槽
-        process.readyReadStandardOutput.connect(lambda: self.handle_stdout(script_id))
-        process.readyReadStandardError.connect(lambda: self.handle_stderr(script_id))
-        process.finished.connect(lambda code, status: self.on_finished(script_id, code, status))
-        process.start(PYTHON_EXECUTABLE, arguments)
+class ChineseFontHighlighter(QSyntaxHighlighter):
+    """在日志区域的布局层为中文字符应用中文字体，不修改文档内容。
 
-        print(f"'{script_path_str}' 已启动。")
-        return True
+    更换字体时只重新格式化视口内的块，其余块在滚动进入视野时才按需更新，
+    因此耗时与可见行数成正比，而不是与日志总长度成正比。
+    """
+    def __init__(self, log_display, zh_format):
+        super().__init__(log_display.document())
+        self.log_display = log_display
+        self.zh_format = zh_format
+        self.generation = 0
+        log_display.verticalScrollBar().valueChanged.connect(self.rehighlight_visible)
 
-    @Slot(str)
-    def stop_script(self, script_id):
-        """通过脚本ID停止正在运行的脚本。"""
-        if script_id in self.processes and self.processes[script_id]['process'].state() != QProcess.ProcessState.NotRunning:
-            self.log_message.emit(script_id, f"--- 正在终止脚本: {self.processes[script_id]['name']} ---\n")
-            self.processes[script_id]['process'].kill()
-            return True
-        return False
-
-    def handle_stdout(self, script_id):
-        if script_id in self.processes:
-            process = self.processes[script_id]['process']
-            data = process.readAllStandardOutput().data().decode('utf-8', errors='ignore')
-            self.log_message.emit(script_id, data)
-
-    def handle_stderr(self, script_id):
-        if script_id in self.processes:
-            process = self.processes[script_id]['process']
-            data = process.readAllStandardError().data().decode('utf-8', errors='ignore')
-            self.log_message.emit(script_id, data)
-
-    def on_finished(self, script_id, exit_code, exit_status):
-        status_text = "正常退出" if exit_status == QProcess.ExitStatus.NormalExit else "崩溃"
-        script_name = self.processes[script_id]['name']
-        self.log_message.emit(script_id, f"\n--- 脚本运行结束 (退出码: {exit_code}, 状态: {status_text}) ---\n")
-        self.finished_message.emit(script_id, f"{script_name} 脚本运行结束 (退出码: {exit_code}, 状态: {status_text})")
-        if script_id in self.processes:
-            del self.processes[script_id]
-
-
-class Server(QObject):
-    """一个简单的TCP服务器，用于监听特定消息。"""
-    trigger_script = Signal(str, list) # 触发信号，参数为脚本路径和参数列表
-
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self._server = QTcpServer(self)
-        self._server.newConnection.connect(self.on_new_connection)
-        self.message_map = {config['msg'].decode('utf-8'): {'script': config['script'], 'args': config.get('args', [])} for config in SCRIPTS_CONFIG}
+    def highlightBlock(self, text):
+        for match in CHINESE_RUN_PATTERN.finditer(text):
+            self.setFormat(match.start(), match.end() - match.start(), self.zh_format)
+        self.setCurrentBlockUserData(_BlockGeneration(self.generation))
 
-    def start(self):
-        if not self._server.listen(QHostAddress(HOST), PORT):
-            print(f"错误: 无法在端口 {PORT} 上启动服务器。")
-            return False
-        print(f"正在监听 {self._server.serverAddress().toString()}:{self._server.serverPort()}...")
-        return True
+    def set_zh_format(self, zh_format):
+        """切换中文格式，只立即更新可见区域。"""
+        self.zh_format = zh_format
+        self.generation += 1
+        self.rehighlight_visible()
 
-    def stop(self):
-        self._server.close()
-        print("服务器已停止。")
+    @Slot()
+    def rehighlight_visible(self):
+        """重新格式化视口内仍使用旧字体设置的块。"""
+        viewport = self.log_display.viewport()
+        block = self.log_display.cursorForPosition(QPoint(0, 0)).block()
+        last = self.log_display.cursorForPosition(QPoint(0, viewport.height())).block()
+        while block.isValid():
+            data = block.userData()
+            if data is None or data.generation != self.generation:
+                self.rehighlightBlock(block)
+            if block == last:
+                break
+            block = block.next()
+
+
+class LogHistoryViewer(QDialog):
+    """分页浏览某次运行的完整日志文件。
+
+    日志文件通过mmap映射，只把当前窗口内的若干页解码后放进控件。
+    滚动到顶部时加载更早的一页，滚动到底部时加载更新的一页，
+    超过HISTORY_MAX_LINES的行会从另一端丢弃。
+    """
+    def __init__(self, log_path, font, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"历史输出 - {log_path.name}")
+        self.resize(800, 600)
+        self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+
+        self._file = open(log_path, 'rb')
+        self._map = None
+        self._loading = False
+        self.line_offsets = deque() # 已加载的每一行在文件中的起始偏移
+
+        layout = QVBoxLayout(self)
+        self.view = QPlainTextEdit()
+        self.view.setReadOnly(True)
+        self.view.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.view.setFont(font)
+        layout.addWidget(self.view)
+
+        # 初始只加载文件末尾的完整行
+        data = self.mapped()
+        self.start_offset = self.end_offset = data.rfind(b'\n') + 1 if data else 0
+        self.load_before()
+        scrollbar = self.view.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+        scrollbar.valueChanged.connect(self.on_scrolled)
+        self.finished.connect(self.release)
+
+    def mapped(self):
+        """返回覆盖整个日志文件的mmap，文件增长后重新映射。文件为空时返回None。"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size and (self._map is None or len(self._map) < size):
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def decode_lines(self, start, end):
+        """解码文件中[start, end)范围内的完整行，返回(每行起始偏移列表, 文本)。"""
+        chunk = self.mapped()[start:end]
+        offsets = [start]
+        for line in chunk.split(b'\n')[:-1]:
+            offsets.append(offsets[-1] + len(line) + 1)
+        offsets.pop()
+        text = collapse_carriage_returns(chunk[:-1].decode('utf-8', errors='replace')).lstrip('\r')
+        return offsets, text
+
+    def load_before(self):
+        """在顶部插入start_offset之前的一页。"""
+        data = self.mapped()
+        if not data or self.start_offset <= 0:
+            return
+        start = self.start_offset
+        for _ in range(HISTORY_PAGE_LINES):
+            if start <= 0:
+                break
+            start = data.rfind(b'\n', 0, start - 1) + 1
+        offsets, text = self.decode_lines(start, self.start_offset)
+
+        self._loading = True
+        cursor = QTextCursor(self.view.document())
+        cursor.movePosition(QTextCursor.MoveOperation.Start)
+        cursor.insertText(text + '\n' if self.line_offsets else text)
+        self.line_offsets.extendleft(reversed(offsets))
+        self.start_offset = start
+
+        # 超出上限时丢弃底部的行
+        excess = len(self.line_offsets) - HISTORY_MAX_LINES
+        if excess > 0:
+            document = self.view.document()
+            block = document.findBlockByNumber(document.blockCount() - excess)
+            cursor.setPosition(block.position() - 1)
+            cursor.movePosition(QTextCursor.MoveOperation.End, QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+            self.end_offset = self.line_offsets[-excess]
+            for _ in range(excess):
+                self.line_offsets.pop()
+        self.view.verticalScrollBar().setValue(len(offsets))
+        self._loading = False
+
+    def load_after(self):
+        """在底部追加end_offset之后的一页（只包含已经写完整的行）。"""
+        data = self.mapped()
+        if not data:
+            return
+        end = self.end_offset
+        for _ in range(HISTORY_PAGE_LINES):
+            newline = data.find(b'\n', end)
+            if newline == -1:
+                break
+            end = newline + 1
+        if end == self.end_offset:
+            return
+        offsets, text = self.decode_lines(self.end_offset, end)
+
+        self._loading = True
+        scrollbar = self.view.verticalScrollBar()
+        value = scrollbar.value()
+        cursor = QTextCursor(self.view.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText('\n' + text if self.line_offsets else text)
+        self.line_offsets.extend(offsets)
+        self.end_offset = end
+
+        # 超出上限时丢弃顶部的行
+        excess = len(self.line_offsets) - HISTORY_MAX_LINES
+        if excess > 0:
+            block = self.view.document().findBlockByNumber(excess)
+            cursor.setPosition(0)
+            cursor.setPosition(block.position(), QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+            self.start_offset = self.line_offsets[excess]
+            for _ in range(excess):
+                self.line_offsets.popleft()
+            value -= excess
+        scrollbar.setValue(value)
+        self._loading = False
+
+    @Slot(int)
+    def on_scrolled(self, value):
+        if self._loading:
+            return
+        scrollbar = self.view.verticalScrollBar()
+        if value == scrollbar.minimum():
+            self.load_before()
+        elif value == scrollbar.maximum():
+            self.load_after()
 
     @Slot()
-    def on_new_connection(self):
-        socket = self._server.nextPendingConnection()
-        if socket:
-            socket.readyRead.connect(lambda: self.on_ready_read(socket))
-            socket.disconnected.connect(socket.deleteLater)
-            print("客户端已连接。")
-
-    def on_ready_read(self, socket):
-        data = socket.readAll().data().decode('utf-8').strip()
-        print(f"收到数据: {data}")
-        if data in self.message_map: # 比较字符串
-            script_info = self.message_map[data]
-            script_to_run = script_info['script']
-            args_to_run = script_info['args']
-            print(f"收到消息 '{data}'! 正在触发脚本: {script_to_run} 带参数: {args_to_run}")
-            self.trigger_script.emit(script_to_run, args_to_run)
-            socket.write(f"确认: 已触发 {Path(script_to_run).name}。\n".encode('utf-8'))
-        else:
-            socket.write("错误: 无效消息。\n".encode('utf-8'))
-        socket.disconnectFromHost()
+    def release(self):
+        """关闭查看器时释放mmap和文件句柄。"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
 
 
 class MainWindow(QMainWindow):
+    run_requested = Signal(str, list, str) # 脚本路径, 参数列表, 凭据
+    stop_requested = Signal(str)           # 脚本ID
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("后台脚本守护程序")
@@ -173,39 +291,48 @@ class MainWindow(QMainWindow):
         # --- 主窗口和布局 ---
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
-        layout = QVBoxLayout(central_widget)
-
-        # --- 用于管理多个脚本的Tab窗口 ---
-        self.tab_widget = QTabWidget()
-        layout.addWidget(self.tab_widget)
-
-        self.tabs_info = {} # 脚本ID -> {log_display, button, index}
+        layout = QHBoxLayout(central_widget)
+
+        # --- 左侧为可搜索的脚本列表，右侧为选中脚本的页面 ---
+        # 页面在第一次被选中时才创建，配置了大量脚本时启动快、占用内存少
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("搜索脚本名称或路径")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.apply_filter)
+        self.running_only = QCheckBox("只显示运行中")
+        self.running_only.toggled.connect(self.apply_filter)
+        self.script_list = QListWidget()
+
+        list_layout = QVBoxLayout()
+        list_layout.addWidget(self.search_box)
+        list_layout.addWidget(self.running_only)
+        list_layout.addWidget(self.script_list)
+        layout.addLayout(list_layout, 1)
+
+        self.page_stack = QStackedWidget()
+        self.page_stack.addWidget(QLabel("在左侧选择一个脚本查看输出", alignment=Qt.AlignmentFlag.AlignCenter))
+        layout.addWidget(self.page_stack, 4)
+
+        self.tabs_info = {} # 脚本ID -> 脚本状态；log_display等页面控件在页面创建后才加入
+        self.en_font = QFont() # 缓存的英文字体，避免每条日志都读取QSettings
+        self.zh_font = QFont() # 缓存的中文字体
+        self.zh_format = QTextCharFormat() # 缓存的中文格式，新建页面的高亮器直接使用
 
         for config in SCRIPTS_CONFIG:
             script_path = config['script']
             script_id = str(Path(script_path).absolute())
-            tab_name = config['name']
-            args = config.get('args', []) # 获取参数，如果不存在则为空列表
-
-            tab = QWidget()
-            tab_layout = QVBoxLayout(tab)
-
-            run_button = QPushButton(f"运行 {tab_name}")
-            run_button.clicked.connect(lambda _, s=script_id: self.toggle_script(s))
-
-            log_display = QTextEdit()
-            log_display.setReadOnly(True)
-            log_display.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
-            log_display.setStyleSheet("background-color: #F5F5DC;") # 设置米色背景
-
-            tab_layout.addWidget(run_button)
-            tab_layout.addWidget(log_display)
-
-            index = self.tab_widget.addTab(tab, tab_name)
-            self.tabs_info[script_id] = {"log_display": log_display, "button": run_button, "index": index, "path": script_path, "args": args}
-
-        # --- UI创建后加载设置 ---
+            item = QListWidgetItem(config['name'], self.script_list)
+            item.setData(Qt.ItemDataRole.UserRole, script_id)
+            item.setToolTip(script_path)
+            self.tabs_info[script_id] = {"name": config['name'], "path": script_path, "args": config.get('args', []), "item": item,
+                                         "scrollback": config.get('scrollback_lines', DEFAULT_SCROLLBACK_LINES),
+                                         "page": None, "pending": None, "active": False, "running": 0, "queued": 0, "next_run": 0.0,
+                                         "recent_runs": deque(maxlen=RECENT_RUNS_SHOWN)}
+        self.script_list.currentItemChanged.connect(self.on_script_selected)
+
+        # --- UI创建后加载设置，然后打开第一个脚本的页面 ---
         self.load_settings()
+        self.script_list.setCurrentRow(0)
 
         # --- 设置菜单栏 ---
         menu_bar = self.menuBar()
@@ -219,8 +346,6 @@ class MainWindow(QMainWindow):
         zh_font_action.triggered.connect(lambda: self.select_font('zh'))
         settings_menu.addAction(zh_font_action)
 
-        self.apply_fonts()
-
         # --- 系统托盘图标 ---
         self.tray_icon = QSystemTrayIcon(self)
         # 程序会使用同目录下的 icon.png 文件作为图标
@@ -250,70 +375,168 @@ class MainWindow(QMainWindow):
         self.tray_icon.activated.connect(self.on_tray_icon_activated)
 
         # --- 核心逻辑 ---
+        # 脚本运行和TCP服务器放在单独的线程中，读取子进程管道不受界面绘制影响；
+        # 与它们的交互全部通过排队的信号进行
+        self.io_thread = QThread(self)
         self.server = None
         self.runner = ScriptRunner()
+        self.runner.moveToThread(self.io_thread)
         self.runner.setup_error.connect(self.show_error_message)
         self.runner.started_message.connect(self.mark_tab_as_running)
-        self.runner.log_message.connect(self.append_log_message)
+        self.runner.output_ready.connect(self.drain_output)
         self.runner.finished_message.connect(self.handle_script_finished)
-
-        if ENABLE_TCP_SERVER:
-            self.server = Server()
+        self.runner.queue_changed.connect(self.update_queue_status)
+        self.runner.run_recorded.connect(self.show_run_record)
+        self.runner.scheduler.next_run_changed.connect(self.show_next_run)
+        self.run_requested.connect(self.runner.run_script)
+        self.stop_requested.connect(self.runner.stop_script)
+        self.io_thread.started.connect(self.runner.start)
+
+        if ENABLE_TCP_SERVER or LOCAL_SOCKET:
+            self.server = Server(stats=self.runner.stats, streams=self.runner.streams, cache=self.runner.results, load=self.runner.load)
+            self.server.moveToThread(self.io_thread)
             self.server.trigger_script.connect(self.runner.run_script)
-            if not self.server.start():
-                QMessageBox.critical(self, "服务器错误", f"无法在端口 {PORT} 上启动服务器。应用程序即将退出。")
-                # 使用QTimer在显示消息框后干净地退出
-                QTimer.singleShot(0, self.quit_application)
+            self.server.trigger_input.connect(self.runner.run_script)
+            self.runner.ticket_resolved.connect(self.server.on_ticket_resolved)
+            self.runner.stream_updated.connect(self.server.on_stream_updated)
+            self.server.start_failed.connect(self.on_server_start_failed)
+            self.io_thread.started.connect(self.server.start)
+        self.io_thread.start()
+
+    @Slot(str)
+    def on_server_start_failed(self, error):
+        QMessageBox.critical(self, "服务器错误", f"{error}应用程序即将退出。")
+        # 使用QTimer在显示消息框后干净地退出
+        QTimer.singleShot(0, self.quit_application)
 
     def toggle_script(self, script_id):
         """根据脚本的当前状态启动或停止它。"""
-        if script_id in self.runner.processes and self.runner.processes[script_id]['process'].state() != QProcess.ProcessState.NotRunning:
-            # 脚本正在运行，所以停止它
-            self.runner.stop_script(script_id)
+        script_info = self.tabs_info[script_id]
+        if script_info['running'] or script_info['queued']:
+            # 脚本正在运行或排队，所以停止它
+            self.stop_requested.emit(script_id)
         else:
             # 脚本未运行，所以启动它
-            script_info = self.tabs_info[script_id]
-            self.runner.run_script(script_info['path'], script_info['args'])
+            self.run_requested.emit(script_info['path'], script_info['args'], '')
+
+    def on_script_selected(self, current, previous):
+        """切换到选中脚本的页面，第一次选中时创建页面。"""
+        if current is None:
+            self.page_stack.setCurrentIndex(0)
+            return
+        script_id = current.data(Qt.ItemDataRole.UserRole)
+        if self.tabs_info[script_id]['page'] is None:
+            self.build_page(script_id)
+        self.page_stack.setCurrentWidget(self.tabs_info[script_id]['page'])
+
+    def build_page(self, script_id):
+        """创建脚本的页面控件，页面创建前缓冲的输出会一次性放进日志区域。"""
+        info = self.tabs_info[script_id]
+        page = QWidget()
+        page_layout = QVBoxLayout(page)
+
+        run_button = QPushButton()
+        run_button.clicked.connect(lambda _, s=script_id: self.toggle_script(s))
+
+        history_button = QPushButton("历史输出")
+        history_button.clicked.connect(lambda _, s=script_id: self.show_history(s))
+
+        log_display = QTextEdit()
+        log_display.setReadOnly(True)
+        log_display.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        log_display.setStyleSheet("background-color: #F5F5DC;") # 设置米色背景
+        # 限制内存中保留的行数，更早的输出只保存在运行日志文件中
+        log_display.document().setMaximumBlockCount(info['scrollback'])
+        log_display.setFont(self.en_font)
+
+        highlighter = ChineseFontHighlighter(log_display, self.zh_format)
+
+        queue_label = QLabel(f"运行中: {info['running']}  排队: {info['queued']}")
+        stats_label = QLabel("尚无运行统计")
+        schedule_label = QLabel()
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(run_button, 1)
+        button_layout.addWidget(queue_label)
+        button_layout.addWidget(schedule_label)
+        button_layout.addWidget(history_button)
+        page_layout.addLayout(button_layout)
+        page_layout.addWidget(stats_label)
+        page_layout.addWidget(log_display)
+
+        self.page_stack.addWidget(page)
+        info.update(page=page, log_display=log_display, highlighter=highlighter, button=run_button,
+                    queue_label=queue_label, stats_label=stats_label, schedule_label=schedule_label)
+        self.refresh_run_button(script_id)
+        self.refresh_next_run(script_id)
+        self.refresh_stats_label(script_id)
+        if info['pending'] is not None:
+            pending, info['pending'] = info['pending'], None
+            self.append_log_message(script_id, pending.take())
+
+    @Slot()
+    def apply_filter(self):
+        """按搜索文本（匹配名称或路径，不区分大小写）和“只显示运行中”筛选脚本列表。"""
+        for info in self.tabs_info.values():
+            self.update_list_item(info)
+
+    def update_list_item(self, info):
+        query = self.search_box.text().strip().lower()
+        visible = not query or query in info['name'].lower() or query in info['path'].lower()
+        if self.running_only.isChecked():
+            visible = visible and info['active']
+        info['item'].setHidden(not visible)
+
+    def show_history(self, script_id):
+        """打开查看器浏览该脚本最近一次运行的完整日志。"""
+        log_path = self.runner.log_paths.get(script_id)
+        if not log_path or not log_path.exists():
+            QMessageBox.information(self, "历史输出", "该脚本还没有运行日志。")
+            return
+        viewer = LogHistoryViewer(log_path, self.en_font, self)
+        viewer.show()
+
+    @Slot()
+    def drain_output(self):
+        """取走运行线程积压的全部输出，界面繁忙时积压的输出会合并成一次插入。"""
+        for script_id, message in self.runner.output.take():
+            self.append_log_message(script_id, message)
 
-    @Slot(str, str)
     def append_log_message(self, script_id, message):
         if script_id not in self.tabs_info:
             print(f"警告: 收到未知脚本ID的日志: {script_id}")
             return
 
-        log_display = self.tabs_info[script_id]["log_display"]
+        info = self.tabs_info[script_id]
+        if info['page'] is None:
+            # 页面还没打开过，只缓冲文本，不创建控件
+            if info['pending'] is None:
+                info['pending'] = PendingLog(info['scrollback'])
+            info['pending'].append(message)
+            return
+
+        log_display = info["log_display"]
 
         # --- 智能滚动逻辑 ---
         # 检查滚动条是否在底部，以决定是否需要自动滚动
         scrollbar = log_display.verticalScrollBar()
         is_at_bottom = scrollbar.value() >= scrollbar.maximum() - 5 # -5 作为容差
 
-        # --- 字体处理 ---
-        # 获取保存的字体设置
-        en_font = self.settings.value("logFont_en", QFont())
-        zh_font = self.settings.value("logFont_zh", QFont())
-
         # 获取文本光标并移动到文档末尾
         cursor = log_display.textCursor()
         cursor.movePosition(QTextCursor.End)
 
         # 检查是否是行内更新（如tqdm进度条）
         if message.startswith('\r'):
-            # 这是一个行内更新
+            # 这是一个行内更新：以'\r'开头的文本替换当前最后一行
             # 移动到当前块（行）的开始
-            cursor.movePosition(QTextCursor.MoveOperation.StartOfLine)
+            cursor.movePosition(QTextCursor.MoveOperation.StartOfBlock)
             # 选中到文档末尾（即选中当前最后一行）
             cursor.movePosition(QTextCursor.MoveOperation.End, QTextCursor.MoveMode.KeepAnchor)
             # 删除选中的文本
             cursor.removeSelectedText()
-            # 加一个回车
-            if message.endswith('\n'):
-                message = message + '\n'
-            self.insert_formatted_text(cursor, message, en_font, zh_font)
-        else:
-            # 这是普通日志或进度条的最后一次输出（通常带'\n'）
-            # 直接插入文本，保留其原始格式
-            self.insert_formatted_text(cursor, message, en_font, zh_font)
+        # 插入普通日志、进度条的新状态或最后一次输出（通常带'\n'）
+        self.insert_text(cursor, message)
         
         # 如果之前就在底部，则新消息到来后继续滚动到底部。
         # 注意：ensureCursorVisible()有时因事件循环时序问题不可靠，直接操作滚动条更稳妥。
@@ -323,62 +546,45 @@ class MainWindow(QMainWindow):
     @Slot()
     def select_font(self, lang):
         """打开字体对话框以选择英文字体('en')或中文字体('zh')。"""
-        current_tab_widget = self.tab_widget.currentWidget()
-        if not current_tab_widget: return
-        log_display = current_tab_widget.findChild(QTextEdit)
-        if not log_display: return
-
         setting_key = f"logFont_{lang}"
         dialog_title = "选择英文字体" if lang == 'en' else "选择中文字体"
 
-        # 从设置中加载当前字体，如果不存在则使用默认字体
-        current_font = self.settings.value(setting_key, QFont())
+        current_font = self.en_font if lang == 'en' else self.zh_font
 
         ok, font = QFontDialog.getFont(current_font, self, dialog_title)
         if ok:
             self.settings.setValue(setting_key, font)
+            if lang == 'en':
+                self.en_font = font
+            else:
+                self.zh_font = font
             self.apply_fonts()
 
     def load_settings(self):
         """在应用程序启动时加载设置。"""
+        # 加载字体，如果未设置则使用默认值
+        self.en_font = self.settings.value("logFont_en", QFont())
+        self.zh_font = self.settings.value("logFont_zh", QFont())
         self.apply_fonts()
 
     def apply_fonts(self):
-        """将所选字体应用于所有日志显示区域。"""
-        # 加载字体，如果未设置则使用默认值
-        en_font = self.settings.value("logFont_en", QFont()) # 加载已保存的字体，如果找不到则使用默认值
-        zh_font = self.settings.value("logFont_zh", QFont()) # 加载已保存的字体，如果找不到则使用默认值
+        """将缓存的字体应用于所有已创建的日志显示区域，之后创建的页面直接使用缓存的字体。
+
+        英文字体作为日志区域的基础字体；中文字体由各页面的高亮器在布局层应用，
+        已有的文本不会被清空重建，行内进度状态也会保留。
+        """
+        self.zh_format = QTextCharFormat()
+        self.zh_format.setFontFamilies([self.zh_font.family()])
 
         for info in self.tabs_info.values():
-            log_display = info["log_display"]
-            # 1. 设置基础字体为英文字体
-            log_display.setFont(en_font)
-
-            # 2. 重新渲染已有文本以应用中文字体
-            # 获取所有现有文本，然后使用新的字体设置重新插入
-            current_text = log_display.toPlainText()
-            log_display.clear()
-            cursor = log_display.textCursor()
-            self.insert_formatted_text(cursor, current_text, en_font, zh_font)
-
-    def insert_formatted_text(self, cursor, text, en_font, zh_font):
-        """将文本插入QTextCursor，为中文字符和非中文字符应用不同的字体。"""
-        import re
-        # 正则表达式匹配中文字符
-        chinese_char_pattern = re.compile(r'[\u4e00-\u9fa5]')
-
-        # 将文本转换为HTML，为中文字符包裹特定的字体span
-        html_parts = []
-        for char in text:
-            if chinese_char_pattern.match(char):
-                # 对中文字符使用中文字体
-                html_parts.append(f'<span style="font-family: \'{zh_font.family()}\';">{char}</span>')
-            else:
-                # 对非中文字符使用默认（英文）字体
-                html_parts.append(char)
-        
-        # 插入HTML
-        cursor.insertHtml("".join(html_parts).replace('\n', '<br>'))
+            if info['page'] is not None:
+                info["log_display"].setFont(self.en_font)
+                info["highlighter"].set_zh_format(self.zh_format)
+
+    def insert_text(self, cursor, text):
+        """将文本插入QTextCursor，中文字体由高亮器负责应用。"""
+        # QTextCursor.insertText会把'\r'当作分段符，这里统一去掉
+        cursor.insertText(text.replace('\r\n', '\n').replace('\r', ''))
 
     def show_error_message(self, script_id, message):
         self.tray_icon.showMessage("错误", message, QSystemTrayIcon.Critical)
@@ -386,25 +592,73 @@ class MainWindow(QMainWindow):
 
     @Slot(str)
     def mark_tab_as_running(self, script_id):
-        """将对应于script_id的标签页标记为正在运行（例如，红色文本）。"""
+        """将脚本在列表中标记为正在运行（红色文本），按钮改为停止。"""
         if script_id in self.tabs_info:
-            index = self.tabs_info[script_id]['index']
-            button = self.tabs_info[script_id]['button']
-            tab_name = self.tab_widget.tabText(index)
-            button.setText(f"停止 {tab_name}")
-            button.setStyleSheet("background-color: #FFDDDD; color: black;") # 淡红色背景，黑色文字
-            self.tab_widget.tabBar().setTabTextColor(index, Qt.red)
+            info = self.tabs_info[script_id]
+            info['active'] = True
+            info['item'].setForeground(Qt.red)
+            self.update_list_item(info)
+            self.refresh_run_button(script_id)
 
     def mark_tab_as_finished(self, script_id):
-        """当脚本完成时，将标签页颜色重置为默认值。"""
+        """当脚本完成时，将列表中的颜色和按钮恢复为默认值。"""
         if script_id in self.tabs_info:
-            index = self.tabs_info[script_id]['index']
-            button = self.tabs_info[script_id]['button']
-            tab_name = self.tab_widget.tabText(index)
-            button.setText(f"运行 {tab_name}")
-            button.setStyleSheet("") # 恢复默认样式
-            default_color = QApplication.palette().color(QPalette.ColorRole.WindowText)
-            self.tab_widget.tabBar().setTabTextColor(index, default_color)
+            info = self.tabs_info[script_id]
+            info['active'] = False
+            info['item'].setForeground(QApplication.palette().color(QPalette.ColorRole.WindowText))
+            self.update_list_item(info)
+            self.refresh_run_button(script_id)
+
+    def refresh_run_button(self, script_id):
+        info = self.tabs_info[script_id]
+        if info['page'] is None:
+            return
+        if info['active']:
+            info['button'].setText(f"停止 {info['name']}")
+            info['button'].setStyleSheet("background-color: #FFDDDD; color: black;") # 淡红色背景，黑色文字
+        else:
+            info['button'].setText(f"运行 {info['name']}")
+            info['button'].setStyleSheet("") # 恢复默认样式
+
+    @Slot(str, int, int)
+    def update_queue_status(self, script_id, running, queued):
+        """更新脚本正在运行和排队的实例数。"""
+        if script_id in self.tabs_info:
+            info = self.tabs_info[script_id]
+            info.update(running=running, queued=queued)
+            if info['page'] is not None:
+                info['queue_label'].setText(f"运行中: {running}  排队: {queued}")
+
+    @Slot(str, float)
+    def show_next_run(self, script_id, timestamp):
+        """记录脚本下次定时运行的时间，显示在页面和列表项的提示中。"""
+        if script_id in self.tabs_info:
+            self.tabs_info[script_id]['next_run'] = timestamp
+            self.refresh_next_run(script_id)
+
+    def refresh_next_run(self, script_id):
+        info = self.tabs_info[script_id]
+        text = f"下次定时运行: {format_next_run(info['next_run'])}" if info['next_run'] else ""
+        info['item'].setToolTip(f"{info['path']}\n{text}" if text else info['path'])
+        if info['page'] is not None:
+            info['schedule_label'].setText(text)
+            info['schedule_label'].setVisible(bool(text))
+
+    @Slot(str, dict)
+    def show_run_record(self, script_id, record):
+        """记录一次运行的资源统计，页面中显示最近一次，提示中列出最近几次运行。"""
+        if script_id not in self.tabs_info:
+            return
+        self.tabs_info[script_id]['recent_runs'].append(record)
+        self.refresh_stats_label(script_id)
+
+    def refresh_stats_label(self, script_id):
+        info = self.tabs_info[script_id]
+        if info['page'] is None or not info['recent_runs']:
+            return
+        info['stats_label'].setText(f"上次运行: {format_run_record(info['recent_runs'][-1])}")
+        info['stats_label'].setToolTip("\n".join(
+            f"#{run['run_id']} 退出码 {run['exit_code']}  {format_run_record(run)}" for run in reversed(info['recent_runs'])))
 
     @Slot(QSystemTrayIcon.ActivationReason)
     def on_tray_icon_activated(self, reason):
@@ -436,14 +690,21 @@ class MainWindow(QMainWindow):
     @Slot(str, str)
     def handle_script_finished(self, script_id, message):
         """处理脚本完成时的所有操作：重置标签页颜色并显示通知。"""
-        self.mark_tab_as_finished(script_id)
+        if not self.tabs_info.get(script_id, {}).get('running'):
+            # 同一脚本还有其他实例在运行时保持运行状态
+            self.mark_tab_as_finished(script_id)
         self.tray_icon.showMessage("任务完成", message, QSystemTrayIcon.MessageIcon.Information, 5000)
         QApplication.beep()
 
     def quit_application(self):
         """正确清理并退出应用程序。"""
-        if self.server:
-            self.server.stop()
+        if self.io_thread.isRunning():
+            # 在运行线程中停止服务器和脚本，然后结束线程
+            if self.server:
+                QMetaObject.invokeMethod(self.server, "stop", Qt.ConnectionType.BlockingQueuedConnection)
+            QMetaObject.invokeMethod(self.runner, "shutdown", Qt.ConnectionType.BlockingQueuedConnection)
+            self.io_thread.quit()
+            self.io_thread.wait()
         self.tray_icon.hide()
         QApplication.quit()
 
@@ -0,0 +1,134 @@
+# 无界面守护程序入口：只使用QtCore/QtNetwork，适合没有显示器的服务器
+import sys
+import signal
+import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from PySide6.QtCore import QCoreApplication, QObject, Slot, QTimer
+
+# 先导入daemon_core：第一次运行时它会从config_sample.py创建config.py，之后再读取配置
+from daemon_core import config, SCRIPTS_CONFIG, ENABLE_TCP_SERVER, PORT, LOCAL_SOCKET, LOG_DIR, ScriptRunner, Server
+
+HEADLESS_LOG_MAX_BYTES = getattr(config, "HEADLESS_LOG_MAX_BYTES", 10 * 1024 * 1024) # 单个日志文件的最大字节数
+HEADLESS_LOG_BACKUPS = getattr(config, "HEADLESS_LOG_BACKUPS", 5) # 每个脚本保留的轮转日志数量
+
+
+class HeadlessConsole(QObject):
+    """把脚本输出按行写入每个脚本的轮转日志文件，并同时打印到标准输出。"""
+
+    def __init__(self, runner, echo=True, parent=None):
+        super().__init__(parent)
+        self.echo = echo
+        self.names = {}        # 脚本ID -> 显示名称
+        self.loggers = {}      # 脚本ID -> logging.Logger
+        self.pending_lines = {} # 脚本ID -> 尚未以换行结束的当前行
+
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        formatter = logging.Formatter("%(asctime)s %(message)s")
+        for script_config in SCRIPTS_CONFIG:
+            script_path = Path(script_config['script'])
+            script_id = str(script_path.absolute())
+            handler = RotatingFileHandler(LOG_DIR / f"{script_path.stem}.log", maxBytes=HEADLESS_LOG_MAX_BYTES,
+                                          backupCount=HEADLESS_LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(formatter)
+            logger = logging.getLogger(f"daemon.{script_path.stem}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            self.names[script_id] = script_config['name']
+            self.loggers[script_id] = logger
+
+        self.runner = runner
+        runner.output_ready.connect(self.drain_output)
+        runner.setup_error.connect(self.on_setup_error)
+        runner.finished_message.connect(self.on_finished)
+
+    @Slot()
+    def drain_output(self):
+        for script_id, message in self.runner.output.take():
+            self.on_log_message(script_id, message)
+
+    def on_log_message(self, script_id, message):
+        if script_id not in self.loggers:
+            print(f"警告: 收到未知脚本ID的日志: {script_id}")
+            return
+        if message.startswith('\r'):
+            # 行内更新（如tqdm进度条）覆盖当前行，只记录最终状态
+            self.pending_lines.pop(script_id, None)
+            message = message[1:]
+        *lines, rest = (self.pending_lines.pop(script_id, '') + message).split('\n')
+        for line in lines:
+            self.write_line(script_id, line)
+        if rest:
+            self.pending_lines[script_id] = rest
+
+    def write_line(self, script_id, line):
+        self.loggers[script_id].info(line)
+        if self.echo:
+            print(f"[{self.names[script_id]}] {line}", flush=True)
+
+    @Slot(str, str)
+    def on_setup_error(self, script_id, message):
+        print(message, file=sys.stderr)
+
+    @Slot(str, str)
+    def on_finished(self, script_id, message):
+        rest = self.pending_lines.pop(script_id, None)
+        if rest:
+            self.write_line(script_id, rest)
+
+
+def option_value(argv, name, default):
+    """返回命令行中"name 值"的值，没有该选项时返回default。"""
+    if name in argv[:-1]:
+        return argv[argv.index(name) + 1]
+    return default
+
+
+def main(argv=None):
+    """以无界面模式运行守护程序，返回进程退出码。
+
+    --port 端口 和 --socket 路径 覆盖配置中的PORT和LOCAL_SOCKET，便于在一台机器上用同一份配置启动多个实例（例如测试分派）。
+    """
+    argv = sys.argv if argv is None else argv
+    try:
+        port = int(option_value(argv, "--port", PORT))
+    except ValueError:
+        print("错误: --port 应为整数。", file=sys.stderr)
+        return 2
+    local_socket = option_value(argv, "--socket", LOCAL_SOCKET)
+    app = QCoreApplication(argv)
+
+    # Ctrl+C/SIGTERM时正常退出；定时器让Python解释器有机会处理信号
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: app.quit())
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
+
+    runner = ScriptRunner(write_run_logs=False)
+    HeadlessConsole(runner, echo="--quiet" not in argv, parent=app) # 归应用所有，随应用存活
+    app.aboutToQuit.connect(runner.shutdown)
+    runner.start()
+
+    server = None
+    if ENABLE_TCP_SERVER or local_socket:
+        server = Server(stats=runner.stats, streams=runner.streams, cache=runner.results, load=runner.load,
+                        port=port, local_socket=local_socket)
+        server.trigger_script.connect(runner.run_script)
+        server.trigger_input.connect(runner.run_script)
+        runner.ticket_resolved.connect(server.on_ticket_resolved)
+        runner.stream_updated.connect(server.on_stream_updated)
+        if not server.start():
+            print("程序即将退出。", file=sys.stderr)
+            return 1
+        app.aboutToQuit.connect(server.stop)
+    else:
+        print("警告: TCP服务器和本地套接字都已禁用，无界面模式下只能通过定时和文件触发运行脚本。")
+
+    return app.exec()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# 脚本进程的资源限制：CPU亲和性、nice、ionice、内存和CPU时间上限
+# 用法: python process_limits.py 脚本 [参数 ...]，限制由环境变量DAEMON_PROCESS_LIMITS传入（见encode_limits），
+# 在本进程中应用后再以__main__身份运行脚本。预热解释器(warm_worker.py)在启动时调用apply_limits。
+# 这个文件在每个受限脚本的进程中导入，会拖慢冷启动的模块（json、re、platform、runpy等）都不要导入。
+import os
+import sys
+import math
+
+LIMITS_ENV = "DAEMON_PROCESS_LIMITS"
+IONICE_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+CPU_TIME_GRACE = 5 # 超过cpu_time_limit时先收到SIGXCPU，再过这么多秒CPU时间由内核强制结束
+LIMIT_VALUES = {'cpu_affinity': lambda text: [int(cpu) for cpu in text.split(',')], 'nice': int,
+                'ionice_class': str, 'ionice_level': int, 'memory_limit_bytes': int, 'cpu_time_limit': float}
+# ioprio_set的系统调用号，标准库没有提供ionice
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'arm64': 30,
+                       'armv7l': 314, 'ppc64le': 273, 's390x': 282, 'riscv64': 30}
+CHILD_OPTIONS = ('cpu_affinity', 'nice', 'ionice_class', 'memory_limit_bytes', 'cpu_time_limit') # 在脚本进程中应用的限制
+
+
+def parse_cpu_list(value):
+    """把CPU编号列表或"0-3,6"形式的字符串解析为排好序的编号列表。"""
+    if isinstance(value, str):
+        cpus = set()
+        for part in value.split(','):
+            start, _, end = part.strip().partition('-')
+            try:
+                cpus.update(range(int(start), int(end or start) + 1))
+            except ValueError:
+                raise ValueError(f"cpu_affinity '{value}' 格式无效") from None
+    else:
+        cpus = set(value)
+    if not cpus or not all(isinstance(cpu, int) and cpu >= 0 for cpu in cpus):
+        raise ValueError(f"cpu_affinity '{value}' 应为非负整数的列表或 \"0-3,6\" 形式的字符串")
+    return sorted(cpus)
+
+
+def parse_limits(config):
+    """从脚本配置中读取进程限制，没有配置任何限制时返回None，配置无效时抛出ValueError。"""
+    keys = CHILD_OPTIONS + ('ionice_level', 'process_group', 'stop_timeout')
+    if not any(config.get(key) is not None for key in keys):
+        return None
+    limits = {'cpu_affinity': None, 'nice': None, 'ionice_class': None, 'ionice_level': None,
+              'memory_limit_bytes': None, 'cpu_time_limit': None,
+              'process_group': bool(config.get('process_group', False)), 'stop_timeout': config.get('stop_timeout', 0)}
+    if config.get('cpu_affinity') is not None:
+        limits['cpu_affinity'] = parse_cpu_list(config['cpu_affinity'])
+    nice = config.get('nice')
+    if nice is not None:
+        if not (isinstance(nice, int) and -20 <= nice <= 19):
+            raise ValueError(f"nice '{nice}' 应为 -20 到 19 之间的整数")
+        limits['nice'] = nice
+    ionice_class = config.get('ionice_class')
+    ionice_level = config.get('ionice_level')
+    if ionice_class is not None or ionice_level is not None:
+        ionice_class = ionice_class or 'best-effort'
+        if ionice_class not in IONICE_CLASSES:
+            raise ValueError(f"ionice_class '{ionice_class}' 应为 {'/'.join(IONICE_CLASSES)}")
+        level = 4 if ionice_level is None else ionice_level
+        if not (isinstance(level, int) and 0 <= level <= 7):
+            raise ValueError(f"ionice_level '{level}' 应为 0 到 7 之间的整数")
+        limits['ionice_class'], limits['ionice_level'] = ionice_class, level
+    for key in ('memory_limit_bytes', 'cpu_time_limit'):
+        value = config.get(key)
+        if value is not None:
+            if not (isinstance(value, (int, float)) and value > 0):
+                raise ValueError(f"{key} '{value}' 应为正数")
+            limits[key] = value
+    if not (isinstance(limits['stop_timeout'], (int, float)) and limits['stop_timeout'] >= 0):
+        raise ValueError(f"stop_timeout '{limits['stop_timeout']}' 应为非负数")
+    return limits
+
+
+def has_child_limits(limits):
+    """是否有需要在脚本进程中应用的限制（进程组和终止方式由守护程序处理）。"""
+    return limits is not None and any(limits[key] is not None for key in CHILD_OPTIONS)
+
+
+def encode_limits(limits):
+    """把需要在脚本进程中应用的限制编码为"键=值;..."，解码不需要导入json。"""
+    values = {key: limits[key] for key in LIMIT_VALUES if limits.get(key) is not None}
+    if values.get('cpu_affinity') is not None:
+        values['cpu_affinity'] = ','.join(map(str, values['cpu_affinity']))
+    return ';'.join(f"{key}={value}" for key, value in values.items())
+
+
+def decode_limits(text):
+    limits = {}
+    for item in filter(None, text.split(';')):
+        key, _, value = item.partition('=')
+        limits[key] = LIMIT_VALUES[key](value)
+    return limits
+
+
+def ioprio_set(ionice_class, level):
+    import ctypes
+    number = IOPRIO_SET_SYSCALLS.get(os.uname().machine.lower())
+    if not sys.platform.startswith('linux') or number is None:
+        raise OSError("当前平台不支持ionice")
+    libc = ctypes.CDLL(None, use_errno=True)
+    # ioprio_set(IOPRIO_WHO_PROCESS=1, 0表示本进程, 类别<<13 | 级别)
+    if libc.syscall(number, 1, 0, (IONICE_CLASSES[ionice_class] << 13) | level) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def apply_limits(limits):
+    """在当前进程中应用限制，之后启动的子进程会继承它们。无法应用的限制只打印警告，不影响脚本运行。"""
+    steps = []
+    if limits.get('cpu_affinity') is not None:
+        steps.append(('cpu_affinity', lambda: os.sched_setaffinity(0, limits['cpu_affinity'])))
+    if limits.get('nice') is not None:
+        # nice是目标值而不是增量，守护程序本身以nice运行时也不会叠加
+        steps.append(('nice', lambda: os.setpriority(os.PRIO_PROCESS, 0, limits['nice'])))
+    if limits.get('ionice_class') is not None:
+        steps.append(('ionice', lambda: ioprio_set(limits['ionice_class'], limits['ionice_level'])))
+    if limits.get('memory_limit_bytes') is not None or limits.get('cpu_time_limit') is not None:
+        def set_rlimits():
+            import resource
+            if limits.get('memory_limit_bytes') is not None:
+                memory = int(limits['memory_limit_bytes'])
+                resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+            if limits.get('cpu_time_limit') is not None:
+                seconds = math.ceil(limits['cpu_time_limit'])
+                resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + CPU_TIME_GRACE))
+        steps.append(('rlimit', set_rlimits))
+    for name, step in steps:
+        try:
+            step()
+        except (OSError, ValueError, AttributeError, ImportError) as e:
+            print(f"警告: 无法应用 {name} 限制: {e}", file=sys.stderr)
+
+
+def main():
+    apply_limits(decode_limits(os.environ.pop(LIMITS_ENV, '')))
+    script = sys.argv[1]
+    sys.argv = sys.argv[1:]
+    sys.path[0] = os.path.dirname(script)
+    with open(script, 'rb') as f:
+        code = compile(f.read(), script, 'exec', dont_inherit=True)
+    # 与直接运行一致，脚本在新的__main__模块中运行（pickle等按sys.modules['__main__']查找的代码也能找到脚本定义的类）；
+    # 不使用runpy，它的导入会让每次冷启动慢约10毫秒。SystemExit会照常决定进程的退出码
+    module = type(sys)('__main__')
+    module.__file__ = script
+    module.__builtins__ = __builtins__
+    sys.modules['__main__'] = module
+    exec(code, module.__dict__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# 运行统计：每次运行的资源占用、守护程序自身的延迟分布，以及导出为JSON/Prometheus文本
+import os
+import sys
+import bisect
+import threading
+from collections import deque
+
+try:
+    import resource
+except ImportError: # Windows没有resource模块
+    resource = None
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def read_proc_usage(pid):
+    """从/proc读取进程累计的CPU时间、峰值内存和磁盘I/O字节数。
+
+    只在Linux上可用，进程已退出或没有/proc时返回None；
+    没有权限读取/proc/<pid>/io时I/O字段为None。
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+        # 进程名可能包含空格和括号，从最后一个')'之后开始按空格切分，第一个字段是state(3)
+        fields = stat[stat.rindex(b')') + 2:].split()
+        usage = {'cpu_user': int(fields[11]) / CLOCK_TICKS, 'cpu_sys': int(fields[12]) / CLOCK_TICKS,
+                 'peak_rss': None, 'read_bytes': None, 'write_bytes': None}
+        with open(f'/proc/{pid}/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    usage['peak_rss'] = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError, IndexError):
+        return None
+    try:
+        with open(f'/proc/{pid}/io', 'rb') as f:
+            for line in f:
+                key, _, value = line.partition(b':')
+                if key in (b'read_bytes', b'write_bytes'):
+                    usage[key.decode()] = int(value)
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def children_usage():
+    """返回本进程已回收的子进程（及其等待过的后代）累计的资源占用，不支持时返回None。"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'cpu_user': usage.ru_utime, 'cpu_sys': usage.ru_stime,
+            # Linux上ru_maxrss的单位是KB，macOS上是字节；它是所有已回收子进程中的最大值，不是累计值
+            'peak_rss': usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+            'read_bytes': usage.ru_inblock * 512, 'write_bytes': usage.ru_oublock * 512}
+
+
+class Histogram:
+    """固定桶的累计直方图，与Prometheus的histogram类型对应。"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # 最后一个是超过所有上限的
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append([bound if bound != float('inf') else '+Inf', total])
+        return {'buckets': cumulative, 'sum': round(self.sum, 6), 'count': self.count}
+
+
+class RunStatistics:
+    """按脚本保存最近若干次运行的记录和延迟直方图，可以从多个线程访问。
+
+    记录由运行线程写入，界面刷新延迟由界面线程写入，查询可以来自任意线程。
+    """
+
+    def __init__(self, names, history=50):
+        self.names = dict(names) # 脚本ID -> 显示名称
+        self.lock = threading.Lock()
+        self.history_limit = history
+        self.history = {script_id: deque(maxlen=history) for script_id in self.names}
+        self.totals = {script_id: {'runs': 0, 'failed': 0} for script_id in self.names}
+        self.latency = {} # (指标名, 脚本ID) -> Histogram
+
+    def record_run(self, script_id, record):
+        with self.lock:
+            self.history.setdefault(script_id, deque(maxlen=self.history_limit)).append(record)
+            totals = self.totals.setdefault(script_id, {'runs': 0, 'failed': 0})
+            totals['runs'] += 1
+            if record['status'] != 'finished' or record['exit_code'] != 0:
+                totals['failed'] += 1
+
+    def observe(self, metric, script_id, seconds):
+        with self.lock:
+            histogram = self.latency.get((metric, script_id))
+            if histogram is None:
+                histogram = self.latency[(metric, script_id)] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self, script_ids=None, with_history=False):
+        """返回可以直接序列化为JSON的统计数据，以脚本名称为键。"""
+        with self.lock:
+            result = {}
+            for script_id in script_ids or self.names:
+                runs = list(self.history.get(script_id, ()))
+                entry = dict(self.totals.get(script_id, {'runs': 0, 'failed': 0}))
+                entry['last'] = runs[-1] if runs else None
+                walls = [run['wall'] for run in runs]
+                entry['wall_avg'] = round(sum(walls) / len(walls), 3) if walls else None
+                entry['wall_max'] = max(walls) if walls else None
+                entry['latency'] = {metric: histogram.snapshot() for (metric, sid), histogram in self.latency.items() if sid == script_id}
+                if with_history:
+                    entry['history'] = runs
+                result[self.names.get(script_id, script_id)] = entry
+            return result
+
+
+# 每次运行记录中导出为Prometheus指标的字段：字段名 -> (指标名, 说明)
+LAST_RUN_METRICS = {
+    'wall': ('daemon_last_run_wall_seconds', "最近一次运行的耗时"),
+    'cpu_user': ('daemon_last_run_cpu_user_seconds', "最近一次运行的用户态CPU时间"),
+    'cpu_sys': ('daemon_last_run_cpu_system_seconds', "最近一次运行的内核态CPU时间"),
+    'peak_rss': ('daemon_last_run_peak_rss_bytes', "最近一次运行的峰值常驻内存"),
+    'read_bytes': ('daemon_last_run_read_bytes', "最近一次运行从磁盘读取的字节数"),
+    'write_bytes': ('daemon_last_run_write_bytes', "最近一次运行写入磁盘的字节数"),
+    'output_bytes': ('daemon_last_run_output_bytes', "最近一次运行输出的字节数"),
+    'output_lines': ('daemon_last_run_output_lines', "最近一次运行输出的行数"),
+    'exit_code': ('daemon_last_run_exit_code', "最近一次运行的退出码"),
+}
+
+# 结果缓存的计数 -> (指标名, 类型, 说明)，只导出启用了cache_ttl的脚本
+CACHE_METRICS = {
+    'hits': ('daemon_cache_hits_total', 'counter', "直接用缓存结果回复的触发次数"),
+    'misses': ('daemon_cache_misses_total', 'counter', "没有可用的缓存结果而运行脚本的触发次数"),
+    'joined': ('daemon_cache_joined_total', 'counter', "合并到排队或运行中的相同请求的触发次数"),
+    'expired': ('daemon_cache_expired_total', 'counter', "查询时发现已过期而删除的缓存结果数"),
+    'evictions': ('daemon_cache_evictions_total', 'counter', "超出条目上限而淘汰的缓存结果数"),
+    'entries': ('daemon_cache_entries', 'gauge', "当前缓存的结果数"),
+}
+
+# 延迟直方图的指标名 -> 说明
+LATENCY_HELP = {
+    'spawn_latency': "从收到触发到脚本进程启动的延迟",
+    'flush_latency': "从读到脚本输出到界面取走输出的延迟",
+}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(snapshot):
+    """把snapshot()的结果转换为Prometheus文本格式。"""
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+
+    scripts = list(snapshot.items())
+    family('daemon_runs_total', 'counter', "脚本运行次数",
+           [f'daemon_runs_total{{script="{_label(name)}"}} {entry["runs"]}' for name, entry in scripts])
+    family('daemon_runs_failed_total', 'counter', "退出码非0或崩溃的运行次数",
+           [f'daemon_runs_failed_total{{script="{_label(name)}"}} {entry["failed"]}' for name, entry in scripts])
+    for field, (metric, help_text) in LAST_RUN_METRICS.items():
+        family(metric, 'gauge', help_text,
+               [f'{metric}{{script="{_label(name)}"}} {entry["last"][field]}' for name, entry in scripts
+                if entry['last'] and entry['last'].get(field) is not None])
+    for field, (metric, kind, help_text) in CACHE_METRICS.items():
+        samples = [f'{metric}{{script="{_label(name)}"}} {entry["cache"][field]}' for name, entry in scripts if 'cache' in entry]
+        if samples:
+            family(metric, kind, help_text, samples)
+    metrics = sorted({metric for _, entry in scripts for metric in entry['latency']})
+    for metric in metrics:
+        name = f"daemon_{metric}_seconds"
+        samples = []
+        for script, entry in scripts:
+            histogram = entry['latency'].get(metric)
+            if not histogram:
+                continue
+            label = f'script="{_label(script)}"'
+            samples += [f'{name}_bucket{{{label},le="{bound}"}} {count}' for bound, count in histogram['buckets']]
+            samples += [f'{name}_sum{{{label}}} {histogram["sum"]}', f'{name}_count{{{label}}} {histogram["count"]}']
+        family(name, 'histogram', LATENCY_HELP.get(metric, metric), samples)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,195 @@
+# 定时触发：按固定间隔或cron表达式触发脚本，所有定时任务共用一个定时器
+import math
+import time
+import heapq
+import random
+import itertools
+from datetime import datetime, timedelta
+
+from PySide6.QtCore import QObject, Signal, Slot, QTimer, Qt
+
+MAX_TIMER_WAIT = 60.0 # 定时器单次等待的最长秒数，到时重新按系统时钟计算，系统时间被调整后也能及时纠正
+
+# cron表达式各字段的取值范围：分钟、小时、日、月、星期（0和7都表示星期日）
+CRON_FIELDS = (('分钟', 0, 59), ('小时', 0, 23), ('日', 1, 31), ('月', 1, 12), ('星期', 0, 7))
+CRON_MACROS = {
+    '@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *', '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0', '@daily': '0 0 * * *', '@midnight': '0 0 * * *', '@hourly': '0 * * * *',
+}
+CRON_SEARCH_YEARS = 5 # 查找下次运行时间的范围，超出说明表达式永远不会匹配（例如2月30日）
+
+
+def parse_cron_field(text, name, low, high):
+    """解析cron表达式的一个字段，支持 *、数字、a-b、逗号分隔的列表和 /步长，返回取值集合。"""
+    values = set()
+    for part in text.split(','):
+        part, _, step = part.partition('/')
+        try:
+            step = int(step) if step else 1
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = int(part)
+                end = high if step != 1 else start # "5/15"表示从5开始每15
+        except ValueError:
+            raise ValueError(f"{name}字段 '{text}' 格式无效") from None
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"{name}字段 '{text}' 超出范围 {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """标准的5字段cron表达式（分 时 日 月 星期），按本地时间计算。
+
+    日和星期都不是 * 时，满足其中之一即可（与cron相同）。也支持@hourly、@daily等简写。
+    """
+
+    def __init__(self, text):
+        self.text = text
+        fields = CRON_MACROS.get(text.strip(), text).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式 '{text}' 应有5个字段")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_cron_field(field, *spec) for field, spec in zip(fields, CRON_FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+
+    def day_matches(self, moment):
+        in_days = moment.day in self.days
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays # Python的星期一为0，cron的星期日为0
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """返回moment之后第一个匹配的时刻（datetime），永远不会匹配时返回None。
+
+        不匹配的月、日、小时整体跳过，最多循环几百次。
+        """
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * CRON_SEARCH_YEARS)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+
+def parse_schedule(config):
+    """从脚本配置中读取定时设置，没有配置定时时返回None，配置无效时抛出ValueError。"""
+    interval = config.get('schedule_interval')
+    cron = config.get('schedule_cron')
+    if interval is None and cron is None:
+        return None
+    if interval is not None and cron is not None:
+        raise ValueError("schedule_interval和schedule_cron只能配置一个")
+    if interval is not None and not (isinstance(interval, (int, float)) and interval > 0):
+        raise ValueError(f"schedule_interval '{interval}' 应为正数")
+    jitter = config.get('schedule_jitter', 0)
+    if not (isinstance(jitter, (int, float)) and jitter >= 0):
+        raise ValueError(f"schedule_jitter '{jitter}' 应为非负数")
+    return {'script': config['script'], 'args': config.get('args', []), 'name': config['name'],
+            'interval': interval, 'cron': CronExpression(cron) if cron is not None else None,
+            'jitter': jitter, 'skip_if_running': config.get('schedule_skip_if_running', True)}
+
+
+class Scheduler(QObject):
+    """按脚本配置定时触发脚本。
+
+    所有定时任务放在一个按到期时间排列的堆中，只用一个定时器等待最早到期的任务，
+    定时任务再多也只有一个定时器，每次触发的开销为O(log n)。到期时间按系统时钟计算。
+    is_busy(脚本ID)返回True且配置了schedule_skip_if_running时跳过这次触发。
+    """
+    trigger_script = Signal(str, list, str) # 与Server.trigger_script相同，连接到ScriptRunner.run_script
+    next_run_changed = Signal(str, float)   # 脚本ID，下次运行的时间戳（0表示不会再运行）
+
+    def __init__(self, script_configs, is_busy, parent=None):
+        super().__init__(parent)
+        self.is_busy = is_busy
+        self.schedules = {} # 脚本ID -> 定时设置
+        for script_id, config in script_configs.items():
+            try:
+                schedule = parse_schedule(config)
+            except ValueError as e:
+                print(f"警告: '{config['name']}' 的定时配置无效，已忽略: {e}")
+                continue
+            if schedule is not None:
+                self.schedules[script_id] = schedule
+        self.heap = []      # [到期时间戳, 序号, 脚本ID, 不含随机延迟的计划时间]
+        self.next_runs = {} # 脚本ID -> 下次运行的时间戳
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer) # 只有一个定时器，精确计时的开销可以忽略
+        self.timer.timeout.connect(self.fire_due)
+        self._seq = itertools.count()
+
+    @Slot()
+    def start(self):
+        """计算所有定时任务的首次运行时间并开始计时，应在所属线程中调用。"""
+        now = time.time()
+        for script_id, schedule in self.schedules.items():
+            self.push(script_id, self.next_planned(schedule, now))
+        self.rearm()
+
+    @Slot()
+    def stop(self):
+        self.timer.stop()
+
+    def next_planned(self, schedule, now, previous=None):
+        """返回下一次计划运行的时间戳，不会再运行时返回None。固定间隔以上次计划时间为基准，不会累积漂移。"""
+        interval = schedule['interval']
+        if interval is not None:
+            if previous is None:
+                return now + interval
+            planned = previous + interval
+            if planned <= now:
+                # 错过的周期（例如系统休眠）不补跑
+                planned += math.ceil((now - planned) / interval) * interval
+            return planned
+        moment = schedule['cron'].next_after(datetime.fromtimestamp(max(now, previous or now)))
+        return moment.timestamp() if moment else None
+
+    def push(self, script_id, planned):
+        schedule = self.schedules[script_id]
+        if planned is None:
+            print(f"警告: '{schedule['name']}' 的定时配置不会再匹配任何时间。")
+            self.next_runs.pop(script_id, None)
+            self.next_run_changed.emit(script_id, 0.0)
+            return
+        due = planned + random.uniform(0, schedule['jitter']) if schedule['jitter'] else planned
+        heapq.heappush(self.heap, [due, next(self._seq), script_id, planned])
+        self.next_runs[script_id] = due
+        self.next_run_changed.emit(script_id, due)
+
+    def rearm(self):
+        if not self.heap:
+            self.timer.stop()
+            return
+        wait = min(max(self.heap[0][0] - time.time(), 0.0), MAX_TIMER_WAIT)
+        self.timer.start(math.ceil(wait * 1000))
+
+    @Slot()
+    def fire_due(self):
+        """触发所有已到期的任务，并安排它们的下一次运行。"""
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, script_id, planned = heapq.heappop(self.heap)
+            schedule = self.schedules[script_id]
+            if schedule['skip_if_running'] and self.is_busy(script_id):
+                print(f"'{schedule['name']}' 仍在运行或排队，跳过这次定时触发。")
+            else:
+                print(f"定时触发: {schedule['name']}")
+                self.trigger_script.emit(schedule['script'], schedule['args'], '')
+            self.push(script_id, self.next_planned(schedule, now, planned))
+        self.rearm()
@@ -4,27 +4,232 @@ import argparse
 import sys
 
 # --- 配置 ---
+import config
 from config import HOST, PORT
 
+SOCKET_PATH = getattr(config, "LOCAL_SOCKET", None) # 配置了本地套接字时默认通过它发送，--tcp 改用TCP
+
+def server_address():
+    return f"本地套接字 {SOCKET_PATH}" if SOCKET_PATH else f"端口 {PORT}"
+
+def connect():
+    """连接到守护程序的本地套接字或TCP端口。"""
+    if SOCKET_PATH:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(str(SOCKET_PATH))
+        except OSError:
+            s.close()
+            raise
+        return s
+    return socket.create_connection((HOST, PORT))
+
+def daemon_client():
+    from daemon_client import DaemonClient
+    return DaemonClient(HOST, PORT, path=SOCKET_PATH or None)
+
 def send_trigger_message(message):
     """连接到监听程序并发送触发消息。"""
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((HOST, PORT))
+        with connect() as s:
             s.sendall(message.encode('utf-8'))
             response = s.recv(1024)
             print(f"已发送消息 '{message}', 收到响应: {response.decode('utf-8').strip()}")
-    except ConnectionRefusedError:
-        print(f"错误: 连接被拒绝。守护程序(gui.py)是否正在端口 {PORT} 上运行?")
+    except (ConnectionRefusedError, FileNotFoundError):
+        print(f"错误: 连接被拒绝。守护程序(gui.py)是否正在{server_address()} 上运行?")
     except Exception as e:
         print(f"发生了一个错误: {e}")
 
+def send_trigger_batch(messages, repeat=1):
+    """通过一个连接以分帧协议连续发送多条触发消息，并逐条打印回复。"""
+    commands = [message for _ in range(repeat) for message in messages]
+    try:
+        with connect() as s:
+            s.sendall("".join(f"#{i} TRIGGER {message}\n" for i, message in enumerate(commands, 1)).encode('utf-8'))
+            with s.makefile('r', encoding='utf-8') as replies:
+                for _ in commands:
+                    reply = replies.readline()
+                    if not reply:
+                        print("错误: 连接在收到全部回复前被关闭。")
+                        break
+                    print(reply.rstrip('\n'))
+    except (ConnectionRefusedError, FileNotFoundError):
+        print(f"错误: 连接被拒绝。守护程序(gui.py)是否正在{server_address()} 上运行?")
+    except Exception as e:
+        print(f"发生了一个错误: {e}")
+
+def open_body(path):
+    """打开请求体文件，'-'表示标准输入（管道的长度事先未知，会先整个读入内存）。"""
+    if path is None:
+        return None
+    if path == '-':
+        return sys.stdin.buffer.read()
+    return open(path, 'rb')
+
+def send_with_payload(message, params, body_path):
+    """通过分帧协议触发脚本，附带参数和请求体。"""
+    from daemon_client import DaemonError
+    body = open_body(body_path)
+    try:
+        with daemon_client() as client:
+            print(f"已发送消息 '{message}', 收到响应: {client.trigger(message, params, body)}")
+    except DaemonError as e:
+        print(f"错误: {e}")
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+def run_and_wait(messages, timeout, params=None, body_path=None):
+    """依次触发脚本并等待运行结束，返回最后一个失败脚本的退出码（全部成功时为0）。"""
+    from daemon_client import DaemonError
+    exit_code = 0
+    with daemon_client() as client:
+        for message in messages:
+            body = open_body(body_path)
+            try:
+                result = client.run(message, timeout, params, body)
+            except DaemonError as e:
+                print(f"'{message}' 未能完成: {e}")
+                exit_code = 1
+                continue
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            print(f"'{message}' 运行结束: {result.status}，退出码 {result.exit_code}{'（缓存结果）' if result.cached else ''}")
+            if result.exit_code != 0:
+                exit_code = result.exit_code
+    return exit_code
+
+def show_stats(messages, prometheus=False):
+    """打印运行统计，没有指定消息时打印所有脚本的汇总。"""
+    import json
+    from daemon_client import DaemonError
+    from run_stats import render_prometheus
+    try:
+        with daemon_client() as client:
+            snapshot = {}
+            for message in messages or ['']:
+                snapshot.update(client.stats(message))
+    except DaemonError as e:
+        print(f"错误: {e}")
+        return 1
+    print(render_prometheus(snapshot) if prometheus else json.dumps(snapshot, ensure_ascii=False, indent=2), end='' if prometheus else '\n')
+    return 0
+
+def show_peers():
+    """打印分派器看到的本机负载和各节点的状态。"""
+    import json
+    from daemon_client import DaemonError
+    try:
+        with daemon_client() as client:
+            snapshot = client.peers()
+    except DaemonError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(snapshot, ensure_ascii=False, indent=2))
+    return 0
+
+def show_result(message):
+    """打印脚本缓存的最近结果和输出，返回缓存结果的退出码。"""
+    from daemon_client import DaemonError
+    try:
+        with daemon_client() as client:
+            result = client.result(message)
+    except DaemonError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    sys.stdout.write(result['output'])
+    truncated = "，输出只保留了末尾" if result['truncated'] else ""
+    print(f"\n[{result['age']:.1f} 秒前的结果: {result['status']}，退出码 {result['exit_code']}{truncated}]", file=sys.stderr)
+    return result['exit_code']
+
+def follow_output(message, offset=None, policy='drop', forever=False):
+    """把脚本的输出实时打印到标准输出。跟随单次运行时返回脚本的退出码。"""
+    from daemon_client import DaemonError
+    clear_line = sys.stdout.isatty()
+    try:
+        for event in daemon_client().follow(message, offset, policy, forever):
+            if event.kind == 'data':
+                text = event.text
+                if clear_line and text.startswith('\r'):
+                    # 替换当前行时先清除它，新内容较短时不会残留旧内容
+                    text = '\r\x1b[K' + text[1:]
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            elif event.kind == 'drop':
+                print(f"\n[读取太慢，跳过了 {event.dropped} 字节的输出]", file=sys.stderr)
+            elif event.kind == 'end' and not forever:
+                return event.exit_code
+    except DaemonError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="向守护程序发送触发消息。",
-        epilog="示例: python send_msg.py RUN_SCRIPT_1ST"
+        epilog="示例: python send_msg.py RUN_SCRIPT_1ST；python send_msg.py --batch RUN_SCRIPT_1ST RUN_SCRIPT_2ND"
     )
-    parser.add_argument("message", help="要发送的秘密消息 (例如: 'RUN_SCRIPT_1ST', 'RUN_SCRIPT_2ND')")
+    parser.add_argument("message", nargs='*', help="要发送的秘密消息 (例如: 'RUN_SCRIPT_1ST', 'RUN_SCRIPT_2ND')")
+    parser.add_argument("--batch", action="store_true", help="通过一个持久连接批量发送所有消息")
+    parser.add_argument("--repeat", type=int, default=1, help="批量模式下每条消息重复发送的次数")
+    parser.add_argument("--wait", action="store_true", help="等待脚本运行结束，并以脚本的退出码退出")
+    parser.add_argument("--timeout", type=float, default=3600, help="--wait 模式下等待的最长秒数")
+    parser.add_argument("--param", action="append", default=[], metavar="键=值",
+                        help="附带参数，脚本中读取环境变量DAEMON_PARAM_<键>，可以指定多次")
+    parser.add_argument("--body", metavar="文件", help="把文件内容写入脚本的标准输入，'-'表示本程序的标准输入")
+    parser.add_argument("--socket", metavar="路径", help="通过该本地套接字连接守护程序（默认为配置中的LOCAL_SOCKET）")
+    parser.add_argument("--tcp", action="store_true", help="即使配置了LOCAL_SOCKET也通过TCP连接")
+    parser.add_argument("--stats", action="store_true", help="查询运行统计（不指定消息时为所有脚本的汇总）")
+    parser.add_argument("--prometheus", action="store_true", help="与--stats一起使用，以Prometheus文本格式输出")
+    parser.add_argument("--peers", action="store_true", help="查看分派模式下本机和各节点的负载与健康状态")
+    parser.add_argument("--result", action="store_true", help="显示脚本缓存的最近结果和输出（脚本需要配置cache_ttl），不会触发脚本")
+    parser.add_argument("--follow", action="store_true",
+                        help="实时显示脚本当前这次运行的输出（没有在运行时等待下一次），并以脚本的退出码退出")
+    parser.add_argument("--forever", action="store_true", help="与--follow一起使用，持续显示之后所有运行的输出，按Ctrl+C结束")
+    parser.add_argument("--offset", type=int, help="与--follow一起使用，从当前运行输出的该字节处开始，负数表示从末尾往前数")
+    parser.add_argument("--slow", choices=['drop', 'disconnect'], default='drop',
+                        help="读取跟不上输出时跳过丢失的部分(drop)还是由守护程序断开(disconnect)")
     args = parser.parse_args()
+    if args.socket and args.tcp:
+        parser.error("--socket 和 --tcp 不能同时使用")
+    if args.tcp:
+        SOCKET_PATH = None
+    elif args.socket:
+        SOCKET_PATH = args.socket
+
+    if args.stats:
+        sys.exit(show_stats(args.message, args.prometheus))
+    elif args.peers:
+        sys.exit(show_peers())
+    elif not args.message:
+        parser.error("需要至少一条消息")
+    elif args.result:
+        if len(args.message) != 1:
+            parser.error("--result 只能指定一条消息")
+        sys.exit(show_result(args.message[0]))
+    elif args.follow:
+        if len(args.message) != 1:
+            parser.error("--follow 只能指定一条消息")
+        sys.exit(follow_output(args.message[0], args.offset, args.slow, args.forever))
+    params = {}
+    for item in args.param:
+        key, separator, value = item.partition('=')
+        if not separator:
+            parser.error(f"--param 应为 键=值 格式: {item}")
+        params[key] = value
+    if args.body == '-' and len(args.message) > 1:
+        parser.error("--body - 只能与一条消息一起使用")
 
-    send_trigger_message(args.message)
\ No newline at end of file
+    if args.wait:
+        sys.exit(run_and_wait(args.message, args.timeout, params, args.body))
+    elif params or args.body is not None:
+        for message in args.message:
+            send_with_payload(message, params, args.body)
+    elif args.batch:
+        send_trigger_batch(args.message, args.repeat)
+    else:
+        for message in args.message:
+            send_trigger_message(message)
@@ -0,0 +1,42 @@
+# 预热的Python解释器：启动时预先导入指定模块，然后等待守护程序下发要运行的脚本
+# 用法: python warm_worker.py [要预先导入的模块 ...]
+import sys
+import os
+import json
+import runpy
+import importlib
+
+from process_limits import LIMITS_ENV, apply_limits, decode_limits
+
+
+def main():
+    # 在预先导入之前应用脚本配置的进程限制，预先导入的CPU时间和内存也计入限制
+    if LIMITS_ENV in os.environ:
+        apply_limits(decode_limits(os.environ.pop(LIMITS_ENV)))
+    for module_name in sys.argv[1:]:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"警告: 预先导入模块 '{module_name}' 失败: {e}", file=sys.stderr)
+
+    # runpy.run_path第一次调用时才导入pkgutil（连同typing约8毫秒），在等待任务之前导入
+    importlib.import_module('pkgutil')
+
+    # 等待守护程序通过标准输入发来一行JSON任务；标准输入关闭表示守护程序已退出。
+    # 从字节缓冲区只读取这一行，其后的数据原样留给脚本（无论它读sys.stdin还是sys.stdin.buffer）
+    line = sys.stdin.buffer.readline()
+    if not line.strip():
+        return
+    job = json.loads(line)
+
+    script = job['script']
+    os.environ.update(job.get('env', {}))
+    os.chdir(job['cwd'])
+    sys.argv = [script] + job.get('args', [])
+    sys.path[0] = os.path.dirname(script)
+    # 与冷启动一致，脚本以__main__身份运行；SystemExit会照常决定进程的退出码
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# 文件触发：监视目录，有新文件时把一批文件交给脚本处理
+import os
+import fnmatch
+from pathlib import Path
+
+from PySide6.QtCore import QObject, Signal, Slot, QTimer, QFileSystemWatcher
+
+DEFAULT_SETTLE_MS = 1000     # 目录最后一次变化后等待多久再处理（毫秒）
+DEFAULT_MAX_DELAY_MS = 10000 # 目录持续变化时，第一次变化后最多等待多久就处理（毫秒）
+DEFAULT_BATCH_FILES = 1000   # 每次运行最多交给脚本的文件数
+WATCH_DELIVERY = ('args', 'stdin')
+
+
+def parse_watch(config):
+    """从脚本配置中读取文件触发设置，没有配置watch时返回None，配置无效时抛出ValueError。"""
+    watch = config.get('watch')
+    if watch is None:
+        return None
+    directories = [watch] if isinstance(watch, (str, Path)) else list(watch)
+    patterns = config.get('watch_patterns', ['*'])
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    delivery = config.get('watch_delivery', 'args')
+    if delivery not in WATCH_DELIVERY:
+        raise ValueError(f"watch_delivery '{delivery}' 应为 {'/'.join(WATCH_DELIVERY)}")
+    settings = {}
+    for key, default in (('watch_settle_ms', DEFAULT_SETTLE_MS), ('watch_max_delay_ms', DEFAULT_MAX_DELAY_MS),
+                         ('watch_batch_files', DEFAULT_BATCH_FILES)):
+        value = config.get(key, default)
+        if not (isinstance(value, int) and value > 0):
+            raise ValueError(f"{key} '{value}' 应为正整数")
+        settings[key] = value
+    return {'script': config['script'], 'args': config.get('args', []), 'name': config['name'],
+            'directories': [str(Path(directory).absolute()) for directory in directories],
+            'patterns': list(patterns), 'delivery': delivery,
+            'settle_ms': settings['watch_settle_ms'], 'max_delay_ms': settings['watch_max_delay_ms'],
+            'batch_files': settings['watch_batch_files']}
+
+
+class DirectoryWatcher(QObject):
+    """监视脚本配置的目录，把新出现的、匹配watch_patterns的文件分批交给脚本。
+
+    目录的变化只重新启动等待定时器，定时器到期时才列出目录、与上次的内容比较，
+    短时间内涌入大量文件也只列出一次目录、运行一次脚本。脚本在运行或排队时新文件继续累积，
+    等它空闲后再交给它，因此运行次数有上限。程序启动时已经存在的文件不会触发。
+    文件路径通过命令行参数（追加在args之后）或标准输入（每行一个）传给脚本。
+    """
+    trigger_script = Signal(str, list, str, object) # 脚本路径、参数、凭据、写入标准输入的bytes，连接到ScriptRunner.run_script
+
+    def __init__(self, script_configs, is_busy, parent=None):
+        super().__init__(parent)
+        self.is_busy = is_busy
+        self.watches = {}     # 脚本ID -> 文件触发设置和状态
+        self.directories = {} # 目录 -> 监视它的脚本ID列表
+        self.known = {}       # 目录 -> 上次列出时的文件名集合
+        self.dirty = set()    # 上次列出之后有变化的目录
+        for script_id, config in script_configs.items():
+            try:
+                watch = parse_watch(config)
+            except ValueError as e:
+                print(f"警告: '{config['name']}' 的文件触发配置无效，已忽略: {e}")
+                continue
+            if watch is None:
+                continue
+            watch['files'] = [] # 等待交给脚本的文件路径
+            watch['settle_timer'] = self.create_timer(watch['settle_ms'], script_id)
+            watch['max_delay_timer'] = self.create_timer(watch['max_delay_ms'], script_id)
+            self.watches[script_id] = watch
+            for directory in watch['directories']:
+                self.directories.setdefault(directory, []).append(script_id)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+
+    def create_timer(self, interval, script_id):
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.setInterval(interval)
+        timer.timeout.connect(lambda: self.flush(script_id))
+        return timer
+
+    @Slot()
+    def start(self):
+        """记录各目录现有的文件并开始监视，应在所属线程中调用。"""
+        for directory in self.directories:
+            try:
+                self.known[directory] = set(os.listdir(directory))
+            except OSError as e:
+                print(f"警告: 无法监视目录 '{directory}': {e}")
+                continue
+            self.watcher.addPath(directory)
+
+    @Slot()
+    def stop(self):
+        for watch in self.watches.values():
+            watch['settle_timer'].stop()
+            watch['max_delay_timer'].stop()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+
+    @Slot(str)
+    def on_directory_changed(self, directory):
+        self.dirty.add(directory)
+        for script_id in self.directories.get(directory, ()):
+            watch = self.watches[script_id]
+            watch['settle_timer'].start() # 每次变化都重新开始等待
+            if not watch['max_delay_timer'].isActive():
+                watch['max_delay_timer'].start()
+
+    def scan(self, directory):
+        """列出有变化的目录，把新文件分给监视它的脚本。"""
+        self.dirty.discard(directory)
+        try:
+            names = set(os.listdir(directory))
+        except OSError as e:
+            print(f"警告: 无法读取目录 '{directory}': {e}")
+            return
+        new_names = sorted(names - self.known.get(directory, set()))
+        self.known[directory] = names # 消失的文件也从集合中移除，同名文件再次出现时会重新触发
+        new_paths = [(name, os.path.join(directory, name)) for name in new_names]
+        new_paths = [(name, path) for name, path in new_paths if os.path.isfile(path)]
+        for script_id in self.directories[directory]:
+            watch = self.watches[script_id]
+            watch['files'].extend(path for name, path in new_paths
+                                  if any(fnmatch.fnmatch(name, pattern) for pattern in watch['patterns']))
+
+    def flush(self, script_id):
+        """等待时间到：列出有变化的目录，再把累积的文件交给脚本。"""
+        watch = self.watches[script_id]
+        watch['settle_timer'].stop()
+        watch['max_delay_timer'].stop()
+        for directory in watch['directories']:
+            if directory in self.dirty:
+                self.scan(directory)
+        self.deliver(script_id)
+
+    def deliver(self, script_id):
+        """脚本空闲时把最多watch_batch_files个文件交给它。"""
+        watch = self.watches[script_id]
+        if not watch['files'] or self.is_busy(script_id):
+            return
+        batch = watch['files'][:watch['batch_files']]
+        del watch['files'][:watch['batch_files']]
+        remaining = f"，还有 {len(watch['files'])} 个等待" if watch['files'] else ""
+        print(f"文件触发: {watch['name']}（{len(batch)} 个文件{remaining}）")
+        if watch['delivery'] == 'stdin':
+            self.trigger_script.emit(watch['script'], watch['args'], '', ('\n'.join(batch) + '\n').encode('utf-8'))
+        else:
+            self.trigger_script.emit(watch['script'], watch['args'] + batch, '', b'')
+
+    @Slot(str, int, int)
+    def on_queue_changed(self, script_id, running, queued):
+        """脚本空闲后交出累积的文件。"""
+        if script_id in self.watches and not running and not queued and self.watches[script_id]['files']:
+            # 推迟到当前信号处理完之后，避免在发出queue_changed的过程中再次发出它，使其他接收方收到的顺序颠倒
+            QTimer.singleShot(0, self, lambda: self.deliver(script_id))